@@ -1,15 +1,29 @@
 
 #! /usr/bin/env python
 import sys
+import time
 from math import log
 from math import exp
 import random
+import argparse
+
+import numpy as np
 
 from utils import Dirichlet, choose
+import sparse_gibbs
+import parallel_gibbs
+import nb_em
+import naive_bayes
+import checkpoint
+import profiling
+from convergence import ConvergenceMonitor
+from metrics import Metrics, JSONLinesSink
+from corpus import Corpus, Vocabulary, HashedVocabulary, concatenate_csr
 
 """
 This programme deals with Gibbs sampling applied to a Naive Bayes classifier.
-Note: Only binary classification is supported.
+Note: By default only binary classification (used_category) is supported; with --all-categories
+every category of the training file is used and the sparse backend samples among K classes.
 
 Reference: 
 Bibtex: @techreport{resnik2010gibbs,
@@ -22,96 +36,65 @@ Bibtex: @techreport{resnik2010gibbs,
 """
 
 """
-Note: vocabulary is a mapping from str to a tuple, in which, the first elements is the word index, 
-and the seconde is the word count
-This means if you want find a word with a specified index , you have to iterate the whole dict, 
-and it becomes much simpler when you have word in string form, like "mini"
+Note: vocabulary is a corpus.Vocabulary (a HashedVocabulary with --hash-bits) shared by the training and the test documents,
+every document is a corpus.Document whose category is its index in used_category
 """
 used_category = ["acq", "alum"] # category used for classification
 
-vocabulary = dict({"a":[0,0]}) # vocabulary for the whole dataset
+vocabulary = Vocabulary() # vocabulary for the whole dataset
+vocabulary.add("a")
 class_map = dict({used_category[0]:0, used_category[1]:1})
     
 logger = open("logger", "w")
 output_file = logger # or output_file = sys.stdout
 
-# Add words in vocabulary
-def add_in_dict(line):
-    doc = line[1: len(line)]
-    for word in doc:
-        if word not in vocabulary:
-            vocabulary[word] = [len(vocabulary), 0]
-        value = vocabulary[word]
-        value[1] = value[1] + 1
-        vocabulary[word] = value
-
 """
-Create index for every document
-Every docuement is associated with a dict, which is defined as str --> [index, count], 
-where str refers to the word, index refers to index in vocabulary, count refers to 
-total count in this document
-
-@return the map for this document
+Load data from a file given the full file path @datafile
+If corpus_cache.py has compiled @datafile, the documents are read from the cache instead.
+Note: Only load the categories in used_category, by default used_category[0] and used_category[1]
+@all_categories load every category found in @datafile, and make them used_category and class_map
+@processes tokenize the file on this many processes (corpus.Corpus.load_parallel)
+@return (doclist, docnum), docnum is the number of documents in each category
 """
-def create_index(line):
-    doc = line[1 : len(line)]
-    docdict = dict()
-    for word in doc:
-        try:
-            value = vocabulary[word]
-        except KeyError:
-            print "Error: word \"" + word + "\" not found in vocabulary!"
-            exit()
-        
-        index = value[0]
-        if word not in docdict:
-            docdict[word] = [index, 0]
-        value = docdict[word]
-        value[1] = value[1] + 1
-        docdict[word] = value
-    
-    return docdict
+def load_data(datafile, all_categories=False, processes=1):
+    corpus = make_corpus(all_categories)
+    corpus.load(datafile, processes=processes)
+    use_categories(corpus, all_categories)
+    return (corpus.documents, tuple(corpus.category_counts()))
 
 """
-Load data from a file given the full file path @datafile
-Note: Only load two categories: used_category[0] and used_category[1]
+Load data from a file as load_data, straight into CSR arrays for the sparse backend: the arrays of a
+corpus cache are memory-mapped rather than copied into Documents (corpus.Corpus.load_csr)
+@return (labels, csr, docnum), labels is the array of the categories of the documents
 """
-def load_data(datafile):
-    docset = []
-    docindexset = []
-    docnum = [0, 0]
-    f = open(datafile, "r")
-    for line in f:  # one document in each line
-        line = line.replace("\t", " ") # raplace \t
-        line = line.replace("\n", "") # remove \n
-        line = line.split(" "); # tokenize the document
-        #print "Line[0]:" + line[0]
-        if line[0] == used_category[0] or line[0] == used_category[1]:
-            cindex = class_map[line[0]]
-            docnum[cindex] = docnum[cindex] + 1
-            add_in_dict(line) # add words in vocabulary
-            docindex = create_index(line) # create index for every word in every document
-            docset.append(line)
-            docindexset.append(docindex)
-    #print docset
-    return (docset, docindexset, tuple(docnum))
+def load_data_csr(datafile, all_categories=False, processes=1):
+    corpus = make_corpus(all_categories)
+    (labels, csr) = corpus.load_csr(datafile, processes=processes)
+    use_categories(corpus, all_categories)
+    return (labels, csr, tuple(np.bincount(labels, minlength=len(corpus.categories)).tolist()))
+
+# corpus of the used categories, or of every category with @all_categories
+def make_corpus(all_categories):
+    if all_categories:
+        return Corpus(vocabulary)
+    return Corpus(vocabulary, used_category)
+
+# with @all_categories, make the categories of @corpus used_category and class_map
+def use_categories(corpus, all_categories):
+    if all_categories:
+        used_category[:] = corpus.categories
+        class_map.clear()
+        class_map.update(corpus.category_map)
 
 """
 Count word for each class
 """
-def count_word(docindexset, labels, word_count):
+def count_word(docset, labels, word_count):
     N = len(labels)
     for i in range(N): # for every document
         label = labels[i]
-        doc = docindexset[i]
-        it = doc.iteritems()
-        try:
-            while 1:
-                (key, value) = it.next()
-                index = value[0]
-                word_count[label][index] = word_count[label][index] + value[1]
-        except StopIteration:
-            pass
+        for (index, count) in docset[i].terms():
+            word_count[label][index] = word_count[label][index] + count
         
 """
 Caculate Pr for each class
@@ -119,42 +102,64 @@ Caculate Pr for each class
 @N number of all the documents
 @index index of the document to be processed
 @hyper_gamma hyperparameter for Gamma distribution
-@theta theta parameters for each class
+@log_theta log of the theta parameters for each class, cached by update_theta
 """    
-def caculate_Pr(c, class_count, N, index, docindexset, hyper_gamma, theta):
+def caculate_Pr(c, class_count, N, index, docset, hyper_gamma, log_theta):
     ln_Pr = log(class_count[c] + hyper_gamma[c] - 1) - log(N + hyper_gamma[0] + hyper_gamma[1] - 1)
-    docindex = docindexset[index]
-    it = docindex.iteritems()
-    try:
-        while 1:
-            (word, t) = it.next()
-            ln_Pr = ln_Pr + t[1] * log(theta[t[0]])
-    except StopIteration:
-        pass
+    for (word_index, count) in docset[index].terms():
+        ln_Pr = ln_Pr + count * log_theta[word_index]
 
     return ln_Pr
     
 """
 Update word count for each class by removing or addint document j
-@docdict the dict for the document j
+@doc the document j
 @c which class
 @sign indicate whether remove(-1) or add(+1)
 @word_count the word count for each class
 """
-def update_word_count(docdict, c, sign, word_count):
-    it = docdict.iteritems()
-    try:
-        while 1:
-            (key, value) = it.next()
-            index = value[0]
-            word_count[c][index] = word_count[c][index] + sign * value[1]
-    except StopIteration:
-        pass
+def update_word_count(doc, c, sign, word_count):
+    for (index, count) in doc.terms():
+        word_count[c][index] = word_count[c][index] + sign * count
+
+"""
+One sweep over the test documents (index trainN..N-1): resample the label of every test document
+@return number of labels changed
+"""
+def sweep(labels, class_count, N, trainN, docset, hyper_gamma, log_theta, word_count):
+    change_count = 0
+    for j in range(trainN, N): # skip training documents
+        label = labels[j]
+        assert(label == 0 or label == 1)
+        class_count[label] = class_count[label] - 1
+        update_word_count(docset[j], label, -1, word_count) # update word count by removing the docuemnt j
+        
+        ln_Pr0 = caculate_Pr(0, class_count, N, j, docset, hyper_gamma, log_theta[0])
+        ln_Pr1 = caculate_Pr(1, class_count, N, j, docset, hyper_gamma, log_theta[1])
+        # sometimes, the probability is very overwhelming
+        if ln_Pr0 - ln_Pr1 > 13.81: # log(999999) \approx 13.815509557963773
+            index = 0
+        elif ln_Pr1 - ln_Pr0 > 13.81:
+            index = 1
+        else:
+            ratio = exp(ln_Pr0 - ln_Pr1)
+            index = choose((0, 1), [ratio, 1]) # choose according a distribution
+        new_label = (0, 1)[index]
+        
+        labels[j] = new_label
+        if label != new_label:
+            change_count = change_count + 1
+        class_count[new_label] = class_count[new_label] + 1
+        update_word_count(docset[j], new_label, +1, word_count) # update word count by adding the docuemnt j
+
+    return change_count
+
 """
 Update theta, the word distribution for two classes
 theta_x ~ Dirichlet(t_x)
+log_theta[x] is refreshed with theta, so caculate_Pr takes no log until the next update
 """    
-def update_theta(docindexset, labels, theta, hyper_multi, word_count):
+def update_theta(docset, labels, theta, hyper_multi, word_count, log_theta):
     N = len(labels) # number of documents
     V = len(vocabulary) # size of vocabulary
     for c in (0, 1): # for class 0 and class 1
@@ -162,6 +167,7 @@ def update_theta(docindexset, labels, theta, hyper_multi, word_count):
         for i in range(V):
             t[i] = word_count[c][i] + hyper_multi[i]
         theta[c] = Dirichlet(t)
+        log_theta[c] = [log(p) for p in theta[c]]
         
 """
 Evaluate the clustering result
@@ -174,9 +180,9 @@ def evaluate_cluster_result(labels, docset, N, docnum):
         doc = docset[i]
         count0 = 0 # count number of used_category[0] docs in cluster 0
         count1 = 0 # count number of used_category[1] docs in cluster 0
-        if labels[i] == 0 and doc[0] == used_category[0]:
+        if labels[i] == 0 and doc.category == 0:
             count0 = count0 + 1
-        elif labels[i] == 0 and doc[0] == used_category[1]:
+        elif labels[i] == 0 and doc.category == 1:
             count1 = count1 + 1
     if count0 > count1:
         sum_count = count0
@@ -196,128 +202,472 @@ def evaluate_cluster_result(labels, docset, N, docnum):
 
 """
 Evaluate classification result
+@test_labels categories of the test documents
 """
-def evaluate_classification(labels, tdocset, N):
-    testN = len(tdocset)
+def evaluate_classification(labels, test_labels, N):
+    testN = len(test_labels)
     trainN = N - testN
     correct = 0 # number of correctly classified
     for i in range(testN):
-        category = tdocset[i][0]
-        if category == used_category[0] or category == used_category[1]:
-            if labels[i+trainN] == class_map[category]:
-                correct = correct + 1
+        if labels[i+trainN] == test_labels[i]:
+            correct = correct + 1
     accuracy = correct * 1.0 / testN
     output_file.write("Classification accuracy: " + str(accuracy) + "\n")
     print "Classification accuracy: " + str(accuracy)
-    
+
+"""
+Evaluator of the classification during sampling, for the metrics of the iterations
+@return function labels --> accuracy on the test documents
+"""
+def accuracy_evaluator(test_labels, trainN):
+    truth = np.asarray(test_labels)
+    def evaluate(labels):
+        return float(np.mean(np.asarray(labels[trainN:]) == truth)) if len(truth) > 0 else 0.0
+    return evaluate
+
+"""
+Metrics of the iterations, with the sinks asked for by @args, and the evaluator of the accuracy
+@return (metrics, evaluate), evaluate is None without evaluation
+"""
+def make_metrics(args, test_labels, trainN, profiler):
+    sinks = []
+    if not args.quiet:
+        sinks.append(text_log_sink)
+    if args.metrics is not None:
+        sinks.append(JSONLinesSink(args.metrics))
+    metrics = Metrics(sinks, args.metrics_every)
+    evaluate = accuracy_evaluator(test_labels, trainN) if args.eval_every > 0 else None
+    if profiler is not None and evaluate is not None:
+        evaluate = profiler.wrap(evaluate, "evaluate")
+    return (metrics, evaluate)
+
+# metrics sink writing the text log of the iterations to output_file and stdout
+def text_log_sink(record):
+    if "log_joint" in record: # written before the header of its iteration, as it always was
+        output_file.write("Log-joint:" + str(record["log_joint"]) + "\n")
+    output_file.write("iteration #" + str(record["iteration"]) + ":\n")
+    output_file.write("Number of changes:" + str(record.get("changes", 0)) + "\n")
+    print "iterationo #:" + str(record["iteration"])
+    if "accuracy" in record:
+        output_file.write("Classification accuracy: " + str(record["accuracy"]) + "\n")
+        print "Classification accuracy: " + str(record["accuracy"])
+
+"""
+Run args.chains independent chains of the sparse backend in parallel and pool their votes
+@csr CSR arrays of the training documents, then of the test documents
+@train_labels labels of the training documents, @test_labels categories of the test documents
+@K number of classes
+"""
+def run_multiple_chains(args, csr, train_labels, test_labels, K, V, T, B, hyper_gamma):
+    hyper_multi = np.ones(V)
+    if args.seed is None:
+        seed = random.randint(0, 2**31 - args.chains)
+    else:
+        seed = args.seed
+    seeds = [seed + k for k in range(args.chains)]
+    print "Start to run " + str(args.chains) + " chains..."
+    start = time.time()
+    votes = parallel_gibbs.run_chains(csr, np.array(train_labels), K, V, T, B, hyper_gamma, hyper_multi,
+                                      seeds, args.collapsed, args.processes)
+    elapsed = time.time() - start
+    print "Chains done in " + str(elapsed) + " seconds."
+    print "Votes per second: " + str(votes.sum() / elapsed)
+
+    trainN = len(train_labels)
+    N = trainN + len(test_labels)
+    labels = [0] * N
+    for k in range(args.chains):
+        labels[trainN:] = list(votes[k].argmax(axis=0))
+        output_file.write("Chain #" + str(k) + " (seed " + str(seeds[k]) + "):\n")
+        evaluate_classification(labels, test_labels, N)
+    agreement = parallel_gibbs.chain_agreement(votes)
+    mean_agreement = (agreement.sum() - args.chains) / (args.chains * (args.chains - 1))
+    print "Mean between-chain agreement: " + str(mean_agreement)
+    output_file.write("Between-chain agreement:\n" + str(agreement) + "\n")
+
+    # pool the votes of all chains
+    class_vote = votes.sum(axis=0)
+    labels[trainN:] = list(class_vote.argmax(axis=0))
+    output_file.write("Results - Labels of testing document:\n")
+    output_file.write(str(labels[trainN: N]) + "\n")
+    evaluate_classification(labels, test_labels, N)
+    output_file.close()
+
+"""
+Label the test documents by semi-supervised EM (nb_em.run_em) instead of sampling, in at most T iterations
+@csr, @train_labels, @test_labels see run_multiple_chains
+@K number of classes
+"""
+def run_expectation_maximisation(args, csr, train_labels, test_labels, K, V, T, hyper_gamma, profiler):
+    trainN = len(train_labels)
+    N = trainN + len(test_labels)
+    labels = np.concatenate([train_labels, np.zeros(N - trainN, dtype=np.int64)])
+    (metrics, evaluate) = make_metrics(args, test_labels, trainN, profiler)
+    last = [time.time()] # end of the previous iteration
+    def iteration(i, posterior, log_posterior, change_count):
+        metrics.count("changes", change_count)
+        metrics.set("log_posterior", log_posterior)
+        start = metrics.lap("em", last[0])
+        if evaluate is not None and (i + 1) % args.eval_every == 0:
+            labels[trainN:] = posterior.argmax(axis=0)
+            metrics.set("accuracy", evaluate(labels))
+            start = metrics.lap("evaluate", start)
+        metrics.end_iteration(i)
+        last[0] = start
+
+    print "Start to iterate..."
+    start = time.time()
+    (posterior, iterations, converged) = nb_em.run_em(csr, train_labels, K, V, T, hyper_gamma, np.ones(V),
+                                                      args.tol, iteration)
+    metrics.close(iterations - 1)
+    if converged:
+        print "Converged after " + str(iterations) + " iterations."
+        output_file.write("Converged after " + str(iterations) + " iterations\n")
+    else:
+        print "Not converged after " + str(iterations) + " iterations."
+    print "EM done in " + str(time.time() - start) + " seconds."
+
+    labels[trainN:] = posterior.argmax(axis=0)
+    output_file.write("Results - Labels of testing document:\n")
+    output_file.write(str(list(labels[trainN: N])) + "\n")
+    evaluate_classification(labels, test_labels, N)
+    output_file.close()
+
+"""
+Copy of the sampler state after iteration @i, for checkpoint.CheckpointWriter
+log_theta is not saved, it is recomputed from theta exactly as update_theta computes it
+@theta is None for the collapsed sampler, @rng is None for the dict backend
+@return dict of name --> array
+"""
+def checkpoint_state(i, T, backend, labels, class_count, word_count, theta, class_vote, rng):
+    state = dict({"iteration": np.array(i), "max_iters": np.array(T), "backend": np.array(backend),
+                  "labels": np.array(labels), "class_count": np.array(class_count),
+                  "word_count": np.array(word_count), "class_vote": np.array(class_vote)})
+    if theta is not None:
+        state["theta"] = np.array(theta)
+    state.update(checkpoint.random_state_arrays(rng))
+    return state
+
 # main loop    
 def main(argv):
+    global vocabulary
 #    print "File to open: " + argv[1]
-    if len(argv) != 4:
-        print "Usage: python ./NB-with-Gibbs.py data_file test_file max_iters"
-        exit()
+    parser = argparse.ArgumentParser(usage="python ./NB-with-Gibbs.py data_file test_file max_iters [options]")
+    parser.add_argument("data_file")
+    parser.add_argument("test_file")
+    parser.add_argument("max_iters", type=int)
+    parser.add_argument("--backend", choices=("dict", "sparse"), default="dict",
+                        help="dict: walk the docdicts (default); sparse: CSR matrix and NumPy arrays")
+    parser.add_argument("--all-categories", action="store_true",
+                        help="classify among all categories of data_file instead of used_category (sparse backend only)")
+    parser.add_argument("--collapsed", action="store_true",
+                        help="integrate theta out and sample labels from the Dirichlet-multinomial predictive (sparse backend only)")
+    parser.add_argument("--chains", type=int, default=1,
+                        help="number of independent chains, run with the sparse backend on a process pool")
+    parser.add_argument("--processes", type=int, default=None,
+                        help="worker processes for --chains (default: number of CPUs)")
+    parser.add_argument("--seed", type=int, default=None,
+                        help="random seed; chain k uses seed + k")
+    parser.add_argument("--hash-bits", type=int, default=None,
+                        help="hash the words into 2^HASH_BITS terms instead of building a vocabulary")
+    parser.add_argument("--load-processes", type=int, default=1,
+                        help="processes tokenizing the data files, 0 for the number of CPUs (default: 1)")
+    parser.add_argument("--em", action="store_true",
+                        help="label the test docs by semi-supervised EM instead of Gibbs sampling, max_iters is a cap (sparse backend only)")
+    parser.add_argument("--tol", type=float, default=nb_em.DEFAULT_TOL,
+                        help="EM stops when the log-posterior changes by less than this, relative to it (default: 1e-6)")
+    parser.add_argument("--checkpoint", default=None,
+                        help="write the state of the chain to this file every --checkpoint-every iterations")
+    parser.add_argument("--checkpoint-every", type=int, default=10,
+                        help="iterations between checkpoints (default: 10)")
+    parser.add_argument("--resume", action="store_true",
+                        help="continue the chain saved in --checkpoint")
+    parser.add_argument("--adaptive", action="store_true",
+                        help="end burn-in and stop once the chain has converged, max_iters is only a cap")
+    parser.add_argument("--window", type=int, default=5,
+                        help="iterations compared by the convergence tests of --adaptive (default: 5)")
+    parser.add_argument("--burnin-tol", type=float, default=0.005,
+                        help="burn-in ends when the rate of label changes drops by less than this per window (default: 0.005)")
+    parser.add_argument("--flip-tol", type=float, default=0.0,
+                        help="largest fraction of test docs changing their majority vote in a settled iteration (default: 0)")
+    parser.add_argument("--margin-tol", type=float, default=0.01,
+                        help="largest mean change of the vote margins in a settled iteration (default: 0.01)")
+    parser.add_argument("--min-samples", type=int, default=10,
+                        help="fewest iterations voted before stopping (default: 10)")
+    parser.add_argument("--log-joint", action="store_true",
+                        help="also wait for the log-joint to level off before ending burn-in (sparse backend, not collapsed)")
+    parser.add_argument("--eval-every", type=int, default=1,
+                        help="evaluate the accuracy every EVAL_EVERY iterations, 0 never (default: 1)")
+    parser.add_argument("--metrics", default=None,
+                        help="write the metrics of the iterations (changes, accuracy, time per phase) to this file as JSON lines")
+    parser.add_argument("--metrics-every", type=int, default=1,
+                        help="iterations summed in one line of metrics and of the text log (default: 1)")
+    parser.add_argument("--quiet", action="store_true",
+                        help="no text log of the iterations in the logger file and on stdout")
+    parser.add_argument("--profile", default=None, metavar="PREFIX",
+                        help="time every phase of the run, print a table and write PREFIX.folded for a flamegraph")
+    parser.add_argument("--profile-iterations", default="",
+                        help="iterations also recorded with cProfile into PREFIX.pstats, e.g. 3,10-12")
+    args = parser.parse_args(argv[1:])
+    if args.resume and args.checkpoint is None:
+        parser.error("--resume needs --checkpoint")
+    if args.checkpoint is not None and args.chains > 1:
+        parser.error("--checkpoint runs a single chain")
+    if args.all_categories and args.backend == "dict" and args.chains == 1:
+        parser.error("--all-categories needs --backend sparse")
+    if args.collapsed and args.backend == "dict" and args.chains == 1:
+        parser.error("--collapsed needs --backend sparse")
+    if args.em and (args.backend != "sparse" or args.collapsed or args.chains > 1 or args.adaptive
+                    or args.checkpoint is not None):
+        parser.error("--em needs --backend sparse, and no --collapsed, --chains, --adaptive nor --checkpoint")
+    if args.em and args.max_iters < 1:
+        parser.error("--em needs max_iters >= 1")
+    if args.adaptive and args.chains > 1:
+        parser.error("--adaptive runs a single chain")
+    if args.log_joint and (not args.adaptive or args.backend != "sparse" or args.collapsed):
+        parser.error("--log-joint needs --adaptive and --backend sparse without --collapsed")
+    if args.profile is not None and args.chains > 1:
+        parser.error("--profile runs a single chain: the chains of --chains run in other processes")
+    profiler = None
+    if args.profile is not None:
+        profiler = profiling.Profiler(profiling.parse_iterations(args.profile_iterations))
+        profiling.instrument(profiler, sys.modules[__name__],
+                             ["load_data", "load_data_csr", "count_word", "sweep", "caculate_Pr", "update_word_count", "choose",
+                              "update_theta", "Dirichlet", "evaluate_classification", "text_log_sink"])
+        profiling.instrument(profiler, sparse_gibbs,
+                             ["build_csr", "count_word_csr", "doc_log_likelihood", "sweep", "update_theta",
+                              "build_expanded", "collapsed_sweep", "record_vote", "log_joint", "count_word_soft"],
+                             "sparse_gibbs.")
+        profiling.instrument(profiler, naive_bayes, ["estimate_multinomial_NB", "posterior_multinomial_NB"],
+                             "naive_bayes.")
+    elif args.profile_iterations:
+        parser.error("--profile-iterations needs --profile")
+    random.seed(args.seed)
+    if args.hash_bits is not None:
+        vocabulary = HashedVocabulary(args.hash_bits)
 
     print "Loading training data..."
-    (docset, docindexset, docnum) = load_data(argv[1])
+    load_processes = args.load_processes or None
+    use_csr = args.backend == "sparse" or args.chains > 1 # the sparse backend needs no Documents
+    if use_csr:
+        (train_labels, train_csr, docnum) = load_data_csr(args.data_file, args.all_categories, load_processes)
+    else:
+        (docset, docnum) = load_data(args.data_file, args.all_categories, load_processes)
+        train_labels = [doc.category for doc in docset]
+    K = len(used_category) # number of classes
     
     # initializations for parameters
-    T = int(argv[3]) # max iterations
-    trainN = len(docset) # number of documents
+    T = args.max_iters # max iterations
+    trainN = len(train_labels) # number of documents
     print "Loading training data done."
-    print "Categories used for classification: " + used_category[0] + " and " + used_category[1]
+    print "Categories used for classification: " + ", ".join(used_category)
     print "Total number of training documents:" + str(trainN)
-    print "Number of training documents in category '" + used_category[0] + "':" + str(docnum[class_map[used_category[0]]])
-    print "Number of training documents in category '" + used_category[1] + "':" + str(docnum[class_map[used_category[1]]])
+    for c in used_category:
+        print "Number of training documents in category '" + c + "':" + str(docnum[class_map[c]])
     
     print "Loading test data..."
-    (tdocset, tdocindexset, tdocnum) = load_data(argv[2])
+    if use_csr:
+        (test_labels, test_csr, tdocnum) = load_data_csr(args.test_file, processes=load_processes)
+    else:
+        (tdocset, tdocnum) = load_data(args.test_file, processes=load_processes)
+        test_labels = [doc.category for doc in tdocset]
     print "Loading test data done."
-    testN = len(tdocset)
+    testN = len(test_labels)
     print "Total number of test documents:" + str(testN)
-    print "Number of test documents in category '" + used_category[0] + "':" + str(tdocnum[class_map[used_category[0]]])
-    print "Number of test documents in category '" + used_category[1] + "':" + str(tdocnum[class_map[used_category[1]]])
+    for c in used_category:
+        print "Number of test documents in category '" + c + "':" + str(tdocnum[class_map[c]])
     V = len(vocabulary) # size of the vocabulary
     print "Size of vocabulary: " + str(V)
     
     #randomly set labels for documents
     N = trainN + testN
-    labels = [0] * N # labes for all documents, 0 or 1
-    class_count = [0, 0] # number of documents in each class
+    labels = [0] * N # labes for all documents, 0..K-1
+    class_count = [0] * K # number of documents in each class
     for i in range(trainN): # assign labels for training doccument
-        category = docset[i][0]
-        labels[i] = class_map[category]
-    for i in range(testN): # randomly assign test document with labels 0 or 1
-        label = random.randint(0, 1)
+        labels[i] = train_labels[i]
+    for i in range(testN): # randomly assign test document with labels 0..K-1
+        label = random.randint(0, K - 1)
         labels[i + trainN] = label
         class_count[label] = class_count[label] + 1
         
-    # count word in each class
-    word_count = [[0]*V, [0]*V]
     # extend training document list with test document
-    docset.extend(tdocset)
-    docindexset.extend(tdocindexset)
-    count_word(docindexset, labels, word_count)
-    
-    hyper_gamma = (2, 2) # parameter for Beta distribution
-    hyper_multi = [1] * V # hyperparameter vector for the multinominal prior
-    # theta0 and theta1 are the multinominal prior for words
-    theta0 = Dirichlet(hyper_multi)
-    theta1 = Dirichlet(hyper_multi)
-    theta = [theta0, theta1]
-    
-    B = T / 3; # B is for burn-in iterations
-    class_vote = [0] * testN # collect vote for every iteration
+    if use_csr:
+        csr = concatenate_csr([train_csr, test_csr])
+    else:
+        docset.extend(tdocset)
+    hyper_gamma = [2] * K # parameter for the Dirichlet prior over classes (Beta for two classes)
+    B = T / 3; # B is for burn-in iterations, decided by the monitor with --adaptive
+    if args.chains > 1:
+        run_multiple_chains(args, csr, labels[:trainN], test_labels, K, V, T, B, hyper_gamma)
+        return
+    if args.em:
+        run_expectation_maximisation(args, csr, np.array(labels[:trainN]), test_labels, K, V, T, hyper_gamma,
+                                     profiler)
+        if profiler is not None:
+            profiler.dump(args.profile)
+        return
+
+    if args.backend == "sparse":
+        rng = np.random.RandomState(args.seed)
+        labels = np.array(labels)
+        class_count = np.array(class_count)
+        # count word in each class
+        word_count = sparse_gibbs.count_word_csr(csr, labels, K, V)
+        hyper_multi = np.ones(V) # hyperparameter vector for the multinominal prior
+        if args.collapsed:
+            class_total = word_count.sum(axis=1) # number of words in each class
+            expanded = sparse_gibbs.build_expanded(csr, trainN, hyper_multi)
+        else:
+            (theta, log_theta) = sparse_gibbs.update_theta(np.zeros((K, V)), hyper_multi, rng)
+        class_vote = np.zeros((K, testN), dtype=np.int64) # votes for every class
+    else:
+        # count word in each class
+        word_count = [[0]*V, [0]*V]
+        count_word(docset, labels, word_count)
+        hyper_multi = [1] * V # hyperparameter vector for the multinominal prior
+        # theta0 and theta1 are the multinominal prior for words
+        theta0 = Dirichlet(hyper_multi)
+        theta1 = Dirichlet(hyper_multi)
+        theta = [theta0, theta1]
+        log_theta = [[log(p) for p in theta0], [log(p) for p in theta1]]
+        class_vote = [0] * testN # collect vote for every iteration
+
+    backend = "collapsed" if args.collapsed else args.backend
+    monitor = None
+    if args.adaptive:
+        monitor = ConvergenceMonitor(testN, args.window, args.burnin_tol, flip_tol=args.flip_tol,
+                                     margin_tol=args.margin_tol, min_samples=args.min_samples)
+    first = 0 # first iteration to run
+    recorded = 0 # iterations voted
+    if args.resume:
+        state = checkpoint.load_checkpoint(args.checkpoint)
+        if str(state["backend"]) != backend or int(state["max_iters"]) != T or len(state["labels"]) != N \
+                or np.shape(state["word_count"]) != (K, V):
+            print "Checkpoint " + args.checkpoint + " is not a chain of this run"
+            exit()
+        first = int(state["iteration"]) + 1
+        recorded = int(state["recorded"]) if "recorded" in state else max(0, first - B)
+        if monitor is not None:
+            if "monitor_samples" not in state:
+                print "Checkpoint " + args.checkpoint + " was not written with --adaptive"
+                exit()
+            monitor.restore(state)
+            if monitor.converged():
+                first = T # the saved chain had already converged
+        if args.backend == "sparse":
+            (labels, class_count, word_count) = (state["labels"], state["class_count"], state["word_count"])
+            class_vote = state["class_vote"]
+            if args.collapsed:
+                class_total = word_count.sum(axis=1) # word counts are integers, so the sum is exact
+            else:
+                (theta, log_theta) = (state["theta"], np.log(state["theta"]))
+            checkpoint.restore_random_state(state, rng)
+        else:
+            (labels, class_count, word_count) = (state["labels"].tolist(), state["class_count"].tolist(),
+                                                 state["word_count"].tolist())
+            class_vote = state["class_vote"].tolist()
+            theta = state["theta"].tolist()
+            log_theta = [[log(p) for p in theta_c] for theta_c in theta]
+            checkpoint.restore_random_state(state, None)
+        print "Resuming from iteration #" + str(first)
+    writer = None
+    if args.checkpoint is not None:
+        writer = checkpoint.CheckpointWriter(args.checkpoint)
+
+    (metrics, evaluate) = make_metrics(args, test_labels, trainN, profiler)
+
     print "Start to iterate..."
-    for i in range(T):
-        change_count = 0
-        for j in range(trainN, N): # skip training documents
-            label = labels[j]
-            assert(label == 0 or label == 1)
-            class_count[label] = class_count[label] - 1
-            update_word_count(docindexset[j], label, -1, word_count) # update word count by removing the docuemnt j
-            
-            ln_Pr0 = caculate_Pr(0, class_count, N, j, docindexset, hyper_gamma, theta[0])
-            ln_Pr1 = caculate_Pr(1, class_count, N, j, docindexset, hyper_gamma, theta[1])
-            # sometimes, the probability is very overwhelming
-            if ln_Pr0 - ln_Pr1 > 13.81: # log(999999) \approx 13.815509557963773
-                index = 0
-            elif ln_Pr1 - ln_Pr0 > 13.81:
-                index = 1
+    i = first - 1
+    for i in range(first, T):
+        if profiler is not None:
+            profiler.begin_iteration(i)
+        start = time.time()
+        if args.collapsed:
+            change_count = sparse_gibbs.collapsed_sweep(labels, class_count, word_count, class_total, N, trainN,
+                                                        hyper_gamma, hyper_multi, csr, expanded, rng)
+        elif args.backend == "sparse":
+            change_count = sparse_gibbs.sweep(labels, class_count, N, trainN, hyper_gamma, log_theta, csr, rng)
+        else:
+            change_count = sweep(labels, class_count, N, trainN, docset, hyper_gamma, log_theta, word_count)
+        metrics.count("changes", change_count)
+        start = metrics.lap("sweep", start)
+        if args.backend == "sparse" and not args.collapsed:
+            word_count = sparse_gibbs.count_word_csr(csr, labels, K, V)
+            (theta, log_theta) = sparse_gibbs.update_theta(word_count, hyper_multi, rng)
+            start = metrics.lap("theta", start)
+        elif args.backend == "dict":
+            update_theta(docset, labels, theta, hyper_multi, word_count, log_theta)
+            start = metrics.lap("theta", start)
+        if monitor is not None:
+            joint = None
+            if args.log_joint:
+                joint = sparse_gibbs.log_joint(word_count, class_count, hyper_gamma, hyper_multi, log_theta)
+                metrics.set("log_joint", joint)
+            voting = monitor.update(i, change_count, joint)
+            if monitor.burnin_end == i:
+                print "Burn-in ends at iteration #" + str(i)
+        else:
+            voting = i >= B
+        if voting: # start to record data
+            recorded = recorded + 1
+            if args.backend == "sparse":
+                sparse_gibbs.record_vote(class_vote, labels[trainN:])
             else:
-                ratio = exp(ln_Pr0 - ln_Pr1)
-                index = choose((0, 1), [ratio, 1]) # choose according a distribution
-            new_label = (0, 1)[index]
-            
-            labels[j] = new_label
-            if label != new_label:
-                change_count = change_count + 1
-            class_count[new_label] = class_count[new_label] + 1
-            update_word_count(docindexset[j], new_label, +1, word_count) # update word count by adding the docuemnt j
-        
-        update_theta(docindexset, labels, theta, hyper_multi, word_count)
-        if(i >= B): # start to record data
-            for k in range(testN):
-                class_vote[k] = class_vote[k] + labels[trainN + k] # record all 1s by adding every label, a bit hacking here
-        output_file.write("iteration #" + str(i) + ":\n")
-        output_file.write("Number of changes:" + str(change_count) + "\n")
-        print "iterationo #:" + str(i)
-        #print "Labels:"; print labels
-        # evaluate in every iteration
-        evaluate_classification(labels, tdocset, N)
+                for k in range(testN):
+                    class_vote[k] = class_vote[k] + labels[trainN + k] # record all 1s by adding every label, a bit hacking here
+            if monitor is not None:
+                if args.backend == "sparse":
+                    monitor.add_votes(class_vote)
+                else:
+                    ones = np.array(class_vote)
+                    monitor.add_votes([recorded - ones, ones])
+        start = metrics.lap("vote", start)
+        if evaluate is not None and (i + 1) % args.eval_every == 0:
+            metrics.set("accuracy", evaluate(labels))
+            start = metrics.lap("evaluate", start)
+        converged = monitor is not None and monitor.converged()
+        if writer is not None and ((i + 1) % args.checkpoint_every == 0 or i == T - 1 or converged):
+            state = checkpoint_state(i, T, backend, labels, class_count, word_count,
+                                     None if args.collapsed else theta, class_vote,
+                                     rng if args.backend == "sparse" else None)
+            state["recorded"] = np.array(recorded)
+            if monitor is not None:
+                state.update(monitor.state())
+            writer.submit(state)
+            metrics.lap("checkpoint", start)
+        metrics.end_iteration(i)
+        if profiler is not None:
+            profiler.end_iteration(i)
+        if converged:
+            print "Converged after " + str(i + 1) + " iterations, " + str(recorded) + " voted."
+            output_file.write("Converged after " + str(i + 1) + " iterations\n")
+            break
+    metrics.close(i)
+    if writer is not None:
+        writer.close() # wait for the last checkpoint
     
+    if monitor is not None and not monitor.converged():
+        print "Not converged after " + str(T) + " iterations, " + str(recorded) + " voted."
     # determin labels for each document
-    for k in range(testN):
-        if class_vote[k] >= T - B - class_vote[k]:
-            labels[k] = 1
-        else:
-            labels[k] = 0
+    if recorded == 0:
+        pass # burn-in never ended, keep the labels of the last iteration
+    elif args.backend == "sparse":
+        labels[trainN:] = class_vote.argmax(axis=0)
+    else:
+        for k in range(testN):
+            if class_vote[k] >= recorded - class_vote[k]:
+                labels[trainN + k] = 1
+            else:
+                labels[trainN + k] = 0
                 
     print "Iteration done."
     output_file.write("Results - Labels of testing document:\n")
-    output_file.write(str(labels[trainN: N]) + "\n")
+    output_file.write(str(list(labels[trainN: N])) + "\n")
     #evaluate_cluster_result(labels, docset, N, docnum)
-    evaluate_classification(labels, tdocset, N)
+    evaluate_classification(labels, test_labels, N)
     output_file.close()
+    if profiler is not None:
+        profiler.dump(args.profile)
     
 if __name__ == "__main__":
     main(sys.argv)
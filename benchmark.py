@@ -0,0 +1,476 @@
+#! /usr/bin/env python
+import os
+import sys
+import time
+import random
+from math import log
+
+import numpy as np
+
+import NB_with_Gibbs
+import naive_bayes
+import sparse_gibbs
+import generate_svm_datafile
+import generate_kNN_data
+import nb_em
+from gibbs_session import GibbsSession
+from corpus import Corpus, Vocabulary, documents_csr, make_vocabulary
+from utils import Dirichlet
+
+"""
+Micro benchmarks for the Gibbs sampler.
+
+Usage: python ./benchmark.py sweep [train_file test_file repeat]
+       python ./benchmark.py samplers [train_file test_file max_iters]
+       python ./benchmark.py export [train_file test_file repeat]
+       python ./benchmark.py formats [train_file test_file repeat] [--all-categories]
+       python ./benchmark.py nb [train_file test_file repeat]
+       python ./benchmark.py nb_online [train_file test_file batch_size]
+       python ./benchmark.py hashing [train_file test_file max_iters] [--all-categories]
+       python ./benchmark.py streaming [train_file test_file batch_size]
+       python ./benchmark.py em [train_file test_file max_iters]
+"""
+
+"""
+caculate_Pr as it was before log(theta) was cached: one log call per word of the document
+"""
+def caculate_Pr_uncached(c, class_count, N, index, docset, hyper_gamma, theta):
+    ln_Pr = log(class_count[c] + hyper_gamma[c] - 1) - log(N + hyper_gamma[0] + hyper_gamma[1] - 1)
+    for (word_index, count) in docset[index].terms():
+        ln_Pr = ln_Pr + count * log(theta[word_index])
+
+    return ln_Pr
+
+"""
+Load the data and set up the sampler state the way NB_with_Gibbs.main does
+@return (labels, class_count, N, trainN, docset, word_count, theta)
+"""
+def prepare_gibbs_state(train_file, test_file):
+    (docset, docnum) = NB_with_Gibbs.load_data(train_file)
+    (tdocset, tdocnum) = NB_with_Gibbs.load_data(test_file)
+    trainN = len(docset)
+    N = trainN + len(tdocset)
+    V = len(NB_with_Gibbs.vocabulary)
+    labels = [doc.category for doc in docset] + [random.randint(0, 1) for doc in tdocset]
+    class_count = [labels[trainN:].count(0), labels[trainN:].count(1)]
+    docset.extend(tdocset)
+    word_count = [[0]*V, [0]*V]
+    NB_with_Gibbs.count_word(docset, labels, word_count)
+    theta = [Dirichlet([1] * V), Dirichlet([1] * V)]
+    return (labels, class_count, N, trainN, docset, word_count, theta)
+
+def best_time(func, repeat):
+    best = float("inf")
+    for r in range(repeat):
+        start = time.time()
+        func()
+        best = min(best, time.time() - start)
+    return best
+
+"""
+Time one sweep of NB_with_Gibbs.sweep with and without the cached log(theta)
+"""
+def bench_sweep(train_file, test_file, repeat):
+    random.seed(0)
+    (labels, class_count, N, trainN, docset, word_count, theta) = prepare_gibbs_state(train_file, test_file)
+    hyper_gamma = (2, 2)
+
+    def run(caculate_Pr, param):
+        # every run starts from the same labels and counts
+        saved = NB_with_Gibbs.caculate_Pr
+        NB_with_Gibbs.caculate_Pr = caculate_Pr
+        try:
+            NB_with_Gibbs.sweep(list(labels), list(class_count), N, trainN, docset, hyper_gamma,
+                                param, [list(w) for w in word_count])
+        finally:
+            NB_with_Gibbs.caculate_Pr = saved
+
+    def likelihoods(caculate_Pr, param):
+        for j in range(trainN, N):
+            caculate_Pr(0, class_count, N, j, docset, hyper_gamma, param[0])
+            caculate_Pr(1, class_count, N, j, docset, hyper_gamma, param[1])
+
+    log_theta = [[log(p) for p in t] for t in theta]
+    cache = best_time(lambda: [[log(p) for p in t] for t in theta], repeat)
+    print "Documents: %d (test: %d), vocabulary: %d" % (N, N - trainN, len(theta[0]))
+    print "filling the log(theta) cache:     %.4f s" % cache
+    before = best_time(lambda: likelihoods(caculate_Pr_uncached, theta), repeat)
+    after = best_time(lambda: likelihoods(NB_with_Gibbs.caculate_Pr, log_theta), repeat)
+    print "caculate_Pr, log per word:        %.4f s" % before
+    print "caculate_Pr, cached log(theta):   %.4f s (%.2fx)" % (after, before / (after + cache))
+    before = best_time(lambda: run(caculate_Pr_uncached, theta), repeat)
+    after = best_time(lambda: run(NB_with_Gibbs.caculate_Pr, log_theta), repeat)
+    print "sweep, log per word:              %.4f s" % before
+    print "sweep, cached log(theta):         %.4f s (%.2fx)" % (after, before / (after + cache))
+
+"""
+Accuracy against wall time of the sparse sampler (theta resampled every iteration) and of the
+collapsed sampler (theta integrated out), both over all categories of the training file
+"""
+def bench_samplers(train_file, test_file, T):
+    (docset, docnum) = NB_with_Gibbs.load_data(train_file, True)
+    (tdocset, tdocnum) = NB_with_Gibbs.load_data(test_file)
+    K = len(NB_with_Gibbs.used_category)
+    V = len(NB_with_Gibbs.vocabulary)
+    trainN = len(docset)
+    N = trainN + len(tdocset)
+    csr = sparse_gibbs.build_csr(docset + tdocset)
+    train_labels = np.array([doc.category for doc in docset])
+    truth = np.array([doc.category for doc in tdocset])
+    hyper_gamma = [2] * K
+    hyper_multi = np.ones(V)
+    print "Documents: %d (test: %d), classes: %d, vocabulary: %d" % (N, N - trainN, K, V)
+
+    results = {}
+    for collapsed in (False, True):
+        rng = np.random.RandomState(0)
+        labels = np.concatenate([train_labels, rng.randint(0, K, N - trainN)])
+        class_count = np.bincount(labels[trainN:], minlength=K)
+        start = time.time()
+        word_count = sparse_gibbs.count_word_csr(csr, labels, K, V)
+        if collapsed:
+            class_total = word_count.sum(axis=1)
+            expanded = sparse_gibbs.build_expanded(csr, trainN, hyper_multi)
+        else:
+            (theta, log_theta) = sparse_gibbs.update_theta(np.zeros((K, V)), hyper_multi, rng)
+        curve = []
+        for i in range(T):
+            if collapsed:
+                sparse_gibbs.collapsed_sweep(labels, class_count, word_count, class_total, N, trainN,
+                                             hyper_gamma, hyper_multi, csr, expanded, rng)
+            else:
+                sparse_gibbs.sweep(labels, class_count, N, trainN, hyper_gamma, log_theta, csr, rng)
+                word_count = sparse_gibbs.count_word_csr(csr, labels, K, V)
+                (theta, log_theta) = sparse_gibbs.update_theta(word_count, hyper_multi, rng)
+            curve.append((time.time() - start, np.mean(labels[trainN:] == truth)))
+        results[collapsed] = curve
+
+    print "%5s  %18s  %18s" % ("iter", "sparse (s, acc)", "collapsed (s, acc)")
+    for i in range(T):
+        print "%5d  %8.3f  %8.4f  %8.3f  %8.4f" % ((i + 1,) + results[False][i] + results[True][i])
+
+"""
+generate_svm_datafile.generate_data_file as it was before the rows were buffered:
+one write call per feature
+"""
+def write_svm_unbuffered(doclist, outfile_path, idf):
+    outfile = open(outfile_path, "w")
+    for doc in doclist:
+        outfile.write(generate_svm_datafile.svm_label(doc) + " ")
+        for (index, tf) in sorted(doc.terms()):
+            outfile.write(str(index + 1) + ":" + str(tf*idf[index]) + " ")
+        outfile.write("\n")
+    outfile.close()
+
+# generate_kNN_data.generate_data_file as it was before the rows were buffered
+def write_kNN_unbuffered(doclist, outfile_path, idf):
+    outfile = open(outfile_path, "w")
+    for doc in doclist:
+        outfile.write(generate_svm_datafile.svm_label(doc) + " ")
+        features = [0.0] * len(idf)
+        for (index, tf) in doc.terms():
+            features[index] = tf*idf[index]
+        for f in features:
+            outfile.write(str(f) + " ")
+        outfile.write("\n")
+    outfile.close()
+
+"""
+Throughput of the feature file exporters, in MB/s of output, for the training docs of the
+acq and alum categories (the documents are loaded once, so only formatting and writing are timed)
+"""
+def bench_export(train_file, test_file, repeat):
+    vocabulary = Vocabulary()
+    idf = generate_svm_datafile.scan_data(train_file, test_file, vocabulary)
+    corpus = Corpus(vocabulary, generate_svm_datafile.used_category)
+    corpus.load(train_file, grow=False)
+    outfile_path = train_file + "-benchmark-export.tmp"
+    writers = [("svm, one write per feature", write_svm_unbuffered),
+               ("svm, buffered rows", generate_svm_datafile.generate_data_file),
+               ("kNN, one write per feature", write_kNN_unbuffered),
+               ("kNN, buffered dense rows", generate_kNN_data.generate_data_file)]
+    print "Documents: " + str(len(corpus)) + ", vocabulary size: " + str(len(vocabulary))
+    for (name, write) in writers:
+        seconds = best_time(lambda: write(corpus.documents, outfile_path, idf), repeat)
+        size = os.path.getsize(outfile_path) / float(1 << 20)
+        print "%-30s %8.2f MB %8.3f s %8.1f MB/s" % (name, size, seconds, size / seconds)
+    os.remove(outfile_path)
+
+# read a dense kNN data file into an N x (V+1) array
+def load_dense(path):
+    return np.array([np.fromstring(line, sep=" ") for line in open(path, "r")])
+
+# read a Matrix Market kNN data file into its (row, column, value) triplets
+def load_mtx(path):
+    return np.loadtxt(path, skiprows=2)
+
+# read a svmlight kNN data file into labels and CSR arrays
+def load_svmlight(path):
+    labels = []
+    indptr = [0]
+    entries = []
+    for line in open(path, "r"):
+        fields = line.split()
+        labels.append(int(fields[0]))
+        entries.extend(fields[1:])
+        indptr.append(len(entries))
+    pairs = np.array(":".join(entries).split(":") if entries else [], dtype=np.float64).reshape(-1, 2)
+    return (labels, indptr, pairs[:, 0].astype(np.int32) - 1, pairs[:, 1])
+
+"""
+Size, write time and load time of every output format of generate_kNN_data, for the test docs of
+the acq and alum categories, or of every category with @all_categories (webkb has no acq nor alum)
+"""
+def bench_formats(train_file, test_file, repeat, all_categories=False):
+    categories = None if all_categories else generate_svm_datafile.used_category
+    vocabulary = Vocabulary()
+    idf = generate_svm_datafile.scan_data(train_file, test_file, vocabulary, categories)
+    corpus = Corpus(vocabulary, categories)
+    corpus.load(test_file, grow=False)
+    loaders = dict({"dense": load_dense, "mtx": load_mtx, "svmlight": load_svmlight,
+                    "npz": generate_kNN_data.load_npz_file})
+    print "Documents: " + str(len(corpus)) + ", vocabulary size: " + str(len(vocabulary))
+    print "%-10s %10s %10s %10s" % ("format", "size (MB)", "write (s)", "load (s)")
+    for output_format in generate_kNN_data.FORMATS:
+        outfile_path = test_file + "-benchmark" + generate_kNN_data.SUFFIX[output_format]
+        write = generate_kNN_data.GENERATORS[output_format]
+        write_seconds = best_time(lambda: write(corpus.documents, outfile_path, idf), repeat)
+        load_seconds = best_time(lambda: loaders[output_format](outfile_path), repeat)
+        size = os.path.getsize(outfile_path) / float(1 << 20)
+        print "%-10s %10.2f %10.3f %10.3f" % (output_format, size, write_seconds, load_seconds)
+        os.remove(outfile_path)
+
+"""
+Training time (loading included) and documents per second of the per-document Naive Bayes
+classifier and of the batch one (one count aggregation to train, one sparse product to classify)
+The test docs are classified @copies times over, as one batch, so that the fixed cost of a batch
+does not hide the cost per document. The per-document classifier reads them into Documents, the
+batch one straight into CSR arrays as naive_bayes.py does; loading is timed apart from classifying.
+"""
+def bench_nb(train_file, test_file, repeat, copies=50):
+    result = dict()
+    train_seconds = best_time(lambda: result.update(doc=naive_bayes.train_multinomial_NB(train_file)), repeat)
+    batch_train_seconds = best_time(lambda: result.update(batch=naive_bayes.train_multinomial_NB_batch(train_file)),
+                                    repeat)
+    (doclist, vocabulary, prior, condprob) = result["doc"]
+    (train_labels, vocabulary, log_prior, log_condprob) = result["batch"]
+    lines = open(test_file, "r").readlines() * copies
+
+    # loading: a Document per line, or the CSR arrays of the lines as naive_bayes.main loads them
+    def load_documents():
+        tokens = [naive_bayes.extract_token(line) for line in lines]
+        result.update(docs=[naive_bayes.assign_word_index(words, counts, category, vocabulary)
+                            for (words, counts, category) in tokens if category != -1])
+    load_seconds = best_time(load_documents, repeat)
+    batch_load_seconds = best_time(lambda: result.update(csr=naive_bayes.lines_csr(lines, vocabulary)), repeat)
+    testdoc_list = result["docs"]
+    (csr, labels) = result["csr"]
+
+    apply_seconds = best_time(lambda: result.update(doc=[naive_bayes.apply_multinomial_NB(prior, condprob, doc)
+                                                         for doc in testdoc_list]), repeat)
+    batch_apply_seconds = best_time(lambda: naive_bayes.apply_multinomial_NB_batch(
+        log_prior, log_condprob, documents_csr(testdoc_list)), repeat)
+    product_seconds = best_time(lambda: result.update(batch=naive_bayes.apply_multinomial_NB_batch(
+        log_prior, log_condprob, csr)), repeat)
+    print "Training docs: " + str(len(doclist)) + ", test docs: " + str(len(testdoc_list))
+    print "%-28s %10s %10s %16s" % ("", "train (s)", "load (s)", "classify docs/s")
+    print "%-28s %10.4f %10.4f %16.0f" % ("per document", train_seconds, load_seconds,
+                                         len(testdoc_list) / apply_seconds)
+    print "%-28s %10.4f %10.4f %16.0f" % ("batch, lines to CSR (main)", batch_train_seconds, batch_load_seconds,
+                                         len(testdoc_list) / product_seconds)
+    print "%-28s %10s %10s %16.0f" % ("batch, from Documents", "", "", len(testdoc_list) / batch_apply_seconds)
+    print "Speedup of classification: %.1fx as naive_bayes.py runs it, %.1fx from Documents" \
+        % (apply_seconds / product_seconds, apply_seconds / batch_apply_seconds)
+    print "Same predictions: %.4f" % np.mean(np.array(result["doc"]) == result["batch"])
+
+"""
+Cost of adding a batch of docs to an IncrementalNB (update and refresh) as the model grows,
+against retraining on every doc so far; the training docs are added 10 times over
+"""
+def bench_nb_online(train_file, test_file, batch_size, copies=10):
+    vocabulary = Vocabulary()
+    corpus = Corpus(vocabulary, naive_bayes.used_category)
+    corpus.load(train_file)
+    doclist = corpus.documents * copies
+    model = naive_bayes.IncrementalNB(vocabulary)
+    print "%10s %16s %16s" % ("docs", "add batch (ms)", "retrain (ms)")
+    for first in range(0, len(doclist), batch_size):
+        batch = doclist[first : first + batch_size]
+        start = time.time()
+        model.add(batch)
+        model.refresh()
+        add_seconds = time.time() - start
+        n = first + len(batch)
+        if (first / batch_size) % (len(doclist) / batch_size / 8 + 1) == 0 or n == len(doclist):
+            def retrain():
+                scratch = naive_bayes.IncrementalNB(vocabulary)
+                scratch.add(doclist[:n])
+                scratch.refresh()
+            print "%10d %16.2f %16.2f" % (n, add_seconds * 1000, best_time(retrain, 1) * 1000)
+
+# approximate memory held by a vocabulary, in bytes
+def vocabulary_bytes(vocabulary):
+    if vocabulary.hashed:
+        return sys.getsizeof(vocabulary.counts)
+    return sys.getsizeof(vocabulary.index) + sys.getsizeof(vocabulary.words) + sys.getsizeof(vocabulary.counts) \
+        + sum([sys.getsizeof(word) for word in vocabulary.words]) \
+        + sum([sys.getsizeof(count) for count in vocabulary.counts])
+
+"""
+Train the Naive Bayes classifier on the docs of @categories (every category if None) and classify the test docs
+@return (vocabulary, log_condprob, accuracy)
+"""
+def nb_accuracy(train_file, test_file, hash_bits, categories):
+    if categories is naive_bayes.used_category:
+        (train_labels, vocabulary, log_prior, log_condprob) = naive_bayes.train_multinomial_NB_batch(train_file,
+                                                                                                     hash_bits)
+        corpus = Corpus(vocabulary, categories)
+    else:
+        vocabulary = make_vocabulary(hash_bits)
+        train = Corpus(vocabulary, categories)
+        train.load(train_file)
+        labels = np.array([doc.category for doc in train.documents], dtype=np.int64)
+        K = len(train.categories)
+        cterm = sparse_gibbs.count_word_csr(sparse_gibbs.build_csr(train.documents), labels, K, len(vocabulary))
+        (log_prior, log_condprob) = naive_bayes.estimate_multinomial_NB(cterm, np.bincount(labels, minlength=K))
+        corpus = Corpus(vocabulary, train.categories)
+    corpus.load(test_file, grow=False)
+    predictions = naive_bayes.apply_multinomial_NB_batch(log_prior, log_condprob, documents_csr(corpus.documents))
+    return (vocabulary, log_condprob, np.mean(predictions == np.array([doc.category for doc in corpus.documents])))
+
+"""
+Memory and accuracy of the exact vocabulary against feature hashing into 2^b terms, for the Naive
+Bayes classifier (acq and alum, or every category with @all_categories) and for a sparse Gibbs
+chain of @T iterations over all categories
+"""
+def bench_hashing(train_file, test_file, T, all_categories=False):
+    categories = None if all_categories else naive_bayes.used_category
+    # V and the vocabulary memory are those of the Gibbs chain, whose vocabulary covers all categories
+    print "%10s %8s %12s %12s %9s %12s %9s" % ("hash bits", "V", "vocab (KB)", "NB params (KB)", "NB acc",
+                                               "Gibbs (KB)", "Gibbs acc")
+    for hash_bits in (None, 10, 12, 14, 16, 18):
+        (vocabulary, log_condprob, nb_acc) = nb_accuracy(train_file, test_file, hash_bits, categories)
+
+        vocabulary = make_vocabulary(hash_bits)
+        train = Corpus(vocabulary)
+        train.load(train_file)
+        test = Corpus(vocabulary, train.categories)
+        test.load(test_file)
+        (K, V) = (len(train.categories), len(vocabulary))
+        csr = sparse_gibbs.build_csr(train.documents + test.documents)
+        votes = sparse_gibbs.run_chain(csr, np.array([doc.category for doc in train.documents]), K, V, T, T / 3,
+                                       [2] * K, np.ones(V), 0)
+        gibbs_accuracy = np.mean(votes.argmax(axis=0) == np.array([doc.category for doc in test.documents]))
+        # word_count, theta and log_theta are K x V arrays of doubles
+        print "%10s %8d %12.0f %12.0f %9.4f %12.0f %9.4f" % ("exact" if hash_bits is None else hash_bits, V,
+            vocabulary_bytes(vocabulary) / 1024.0, log_condprob.nbytes / 1024.0, nb_acc,
+            3 * K * V * 8 / 1024.0, gibbs_accuracy)
+
+"""
+Latency and accuracy of labelling the test docs batch by batch, over all categories: a GibbsSession
+that keeps its chain (local burn-in, then 5 sweeps per batch), against a new chain of 30 iterations
+(10 of burn-in) over the training docs and the batch, as NB_with_Gibbs.py runs for every batch
+"""
+def bench_streaming(train_file, test_file, batch_size, T=30):
+    vocabulary = Vocabulary()
+    train = Corpus(vocabulary)
+    train.load(train_file)
+    test = Corpus(vocabulary, train.categories)
+    test.load(test_file)
+    K = len(train.categories)
+    train_labels = np.array([doc.category for doc in train.documents])
+    session = GibbsSession(train.documents, K, len(vocabulary), [2] * K, seed=0)
+    rng = np.random.RandomState(0)
+    print "%8s %16s %10s %16s %10s" % ("batch", "session (s)", "acc", "new chain (s)", "acc")
+    (latency, accuracy) = ([0.0, 0.0], [0.0, 0.0])
+    batches = list(naive_bayes.read_batches(test.documents, batch_size))
+    for (b, batch) in enumerate(batches):
+        truth = np.array([doc.category for doc in batch])
+        start = time.time()
+        ids = session.add(batch)
+        for s in range(5):
+            session.step()
+        (ids, labels) = session.retire(ids)
+        session_seconds = time.time() - start
+        session_accuracy = np.mean(labels == truth)
+
+        start = time.time()
+        csr = sparse_gibbs.build_csr(train.documents + batch)
+        votes = sparse_gibbs.run_chain(csr, train_labels, K, len(vocabulary), T, T / 3, [2] * K,
+                                       np.ones(len(vocabulary)), rng.randint(2**31))
+        chain_seconds = time.time() - start
+        chain_accuracy = np.mean(votes.argmax(axis=0) == truth)
+        print "%8d %16.3f %10.4f %16.3f %10.4f" % (b, session_seconds, session_accuracy, chain_seconds,
+                                                   chain_accuracy)
+        latency = [latency[0] + session_seconds, latency[1] + chain_seconds]
+        accuracy = [accuracy[0] + session_accuracy * len(batch), accuracy[1] + chain_accuracy * len(batch)]
+    print "%8s %16.3f %10.4f %16.3f %10.4f" % ("mean", latency[0] / len(batches), accuracy[0] / len(test),
+                                               latency[1] / len(batches), accuracy[1] / len(test))
+
+"""
+Accuracy and time of semi-supervised EM against a sparse Gibbs chain of @T iterations (a third of
+burn-in), over all categories; the first E step of EM is the Naive Bayes classifier of the training docs
+"""
+def bench_em(train_file, test_file, T):
+    vocabulary = Vocabulary()
+    train = Corpus(vocabulary)
+    train.load(train_file)
+    test = Corpus(vocabulary, train.categories)
+    test.load(test_file)
+    (K, V) = (len(train.categories), len(vocabulary))
+    csr = sparse_gibbs.build_csr(train.documents + test.documents)
+    train_labels = np.array([doc.category for doc in train.documents])
+    truth = np.array([doc.category for doc in test.documents])
+    print "Documents: %d (test: %d), classes: %d, vocabulary: %d" % (len(train) + len(test), len(test), K, V)
+
+    print "%28s %12s %10s %10s" % ("", "iterations", "time (s)", "accuracy")
+    curve = []
+    def iteration(i, posterior, log_posterior, change_count):
+        curve.append((time.time() - start, np.mean(posterior.argmax(axis=0) == truth)))
+    for tol in (1e-4, 1e-6, 1e-8):
+        (start, curve) = (time.time(), [])
+        (posterior, iterations, converged) = nb_em.run_em(csr, train_labels, K, V, 1000, [2] * K, 1.0, tol, iteration)
+        if tol == 1e-4:
+            print "%28s %12d %10.3f %10.4f" % ("Naive Bayes (first E step)", 1, curve[0][0], curve[0][1])
+        print "%28s %12d %10.3f %10.4f" % ("EM, tol %g" % tol, iterations, curve[-1][0], curve[-1][1])
+    for seed in range(3):
+        start = time.time()
+        votes = sparse_gibbs.run_chain(csr, train_labels, K, V, T, T / 3, [2] * K, np.ones(V), seed)
+        print "%28s %12d %10.3f %10.4f" % ("Gibbs, seed %d" % seed, T, time.time() - start,
+                                           np.mean(votes.argmax(axis=0) == truth))
+
+def main(argv):
+    commands = dict({"sweep": (bench_sweep, 3), "samplers": (bench_samplers, 30), "export": (bench_export, 3),
+                     "formats": (bench_formats, 3), "nb": (bench_nb, 3), "nb_online": (bench_nb_online, 100),
+                     "hashing": (bench_hashing, 10), "streaming": (bench_streaming, 200), "em": (bench_em, 30)})
+    if len(argv) < 2 or argv[1] not in commands:
+        print "Usage: python ./benchmark.py sweep [train_file test_file repeat]"
+        print "       python ./benchmark.py samplers [train_file test_file max_iters]"
+        print "       python ./benchmark.py export [train_file test_file repeat]"
+        print "       python ./benchmark.py formats [train_file test_file repeat] [--all-categories]"
+        print "       python ./benchmark.py nb [train_file test_file repeat]"
+        print "       python ./benchmark.py nb_online [train_file test_file batch_size]"
+        print "       python ./benchmark.py hashing [train_file test_file max_iters] [--all-categories]"
+        print "       python ./benchmark.py streaming [train_file test_file batch_size]"
+        print "       python ./benchmark.py em [train_file test_file max_iters]"
+        exit()
+    # --all-categories, for the benchmarks taking it, may come anywhere after the command
+    all_categories = "--all-categories" in argv
+    argv = [arg for arg in argv if arg != "--all-categories"]
+    (bench, n) = commands[argv[1]]
+    train_file = "dataset/r52-train-stemmed.txt"
+    test_file = "dataset/r52-test-stemmed.txt"
+    if len(argv) >= 4:
+        (train_file, test_file) = (argv[2], argv[3])
+    if len(argv) >= 5:
+        n = int(argv[4])
+    if all_categories:
+        if argv[1] not in ("formats", "hashing"):
+            print "--all-categories is only taken by: formats, hashing"
+            exit()
+        bench(train_file, test_file, n, all_categories=True)
+    else:
+        bench(train_file, test_file, n)
+
+if __name__ == "__main__":
+    main(sys.argv)
@@ -0,0 +1,381 @@
+#! /usr/bin/env python
+import os
+import sys
+import json
+import time
+import random
+import resource
+import argparse
+import platform
+import subprocess
+import tempfile
+from math import log
+from multiprocessing import cpu_count
+
+import numpy as np
+
+import NB_with_Gibbs
+import naive_bayes
+import sparse_gibbs
+import generate_svm_datafile
+import generate_kNN_data
+from benchmark import best_time, prepare_gibbs_state
+from corpus import Corpus, Vocabulary, documents_csr
+
+"""
+Reproducible benchmark suite: loaders, samplers, classifiers and exporters on synthetic corpora.
+
+The corpora are generated from fixed seeds, so every run times the same documents: two classes
+(acq and alum, as in used_category) whose words follow a Zipf distribution over the vocabulary,
+every class with its own topical words. A corpus of N training docs comes with N/4 test docs,
+and is written once into --data-dir, then reused.
+
+Every case runs for every size in a forked process, so that its peak RSS is its own and no state
+is shared between the cases. For every case and size the best of --repeat runs is reported, with
+its throughput, and for every case the scaling exponent, the slope of log(time) against log(docs).
+The results are written as JSON with the commit they were measured on; --compare prints the ratio
+of the times to those of an earlier results file and exits with status 1 if any case got slower
+by more than --tolerance.
+
+Usage: python ./benchmark_suite.py [--sizes 1000,10000,100000] [--cases load_data,...] [--repeat 3]
+                                   [--seed 0] [--output results.json] [--compare old.json]
+"""
+
+SYNTHETIC_VOCABULARY = 20000 # words of a synthetic corpus
+SYNTHETIC_DOC_LENGTH = 60 # mean tokens per synthetic doc
+SYNTHETIC_TOPICAL = 0.2 # fraction of the tokens drawn from the topical words of the class
+SYNTHETIC_CHUNK = 10000 # docs generated at once
+
+# the pseudo word of term @t: letters, as the stemmed words of the datasets
+def synthetic_word(t):
+    letters = []
+    t = t + 26
+    while t > 0:
+        letters.append(chr(ord("a") + t % 26))
+        t = t / 26
+    return "".join(letters)
+
+"""
+Write a synthetic corpus of @N docs to @path, in the format of the datasets
+The word distributions of the classes depend on @seed only; @part (0 for training, 1 for test)
+selects the stream of docs drawn from them.
+"""
+def synthetic_corpus(path, N, seed, part, V=SYNTHETIC_VOCABULARY, doc_length=SYNTHETIC_DOC_LENGTH):
+    categories = NB_with_Gibbs.used_category
+    model_rng = np.random.RandomState(seed)
+    zipf = 1.0 / np.arange(1, V + 1)
+    zipf = zipf / zipf.sum()
+    cdfs = []
+    for c in categories:
+        p = (1 - SYNTHETIC_TOPICAL) * zipf + SYNTHETIC_TOPICAL * zipf[model_rng.permutation(V)]
+        cdfs.append(np.cumsum(p / p.sum()))
+    words = [synthetic_word(t) for t in range(V)]
+
+    rng = np.random.RandomState([seed, part + 1])
+    outfile = open(path + ".tmp", "w", generate_svm_datafile.BUFFER_SIZE)
+    for first in range(0, N, SYNTHETIC_CHUNK):
+        n = min(SYNTHETIC_CHUNK, N - first)
+        labels = rng.randint(0, len(categories), n)
+        lengths = 1 + rng.poisson(doc_length - 1, n)
+        tokens = np.empty(lengths.sum(), dtype=np.int64)
+        ends = np.cumsum(lengths)
+        doc_of_token = np.repeat(labels, lengths)
+        for c in range(len(categories)):
+            in_class = doc_of_token == c
+            tokens[in_class] = cdfs[c].searchsorted(rng.random_sample(in_class.sum()), side="right")
+        np.minimum(tokens, V - 1, out=tokens)
+        tokens = tokens.tolist()
+        start = 0
+        rows = []
+        for k in range(n):
+            rows.append(categories[labels[k]] + "\t" + " ".join([words[t] for t in tokens[start : ends[k]]]) + "\n")
+            start = ends[k]
+        outfile.write("".join(rows))
+    outfile.close()
+    os.rename(path + ".tmp", path) # an interrupted run leaves no partial corpus behind
+
+"""
+Paths of the synthetic training and test files of @N training docs, generated if missing
+@return (train_path, test_path)
+"""
+def synthetic_files(data_dir, N, seed):
+    if not os.path.isdir(data_dir):
+        os.makedirs(data_dir)
+    paths = []
+    for (part, n) in ((0, N), (1, max(N / 4, 1))):
+        path = os.path.join(data_dir, "synthetic-%d-seed%d-%s.txt" % (N, seed, ("train", "test")[part]))
+        if not os.path.exists(path):
+            synthetic_corpus(path, n, seed, part)
+        paths.append(path)
+    return tuple(paths)
+
+# the cases: function (train_path, test_path, repeat) --> dict(seconds, items, unit), setup is not timed
+
+def case_load_data(train_path, test_path, repeat):
+    result = dict()
+    def load():
+        NB_with_Gibbs.vocabulary = Vocabulary() # every run builds the vocabulary from scratch
+        result["docs"] = NB_with_Gibbs.load_data(train_path)[0]
+    seconds = best_time(load, repeat)
+    return dict({"seconds": seconds, "items": len(result["docs"]), "unit": "docs"})
+
+# corpus.Corpus.load_parallel on every CPU
+def case_load_parallel(train_path, test_path, repeat):
+    result = dict()
+    def load():
+        result["corpus"] = Corpus(Vocabulary(), NB_with_Gibbs.used_category)
+        result["corpus"].load(train_path, processes=cpu_count())
+    seconds = best_time(load, repeat)
+    return dict({"seconds": seconds, "items": len(result["corpus"]), "unit": "docs", "processes": cpu_count()})
+
+# dict backend: one NB_with_Gibbs.sweep over the test docs
+def case_gibbs_sweep(train_path, test_path, repeat):
+    (labels, class_count, N, trainN, docset, word_count, theta) = prepare_gibbs_state(train_path, test_path)
+    log_theta = [[log(p) for p in theta_c] for theta_c in theta]
+    seconds = best_time(lambda: NB_with_Gibbs.sweep(labels, class_count, N, trainN, docset, (2, 2), log_theta,
+                                                    word_count), repeat)
+    return dict({"seconds": seconds, "items": N - trainN, "unit": "docs"})
+
+# dict backend: NB_with_Gibbs.update_theta, both classes
+def case_gibbs_theta(train_path, test_path, repeat):
+    (labels, class_count, N, trainN, docset, word_count, theta) = prepare_gibbs_state(train_path, test_path)
+    V = len(NB_with_Gibbs.vocabulary)
+    log_theta = [None, None]
+    seconds = best_time(lambda: NB_with_Gibbs.update_theta(docset, labels, theta, [1] * V, word_count, log_theta),
+                        repeat)
+    return dict({"seconds": seconds, "items": 2 * V, "unit": "terms"})
+
+"""
+Set up the sparse sampler the way NB_with_Gibbs.main does
+@return (labels, class_count, N, trainN, csr, K, V, rng)
+"""
+def prepare_sparse_state(train_path, test_path):
+    (docset, docnum) = NB_with_Gibbs.load_data(train_path)
+    (tdocset, tdocnum) = NB_with_Gibbs.load_data(test_path)
+    (K, V) = (len(NB_with_Gibbs.used_category), len(NB_with_Gibbs.vocabulary))
+    trainN = len(docset)
+    N = trainN + len(tdocset)
+    rng = np.random.RandomState(0)
+    labels = np.concatenate([[doc.category for doc in docset], rng.randint(0, K, N - trainN)]).astype(np.int64)
+    class_count = np.bincount(labels[trainN:], minlength=K)
+    return (labels, class_count, N, trainN, sparse_gibbs.build_csr(docset + tdocset), K, V, rng)
+
+# sparse backend: one sparse_gibbs.sweep over the test docs
+def case_sparse_sweep(train_path, test_path, repeat):
+    (labels, class_count, N, trainN, csr, K, V, rng) = prepare_sparse_state(train_path, test_path)
+    (theta, log_theta) = sparse_gibbs.update_theta(np.zeros((K, V)), np.ones(V), rng)
+    seconds = best_time(lambda: sparse_gibbs.sweep(labels, class_count, N, trainN, [2] * K, log_theta, csr, rng),
+                        repeat)
+    return dict({"seconds": seconds, "items": N - trainN, "unit": "docs"})
+
+# sparse backend: word counts of the classes and a new theta, as every iteration does
+def case_sparse_theta(train_path, test_path, repeat):
+    (labels, class_count, N, trainN, csr, K, V, rng) = prepare_sparse_state(train_path, test_path)
+    hyper_multi = np.ones(V)
+    def update():
+        word_count = sparse_gibbs.count_word_csr(csr, labels, K, V)
+        sparse_gibbs.update_theta(word_count, hyper_multi, rng)
+    seconds = best_time(update, repeat)
+    return dict({"seconds": seconds, "items": N, "unit": "docs"})
+
+# naive_bayes.train_multinomial_NB_batch, loading included
+def case_nb_train(train_path, test_path, repeat):
+    result = dict()
+    seconds = best_time(lambda: result.update(model=naive_bayes.train_multinomial_NB_batch(train_path)), repeat)
+    return dict({"seconds": seconds, "items": len(result["model"][0]), "unit": "docs"})
+
+# naive_bayes.apply_multinomial_NB_batch on the CSR arrays of the test docs
+def case_nb_predict(train_path, test_path, repeat):
+    (train_labels, vocabulary, log_prior, log_condprob) = naive_bayes.train_multinomial_NB_batch(train_path)
+    corpus = Corpus(vocabulary, naive_bayes.used_category)
+    corpus.load(test_path, grow=False)
+    csr = documents_csr(corpus.documents)
+    seconds = best_time(lambda: naive_bayes.apply_multinomial_NB_batch(log_prior, log_condprob, csr), repeat)
+    return dict({"seconds": seconds, "items": len(corpus), "unit": "docs"})
+
+# generate_svm_datafile.caculate_idf over the training docs
+def case_idf(train_path, test_path, repeat):
+    vocabulary = Vocabulary()
+    corpus = Corpus(vocabulary, generate_svm_datafile.used_category)
+    corpus.load(train_path)
+    seconds = best_time(lambda: generate_svm_datafile.caculate_idf(corpus.documents, vocabulary), repeat)
+    return dict({"seconds": seconds, "items": len(corpus), "unit": "docs"})
+
+"""
+Case writing the training docs with @write (doclist, outfile_path, idf), as the exporters do once
+the vocabulary and the idf are known
+"""
+def export_case(write):
+    def case(train_path, test_path, repeat):
+        vocabulary = Vocabulary()
+        idf = generate_svm_datafile.scan_data(train_path, test_path, vocabulary)
+        corpus = Corpus(vocabulary, generate_svm_datafile.used_category)
+        corpus.load(train_path, grow=False)
+        outfile_path = train_path + "-benchmark-export.tmp"
+        seconds = best_time(lambda: write(corpus.documents, outfile_path, idf), repeat)
+        size = os.path.getsize(outfile_path)
+        os.remove(outfile_path)
+        return dict({"seconds": seconds, "items": len(corpus), "unit": "docs", "bytes": size})
+    return case
+
+CASES = [("load_data", case_load_data), ("load_parallel", case_load_parallel), ("gibbs_sweep", case_gibbs_sweep), ("gibbs_theta", case_gibbs_theta),
+         ("sparse_sweep", case_sparse_sweep), ("sparse_theta", case_sparse_theta),
+         ("nb_train", case_nb_train), ("nb_predict", case_nb_predict), ("idf", case_idf),
+         ("export_svm", export_case(generate_svm_datafile.generate_data_file)),
+         ("export_svmlight", export_case(generate_kNN_data.generate_svmlight_file)),
+         ("export_mtx", export_case(generate_kNN_data.generate_mtx_file)),
+         ("export_npz", export_case(generate_kNN_data.generate_npz_file))]
+
+# resident set size of this process in MB, None where /proc is missing
+def current_rss_mb():
+    try:
+        for line in open("/proc/self/status", "r"):
+            if line.startswith("VmRSS:"):
+                return int(line.split()[1]) / 1024.0
+    except IOError:
+        pass
+    return None
+
+"""
+Run @case in a forked process, whose output is discarded
+@return the dict of the case, plus rss_start_mb and peak_rss_mb of the forked process
+"""
+def run_forked(case, train_path, test_path, repeat):
+    (read_end, write_end) = os.pipe()
+    pid = os.fork()
+    if pid == 0:
+        os.close(read_end)
+        status = 0
+        try:
+            devnull = open(os.devnull, "w")
+            (stdout, sys.stdout) = (sys.stdout, devnull) # the loaders and writers print their progress
+            random.seed(0) # prepare_gibbs_state draws the initial labels with random
+            rss_start = current_rss_mb()
+            result = case(train_path, test_path, repeat)
+            result["rss_start_mb"] = rss_start
+            # ru_maxrss is in KB on Linux, in bytes on macOS
+            peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+            result["peak_rss_mb"] = peak / (1024.0 * 1024.0 if sys.platform == "darwin" else 1024.0)
+        except Exception as e:
+            result = dict({"error": repr(e)})
+            status = 1
+        os.write(write_end, json.dumps(result))
+        os.close(write_end)
+        os._exit(status)
+    os.close(write_end)
+    chunks = []
+    while True:
+        chunk = os.read(read_end, 1 << 16)
+        if not chunk:
+            break
+        chunks.append(chunk)
+    os.close(read_end)
+    os.waitpid(pid, 0)
+    if len(chunks) == 0:
+        return dict({"error": "benchmark process died"})
+    return json.loads("".join(chunks))
+
+# slope of log(seconds) against log(docs), None with fewer than two sizes
+def scaling_exponent(points):
+    points = [(docs, seconds) for (docs, seconds) in points if seconds > 0]
+    if len(points) < 2:
+        return None
+    return float(np.polyfit(np.log([p[0] for p in points]), np.log([p[1] for p in points]), 1)[0])
+
+# commit of the working tree, None outside a git checkout
+def git_commit():
+    try:
+        devnull = open(os.devnull, "w")
+        commit = subprocess.check_output(["git", "rev-parse", "HEAD"], stderr=devnull,
+                                         cwd=os.path.dirname(os.path.abspath(__file__))).strip()
+        dirty = subprocess.call(["git", "diff", "--quiet", "HEAD"], stderr=devnull,
+                                cwd=os.path.dirname(os.path.abspath(__file__))) != 0
+        return commit + ("-dirty" if dirty else "")
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+"""
+Print the time ratios of @results to @baseline, matched by case and size
+@return number of regressions, ratios above 1 + @tolerance
+"""
+def compare_results(results, baseline, tolerance):
+    before = dict(((r["case"], r["docs"]), r) for r in baseline["results"] if "seconds" in r)
+    print "Compared to " + str(baseline.get("commit")) + ":"
+    print "%-16s %10s %12s %12s %8s" % ("case", "docs", "before (s)", "now (s)", "ratio")
+    regressions = 0
+    for r in results:
+        old = before.get((r["case"], r["docs"]))
+        if old is None or "seconds" not in r:
+            continue
+        ratio = r["seconds"] / old["seconds"] if old["seconds"] > 0 else float("inf")
+        flag = ""
+        if ratio > 1 + tolerance:
+            flag = "  REGRESSION"
+            regressions = regressions + 1
+        print "%-16s %10d %12.4f %12.4f %8.2f%s" % (r["case"], r["docs"], old["seconds"], r["seconds"], ratio, flag)
+    return regressions
+
+def main(argv):
+    parser = argparse.ArgumentParser(usage="python ./benchmark_suite.py [options]")
+    parser.add_argument("--sizes", default="1000,10000,100000",
+                        help="numbers of training docs, comma separated (default: 1000,10000,100000)")
+    parser.add_argument("--cases", default=None,
+                        help="cases to run, comma separated (default: all of " + ",".join([c[0] for c in CASES]) + ")")
+    parser.add_argument("--repeat", type=int, default=3, help="runs of every case, the best is kept (default: 3)")
+    parser.add_argument("--seed", type=int, default=0, help="seed of the synthetic corpora (default: 0)")
+    parser.add_argument("--data-dir", default=os.path.join(tempfile.gettempdir(), "nb-with-gibbs-benchmark"),
+                        help="directory of the synthetic corpora")
+    parser.add_argument("--output", default=None, help="write the results to this JSON file")
+    parser.add_argument("--compare", default=None, help="results file of an earlier run to compare with")
+    parser.add_argument("--tolerance", type=float, default=0.1,
+                        help="slowdown reported as a regression by --compare (default: 0.1, 10%%)")
+    args = parser.parse_args(argv[1:])
+    sizes = [int(size) for size in args.sizes.split(",")]
+    cases = CASES
+    if args.cases is not None:
+        names = args.cases.split(",")
+        unknown = [name for name in names if name not in dict(CASES)]
+        if len(unknown) > 0:
+            parser.error("unknown cases: " + ", ".join(unknown))
+        cases = [(name, dict(CASES)[name]) for name in names]
+
+    files = dict()
+    for N in sizes:
+        start = time.time()
+        files[N] = synthetic_files(args.data_dir, N, args.seed)
+        print "Corpus of %d training docs ready in %.1f s" % (N, time.time() - start)
+
+    print "%-16s %10s %10s %18s %14s" % ("case", "docs", "time (s)", "throughput", "peak RSS (MB)")
+    results = []
+    exponents = dict()
+    for (name, case) in cases:
+        points = []
+        for N in sizes:
+            result = run_forked(case, files[N][0], files[N][1], args.repeat)
+            result.update({"case": name, "docs": N})
+            results.append(result)
+            if "error" in result:
+                print "%-16s %10d  failed: %s" % (name, N, result["error"])
+                continue
+            result["throughput"] = result["items"] / result["seconds"] if result["seconds"] > 0 else None
+            points.append((N, result["seconds"]))
+            print "%-16s %10d %10.4f %10.0f %-7s %14.1f" % (name, N, result["seconds"], result["throughput"] or 0,
+                                                           result["unit"] + "/s", result["peak_rss_mb"])
+        exponents[name] = scaling_exponent(points)
+        if exponents[name] is not None:
+            print "%-16s scaling exponent %.2f" % (name, exponents[name])
+
+    report = dict({"commit": git_commit(), "python": platform.python_version(), "numpy": np.__version__,
+                   "machine": platform.machine(), "seed": args.seed, "repeat": args.repeat, "sizes": sizes,
+                   "time": time.strftime("%Y-%m-%dT%H:%M:%S"), "scaling_exponents": exponents, "results": results})
+    if args.output is not None:
+        outfile = open(args.output, "w")
+        json.dump(report, outfile, indent=1, sort_keys=True)
+        outfile.close()
+        print "Results written to " + args.output
+    if args.compare is not None:
+        if compare_results(results, json.load(open(args.compare, "r")), args.tolerance) > 0:
+            sys.exit(1)
+
+if __name__ == "__main__":
+    main(sys.argv)
@@ -0,0 +1,124 @@
+#! /usr/bin/env python
+import os
+import random
+import threading
+
+import numpy as np
+
+"""
+Checkpoints of a Gibbs chain of NB_with_Gibbs.py.
+
+A checkpoint is one binary file holding the state of the sampler as arrays: labels, class_count,
+word_count, theta, class_vote, the iteration number, and the states of the random generators
+(Python's random module and the NumPy RandomState of the sparse backend), so that a resumed
+chain continues exactly as the interrupted one would have. The file is a sequence of .npy
+records: CHECKPOINT_VERSION, the names of the arrays, then the arrays in that order (a .npz
+archive takes about four times longer to write).
+
+The file is written next to the checkpoint and renamed over it, so an interrupted write leaves
+the previous checkpoint intact. CheckpointWriter writes on a background thread: the sampler
+hands over a copy of its state and goes on with the next sweep.
+"""
+
+CHECKPOINT_VERSION = 1
+
+"""
+States of Python's random module and of @rng (a np.random.RandomState, or None) as arrays
+@return dict of name --> array
+"""
+def random_state_arrays(rng):
+    (version, internal, gauss_next) = random.getstate()
+    arrays = dict({"py_random_version": np.array(version),
+                   "py_random_internal": np.array(internal, dtype=np.int64),
+                   "py_random_gauss": np.array(np.nan if gauss_next is None else gauss_next)})
+    if rng is not None:
+        (name, keys, pos, has_gauss, cached_gaussian) = rng.get_state()
+        arrays.update({"np_random_keys": keys.copy(), "np_random_pos": np.array(pos),
+                       "np_random_has_gauss": np.array(has_gauss),
+                       "np_random_gauss": np.array(cached_gaussian)})
+    return arrays
+
+# restore the states saved by random_state_arrays
+def restore_random_state(arrays, rng):
+    gauss_next = float(arrays["py_random_gauss"])
+    random.setstate((int(arrays["py_random_version"]), tuple([int(x) for x in arrays["py_random_internal"]]),
+                     None if np.isnan(gauss_next) else gauss_next))
+    if rng is not None:
+        rng.set_state(("MT19937", arrays["np_random_keys"], int(arrays["np_random_pos"]),
+                       int(arrays["np_random_has_gauss"]), float(arrays["np_random_gauss"])))
+
+"""
+Write @state (dict of name --> array) to @path, through a temporary file renamed over it
+"""
+def save_checkpoint(path, state):
+    tmp_path = path + ".tmp"
+    names = sorted(state)
+    f = open(tmp_path, "wb")
+    np.save(f, np.array(CHECKPOINT_VERSION))
+    np.save(f, np.array(names))
+    for name in names:
+        np.save(f, state[name])
+    f.close()
+    os.rename(tmp_path, path)
+
+# @return dict of name --> array
+def load_checkpoint(path):
+    f = open(path, "rb")
+    version = int(np.load(f))
+    if version != CHECKPOINT_VERSION:
+        raise ValueError("Checkpoint " + path + " has version " + str(version) + ", expected "
+                         + str(CHECKPOINT_VERSION))
+    names = [str(name) for name in np.load(f)]
+    state = dict((name, np.load(f)) for name in names)
+    f.close()
+    return state
+
+"""
+Write checkpoints on a background thread. A state submitted while the previous one is still
+being written replaces any state not written yet: only the latest one matters.
+"""
+class CheckpointWriter(object):
+    __slots__ = ("path", "pending", "closed", "error", "condition", "thread")
+
+    def __init__(self, path):
+        self.path = path
+        self.pending = None # state waiting to be written
+        self.closed = False
+        self.error = None # exception raised by the writer thread
+        self.condition = threading.Condition()
+        self.thread = threading.Thread(target=self.run)
+        self.thread.daemon = True
+        self.thread.start()
+
+    # hand over @state, which must not be modified afterwards
+    def submit(self, state):
+        with self.condition:
+            if self.error is not None:
+                raise self.error
+            self.pending = state
+            self.condition.notify()
+
+    def run(self):
+        while True:
+            with self.condition:
+                while self.pending is None and not self.closed:
+                    self.condition.wait()
+                if self.pending is None:
+                    return
+                state = self.pending
+                self.pending = None
+            try:
+                save_checkpoint(self.path, state)
+            except Exception as e:
+                with self.condition:
+                    self.error = e
+                return
+
+    # write the last submitted state and stop the thread
+    def close(self):
+        with self.condition:
+            self.closed = True
+            self.condition.notify()
+        self.thread.join()
+        if self.error is not None:
+            raise self.error
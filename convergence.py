@@ -0,0 +1,113 @@
+#! /usr/bin/env python
+import numpy as np
+
+"""
+Convergence monitor for a Gibbs chain of NB_with_Gibbs.py, replacing the fixed burn-in of T/3
+and the fixed number of iterations.
+
+Burn-in ends once the chain stops drifting: the mean rate of label changes over the last
+@window iterations is no longer lower than over the @window iterations before by more than
+@burnin_tol, and, if the log-joint is tracked, its mean over the last window is no longer higher
+than over the window before by more than @log_joint_tol (relative).
+
+Sampling stops once the votes have settled: during @window consecutive iterations after burn-in,
+at most a fraction @flip_tol of the test documents changed their majority label, and the mean
+absolute change of the vote margin (votes of the first class minus votes of the second, over the
+number of votes) stayed below @margin_tol, with at least @min_samples votes recorded.
+"""
+
+class ConvergenceMonitor(object):
+    __slots__ = ("testN", "window", "burnin_tol", "log_joint_tol", "flip_tol", "margin_tol", "min_samples",
+                 "change_rates", "log_joints", "burnin_end", "samples", "decided", "margin", "stable")
+
+    def __init__(self, testN, window=5, burnin_tol=0.005, log_joint_tol=0.001, flip_tol=0.0, margin_tol=0.01,
+                 min_samples=10):
+        self.testN = testN
+        self.window = window
+        self.burnin_tol = burnin_tol
+        self.log_joint_tol = log_joint_tol
+        self.flip_tol = flip_tol
+        self.margin_tol = margin_tol
+        self.min_samples = min_samples
+        self.change_rates = [] # fraction of test labels changed, every iteration
+        self.log_joints = [] # log-joint every iteration, if tracked
+        self.burnin_end = None # first iteration recorded, None during burn-in
+        self.samples = 0 # votes recorded per document
+        self.decided = None # majority label of every test document
+        self.margin = None # vote margin of every test document
+        self.stable = 0 # consecutive iterations with settled votes
+
+    # @return True if the last two windows of @values differ by at most @tol
+    def plateau(self, values, tol):
+        if len(values) < 2 * self.window:
+            return False
+        recent = np.mean(values[-self.window:])
+        before = np.mean(values[-2 * self.window : -self.window])
+        return recent - before <= tol
+
+    """
+    Record iteration @i
+    @change_count number of test labels changed by the sweep
+    @log_joint log-joint after the sweep, None if not tracked
+    @return True if the labels of this iteration should be voted, i.e. burn-in is over
+    """
+    def update(self, i, change_count, log_joint=None):
+        self.change_rates.append(change_count * 1.0 / max(self.testN, 1))
+        if log_joint is not None:
+            self.log_joints.append(log_joint)
+        if self.burnin_end is None:
+            # change rates should stop decreasing, the log-joint should stop increasing
+            settled = self.plateau([-r for r in self.change_rates], self.burnin_tol)
+            if log_joint is not None:
+                settled = settled and self.plateau(self.log_joints, self.log_joint_tol * abs(log_joint))
+            if settled:
+                self.burnin_end = i
+        return self.burnin_end is not None
+
+    """
+    Record the votes after iteration @i
+    @class_vote K x testN array of votes
+    """
+    def add_votes(self, class_vote):
+        class_vote = np.asarray(class_vote)
+        self.samples = self.samples + 1
+        if len(class_vote) < 2:
+            margin = np.ones(class_vote.shape[1]) # a single class always wins by every vote
+        else:
+            ranked = np.sort(class_vote, axis=0)
+            margin = (ranked[-1] - ranked[-2]) * 1.0 / self.samples
+        decided = class_vote.argmax(axis=0)
+        if self.decided is not None:
+            flips = np.mean(decided != self.decided) if self.testN > 0 else 0.0
+            drift = np.mean(np.abs(margin - self.margin)) if self.testN > 0 else 0.0
+            if flips <= self.flip_tol and drift <= self.margin_tol:
+                self.stable = self.stable + 1
+            else:
+                self.stable = 0
+        (self.decided, self.margin) = (decided, margin)
+
+    # @return True once sampling can stop
+    def converged(self):
+        return self.samples >= self.min_samples and self.stable >= self.window
+
+    # state as arrays for checkpoint.save_checkpoint, prefixed by "monitor_"
+    def state(self):
+        state = dict({"monitor_change_rates": np.array(self.change_rates, dtype=np.float64),
+                      "monitor_log_joints": np.array(self.log_joints, dtype=np.float64),
+                      "monitor_burnin_end": np.array(-1 if self.burnin_end is None else self.burnin_end),
+                      "monitor_samples": np.array(self.samples), "monitor_stable": np.array(self.stable)})
+        if self.decided is not None:
+            state["monitor_decided"] = self.decided.copy()
+            state["monitor_margin"] = self.margin.copy()
+        return state
+
+    # restore the state saved by state()
+    def restore(self, state):
+        self.change_rates = state["monitor_change_rates"].tolist()
+        self.log_joints = state["monitor_log_joints"].tolist()
+        burnin_end = int(state["monitor_burnin_end"])
+        self.burnin_end = None if burnin_end < 0 else burnin_end
+        self.samples = int(state["monitor_samples"])
+        self.stable = int(state["monitor_stable"])
+        if "monitor_decided" in state:
+            (self.decided, self.margin) = (state["monitor_decided"], state["monitor_margin"])
@@ -0,0 +1,487 @@
+#! /usr/bin/env python
+import os
+import zlib
+from array import array
+from itertools import izip
+from multiprocessing import Pool, cpu_count
+
+import numpy as np
+
+from corpus_cache import find_cache, load_cache, iter_documents, tokenize
+
+"""
+Compact corpus representation shared by all the scripts.
+
+Vocabulary  interned words <--> term ids, with the total count of every term
+HashedVocabulary  words --> one of 2^b term ids by feature hashing, no words are kept
+Document    category and length, plus the term ids and term counts as array('i')
+Corpus      a Vocabulary (possibly shared with other corpora), the categories and the documents
+
+A document costs two machine ints per distinct word instead of a dict entry holding a
+two-element list per word, and category and length are attributes rather than magic keys.
+"""
+
+CHUNK_BYTES = 16 << 20 # largest chunk of a dataset file tokenized by one task of a parallel load
+
+"""
+Count the words of a document
+@return (words, counts), distinct words in order of first appearance and their counts
+"""
+def count_words(tokens):
+    position = dict()
+    words = []
+    counts = []
+    for word in tokens:
+        if word not in position:
+            position[word] = len(words)
+            words.append(word)
+            counts.append(0)
+        counts[position[word]] = counts[position[word]] + 1
+    return (words, counts)
+
+# tokenize a line of a dataset file and count its words
+# @return (category, words, counts)
+def split_document(line):
+    tokens = tokenize(line)
+    (words, counts) = count_words(tokens[1:])
+    return (tokens[0], words, counts)
+
+class Vocabulary(object):
+    __slots__ = ("index", "words", "counts")
+    hashed = False
+
+    def __init__(self):
+        self.index = dict() # str --> term id
+        self.words = [] # term id --> str
+        self.counts = [] # term id --> total count
+
+    def __len__(self):
+        return len(self.words)
+
+    def __contains__(self, word):
+        return word in self.index
+
+    # term id of @word, adding it to the vocabulary if needed
+    def add(self, word):
+        termid = self.index.get(word)
+        if termid is None:
+            termid = len(self.words)
+            word = intern(word)
+            self.index[word] = termid
+            self.words.append(word)
+            self.counts.append(0)
+        return termid
+
+    # add @words, distinct words none of which is in the vocabulary, @return their term ids
+    def extend(self, words):
+        first = len(self.words)
+        words = [intern(word) for word in words]
+        self.index.update(izip(words, xrange(first, first + len(words))))
+        self.words.extend(words)
+        self.counts.extend([0] * len(words))
+        return range(first, len(self.words))
+
+    # term id of @word, -1 if it is unknown
+    def get(self, word):
+        return self.index.get(word, -1)
+
+    """
+    Map the words of a document to term ids
+    @grow add unknown words (and the counts to the term totals); otherwise unknown words are dropped
+    @term_ids, @doc_counts array('i') to append to, e.g. the CSR arrays of a batch; new arrays by default
+    @return (term_ids, counts) as array('i')
+    """
+    def map_words(self, words, counts, grow=True, term_ids=None, doc_counts=None):
+        if term_ids is None:
+            (term_ids, doc_counts) = (array("i"), array("i"))
+        for (word, count) in izip(words, counts):
+            if grow:
+                termid = self.add(word)
+                self.counts[termid] = self.counts[termid] + count
+            else:
+                termid = self.index.get(word, -1)
+                if termid == -1:
+                    continue
+            term_ids.append(termid)
+            doc_counts.append(count)
+        return (term_ids, doc_counts)
+
+"""
+Vocabulary of a fixed size 2^hash_bits: a word is mapped to the term id crc32(word) mod 2^hash_bits,
+so the count and parameter arrays have a fixed size and no word is stored. Words sharing a term id
+(collisions) are counted together, and no word is unknown.
+"""
+class HashedVocabulary(object):
+    __slots__ = ("hash_bits", "mask", "counts")
+    hashed = True
+
+    def __init__(self, hash_bits):
+        self.hash_bits = hash_bits
+        self.mask = (1 << hash_bits) - 1
+        self.counts = array("l", [0]) * (1 << hash_bits) # term id --> total count
+
+    def __len__(self):
+        return self.mask + 1
+
+    def __contains__(self, word):
+        return True
+
+    def add(self, word):
+        return zlib.crc32(word) & self.mask
+
+    def get(self, word):
+        return zlib.crc32(word) & self.mask
+
+    """
+    Map the words of a document to term ids, adding up the counts of words that collide
+    @grow add the counts to the term totals
+    @term_ids, @doc_counts see Vocabulary.map_words
+    @return (term_ids, counts) as array('i')
+    """
+    def map_words(self, words, counts, grow=True, term_ids=None, doc_counts=None):
+        position = dict() # term id --> position in term_ids
+        if term_ids is None:
+            (term_ids, doc_counts) = (array("i"), array("i"))
+        mask = self.mask
+        for (word, count) in izip(words, counts):
+            termid = zlib.crc32(word) & mask
+            if termid in position:
+                doc_counts[position[termid]] = doc_counts[position[termid]] + count
+            else:
+                position[termid] = len(term_ids)
+                term_ids.append(termid)
+                doc_counts.append(count)
+            if grow:
+                self.counts[termid] = self.counts[termid] + count
+        return (term_ids, doc_counts)
+
+# a Vocabulary, or a HashedVocabulary of 2^hash_bits terms if @hash_bits is given
+def make_vocabulary(hash_bits=None):
+    if hash_bits is None:
+        return Vocabulary()
+    return HashedVocabulary(hash_bits)
+
+class Document(object):
+    __slots__ = ("category", "length", "term_ids", "counts")
+
+    def __init__(self, category, term_ids, counts):
+        self.category = category # index of the category, -1 if unknown
+        self.term_ids = term_ids
+        self.counts = counts
+        self.length = sum(counts) # number of words
+
+    # iterate over (term id, count)
+    def terms(self):
+        return izip(self.term_ids, self.counts)
+
+class Corpus(object):
+    __slots__ = ("vocabulary", "categories", "category_map", "fixed_categories", "documents")
+
+    """
+    @vocabulary Vocabulary to use, e.g. the one of the training corpus; a new one by default
+    @categories only keep the documents of these categories; every category is kept by default,
+                in order of first appearance
+    """
+    def __init__(self, vocabulary=None, categories=None):
+        if vocabulary is None:
+            vocabulary = Vocabulary()
+        self.vocabulary = vocabulary
+        self.fixed_categories = categories is not None
+        self.categories = list(categories or [])
+        self.category_map = dict((c, i) for (i, c) in enumerate(self.categories))
+        self.documents = []
+
+    def __len__(self):
+        return len(self.documents)
+
+    # index of category @name, -1 if the corpus does not keep it
+    def category_index(self, name):
+        if name not in self.category_map:
+            if self.fixed_categories:
+                return -1
+            self.category_map[name] = len(self.categories)
+            self.categories.append(name)
+        return self.category_map[name]
+
+    """
+    Add a document given its distinct words and their counts
+    @grow add unknown words to the vocabulary; otherwise they are dropped (test documents)
+    @return the new Document, None if its category is not kept
+    """
+    def add(self, category_name, words, counts, grow=True):
+        doc = self.make_document(category_name, words, counts, grow)
+        if doc is not None:
+            self.documents.append(doc)
+        return doc
+
+    # same as add, without keeping the document in the corpus
+    def make_document(self, category_name, words, counts, grow=True):
+        category = self.category_index(category_name)
+        if category == -1:
+            return None
+        (term_ids, doc_counts) = self.vocabulary.map_words(words, counts, grow)
+        return Document(category, term_ids, doc_counts)
+
+    """
+    Read the documents of a dataset file (or of its corpus cache) one at a time, without keeping them
+    in the corpus, so that memory does not grow with the number of documents
+    @grow see add
+    @return generator of Document
+    """
+    def stream(self, datafile, grow=True):
+        cachedir = find_cache(datafile)
+        if cachedir is not None:
+            documents = iter_documents(load_cache(cachedir))
+        else:
+            documents = (split_document(line) for line in open(datafile, "r"))
+        for (category_name, words, counts) in documents:
+            doc = self.make_document(category_name, words, counts, grow)
+            if doc is not None:
+                yield doc
+
+    """
+    Load the documents of a dataset file, from its corpus cache when corpus_cache.py has compiled it
+    @grow see add
+    @return number of documents added
+    """
+    def load(self, datafile, grow=True, processes=1):
+        before = len(self.documents)
+        cachedir = find_cache(datafile)
+        if cachedir is not None and not self.vocabulary.hashed: # load_cache does not merge collisions
+            self.load_cache(load_cache(cachedir), grow)
+        elif processes != 1:
+            self.load_parallel(datafile, grow, processes)
+        else:
+            self.documents.extend(self.stream(datafile, grow))
+        return len(self.documents) - before
+
+    """
+    Load the documents of a dataset file on a process pool: the file is split into chunks of whole
+    lines (split_chunks), every chunk is tokenized and counted by load_chunk with a vocabulary of its
+    own, and the chunks are merged in file order by load_cache, which gives new words their ids in
+    order of first appearance. The documents, term ids and term counts are those of a serial load.
+    @processes number of worker processes, number of CPUs by default
+    """
+    def load_parallel(self, datafile, grow=True, processes=None):
+        for chunk in self.chunks(datafile, processes):
+            self.load_cache(chunk, grow, ordered=True)
+
+    """
+    Tokenize and count a dataset file with load_chunk, in one chunk if @processes is 1, else in chunks
+    of whole lines on a pool of @processes worker processes (number of CPUs if None)
+    @return generator of the chunks in file order, for load_cache or merge_cache with ordered=True
+    """
+    def chunks(self, datafile, processes=1):
+        hash_bits = self.vocabulary.hash_bits if self.vocabulary.hashed else None
+        categories = list(self.categories) if self.fixed_categories else None
+        if processes == 1:
+            yield load_chunk((datafile, 0, os.path.getsize(datafile), categories, hash_bits))
+            return
+        # a few chunks per process, so that the processes finish at about the same time
+        chunk_bytes = min(CHUNK_BYTES, os.path.getsize(datafile) / (4 * (processes or cpu_count())) + 1)
+        tasks = [(datafile, start, end, categories, hash_bits) for (start, end) in split_chunks(datafile, chunk_bytes)]
+        pool = Pool(processes)
+        try:
+            for chunk in pool.imap(load_chunk, tasks):
+                yield chunk
+        finally:
+            pool.close()
+            pool.join()
+
+    """
+    Load the CSR arrays of the documents of a dataset file without making Documents of them: the words
+    are added to the vocabulary and the categories to the corpus, but self.documents is left as it is.
+    From a corpus cache the arrays are those merge_cache returns, memory-mapped when it can; without
+    a cache the file is tokenized straight into CSR arrays by load_chunk.
+    @grow see add
+    @processes see load_parallel, when there is no cache
+    @return (labels, csr), labels is the array of the categories of the documents and
+            csr = (indptr, indices, counts) as documents_csr
+    """
+    def load_csr(self, datafile, grow=True, processes=1):
+        cachedir = find_cache(datafile)
+        if cachedir is not None and not self.vocabulary.hashed: # merge_cache does not merge collisions
+            return self.merge_cache(load_cache(cachedir), grow)
+        parts = [self.merge_cache(chunk, grow, ordered=True) for chunk in self.chunks(datafile, processes)]
+        labels = np.concatenate([part[0] for part in parts])
+        return (labels, concatenate_csr([part[1] for part in parts]))
+
+    """
+    Add the documents of a cache loaded by corpus_cache.load_cache, remapping its term ids at once
+    words is None if the term ids are already those of self.vocabulary (hashed chunks of load_chunk)
+    @ordered the term ids are numbered in order of first appearance in the documents kept (load_chunk)
+    """
+    def load_cache(self, cache, grow=True, ordered=False):
+        (labels, (indptr, term_ids, counts)) = self.merge_cache(cache, grow, ordered)
+        # cut the bytes of the CSR arrays into documents
+        doc_start = (4 * indptr).tolist() # 4 bytes per int32
+        term_bytes = term_ids.tostring()
+        count_bytes = counts.tostring()
+        labels = labels.tolist()
+        for k in range(len(labels)):
+            (s, e) = (doc_start[k], doc_start[k + 1])
+            doc_term_ids = array("i")
+            doc_term_ids.fromstring(term_bytes[s:e])
+            doc_counts = array("i")
+            doc_counts.fromstring(count_bytes[s:e])
+            self.documents.append(Document(labels[k], doc_term_ids, doc_counts))
+
+    """
+    Merge a cache loaded by corpus_cache.load_cache into the vocabulary and the categories of the corpus,
+    see load_cache for @grow and @ordered
+    The offsets and the counts of a memory-mapped cache are returned as views of its pages when every
+    document is kept and no word is dropped, and so are the term ids when the cache numbers its words as
+    the vocabulary does (e.g. a new Vocabulary); otherwise they are copied once, as whole arrays.
+    @return (labels, csr) as load_csr
+    """
+    def merge_cache(self, cache, grow=True, ordered=False):
+        (words, categories, labels, indptr, indices, counts) = cache
+        # plain ndarray views: slicing a np.memmap wraps every slice in a new memmap object
+        (indptr, indices, counts) = (np.asarray(indptr), np.asarray(indices), np.asarray(counts))
+        categories = np.array([self.category_index(c) for c in categories], dtype=np.int64)
+        doc_category = categories[labels]
+        if np.any(doc_category < 0):
+            kept = doc_category >= 0
+            kept_tokens = np.repeat(kept, np.diff(indptr))
+            indices = indices[kept_tokens]
+            counts = counts[kept_tokens]
+            indptr = np.concatenate([[0], np.cumsum(np.diff(indptr)[kept])]).astype(np.int64)
+            doc_category = doc_category[kept]
+        else:
+            ordered = True # corpus_cache numbers the words in order of first appearance in all the documents
+
+        if words is None:
+            remap = np.arange(len(self.vocabulary), dtype=np.int64)
+        else:
+            remap = np.array([self.vocabulary.get(word) for word in words], dtype=np.int64)
+        if grow:
+            # new words get their ids in order of first appearance, as with the text file
+            if ordered:
+                unique = np.flatnonzero(np.bincount(indices, minlength=len(remap)))
+                first_seen = unique
+            else:
+                (unique, first) = np.unique(indices, return_index=True)
+                first_seen = unique[np.argsort(first)]
+            new_terms = first_seen[remap[first_seen] == -1]
+            if len(new_terms) > 0: # never with words None
+                remap[new_terms] = self.vocabulary.extend([words[termid] for termid in new_terms.tolist()])
+            totals = np.bincount(indices, weights=counts, minlength=len(remap))
+            vocabulary_counts = self.vocabulary.counts
+            for (termid, total) in izip(remap[unique].tolist(), totals[unique].astype(np.int64).tolist()):
+                vocabulary_counts[termid] += total
+        if np.array_equal(remap, np.arange(len(remap))):
+            term_ids = indices
+        else:
+            term_ids = remap[indices].astype(np.int32)
+        known = term_ids >= 0
+        if not known.all():
+            # drop the unknown words of all documents at once
+            rows = np.repeat(np.arange(len(doc_category)), np.diff(indptr))
+            indptr = np.concatenate([[0], np.cumsum(np.bincount(rows[known], minlength=len(doc_category)))])
+            (term_ids, counts) = (term_ids[known], counts[known])
+        return (doc_category, (indptr.astype(np.int64, copy=False), term_ids.astype(np.int32, copy=False),
+                               counts.astype(np.int32, copy=False)))
+
+    # number of documents in every category
+    def category_counts(self):
+        docnum = [0] * len(self.categories)
+        for doc in self.documents:
+            docnum[doc.category] = docnum[doc.category] + 1
+        return docnum
+
+"""
+Split @datafile into chunks of about @chunk_bytes, every chunk ending at the end of a line
+@return list of (start, end) byte offsets
+"""
+def split_chunks(datafile, chunk_bytes=CHUNK_BYTES):
+    size = os.path.getsize(datafile)
+    bounds = [0]
+    datafileobj = open(datafile, "rb")
+    while bounds[-1] + chunk_bytes < size:
+        datafileobj.seek(bounds[-1] + chunk_bytes)
+        datafileobj.readline() # the rest of the line belongs to this chunk
+        if datafileobj.tell() >= size:
+            break
+        bounds.append(datafileobj.tell())
+    datafileobj.close()
+    bounds.append(size)
+    return zip(bounds[:-1], bounds[1:])
+
+"""
+Tokenize and count the documents in bytes start..end-1 of a dataset file, with a vocabulary of their own
+@task (datafile, start, end, categories, hash_bits); only the documents of @categories are kept, all of
+      them if it is None; with hash_bits the words are hashed as by HashedVocabulary(hash_bits)
+@return (words, categories, labels, indptr, indices, counts) as corpus_cache.load_cache, for Corpus.load_cache;
+        words is None with hash_bits
+"""
+def load_chunk(task):
+    (datafile, start, end, categories, hash_bits) = task
+    datafileobj = open(datafile, "rb")
+    datafileobj.seek(start)
+    lines = datafileobj.read(end - start).split("\n")
+    datafileobj.close()
+    if lines[-1] == "":
+        lines.pop() # the chunk ends with a newline, as a file iterated line by line
+    vocabulary = make_vocabulary(hash_bits)
+    chunk = Corpus(vocabulary, categories) # for its categories only, the documents go straight into CSR arrays
+    labels = []
+    lengths = []
+    indices = array("i")
+    counts = array("i")
+    for line in lines:
+        (category_name, words, word_counts) = split_document(line)
+        category = chunk.category_index(category_name)
+        if category == -1:
+            continue
+        (term_ids, doc_counts) = vocabulary.map_words(words, word_counts)
+        labels.append(category)
+        lengths.append(len(term_ids))
+        indices.extend(term_ids)
+        counts.extend(doc_counts)
+    indptr = np.concatenate([[0], np.cumsum(lengths)]).astype(np.int64)
+    return (None if vocabulary.hashed else vocabulary.words, chunk.categories, np.array(labels, dtype=np.int64),
+            indptr, np.frombuffer(indices, dtype=np.int32), np.frombuffer(counts, dtype=np.int32))
+
+"""
+CSR arrays of a list of documents
+@return (indptr, indices, counts), the terms of document i are indices[indptr[i] : indptr[i+1]]
+"""
+def documents_csr(documents):
+    lengths = [len(doc.term_ids) for doc in documents]
+    indptr = np.concatenate([[0], np.cumsum(lengths)]).astype(np.int64)
+    # concatenate the arrays of all the documents, then view them without a copy
+    indices = array("i")
+    counts = array("i")
+    for doc in documents:
+        indices.extend(doc.term_ids)
+        counts.extend(doc.counts)
+    return (indptr, np.frombuffer(indices, dtype=np.int32), np.frombuffer(counts, dtype=np.int32))
+
+"""
+CSR arrays of the rows of several CSR matrices, one after the other
+@return (indptr, indices, counts), @csrs[0] itself if there is only one
+"""
+def concatenate_csr(csrs):
+    if len(csrs) == 1:
+        return csrs[0]
+    offsets = np.cumsum([0] + [csr[0][-1] for csr in csrs[:-1]])
+    indptr = np.concatenate([[0]] + [csr[0][1:] + offset for (csr, offset) in zip(csrs, offsets)])
+    return (indptr.astype(np.int64), np.concatenate([csr[1] for csr in csrs]),
+            np.concatenate([csr[2] for csr in csrs]))
+
+"""
+Document frequency of every term: the number of documents it appears in, in one pass
+@documents list or generator of Document
+@V size of vocabulary, df grows past it for generators that add words
+@return (df, N), df is a list indexed by term id and N the number of documents
+"""
+def document_frequency(documents, V):
+    df = [0] * V
+    N = 0
+    for doc in documents:
+        N = N + 1
+        for index in doc.term_ids: # distinct terms, so one per document
+            if index >= len(df):
+                df.extend([0] * (index + 1 - len(df)))
+            df[index] = df[index] + 1
+    return (df, N)
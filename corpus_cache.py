@@ -0,0 +1,148 @@
+#! /usr/bin/env python
+import os
+import sys
+
+import numpy as np
+
+"""
+Binary corpus cache for the stemmed dataset files.
+
+A dataset file (one document per line: category, a tab, then the words) is compiled once
+into a directory <datafile>.cache holding
+    vocabulary.txt  the words of the file, one per line, the line number is the term id
+    categories.txt  the categories of the file, one per line, the line number is the label
+    labels.npy      label of every document
+    indptr.npy      CSR offsets: the terms of document i are indptr[i]..indptr[i+1]-1
+    indices.npy     term ids, in order of first appearance in the document
+    counts.npy      term counts
+    version.txt     CACHE_VERSION
+The arrays are memory-mapped on load, so processes reading the same cache share its pages.
+
+Usage: python ./corpus_cache.py datafile [datafile ...]
+"""
+
+CACHE_VERSION = 1
+
+# same tokenization as the loaders of the other scripts
+def tokenize(line):
+    line = line.replace("\t", " ") # raplace \t
+    line = line.replace("\n", "") # remove \n
+    return line.split(" ")
+
+def cache_path(datafile):
+    return datafile + ".cache"
+
+"""
+Compile @datafile into a cache directory (by default cache_path(datafile))
+@return the cache directory
+"""
+def compile_cache(datafile, cachedir=None):
+    if cachedir is None:
+        cachedir = cache_path(datafile)
+    vocabulary = dict() # str --> term id
+    categories = dict() # str --> label
+    labels = []
+    indptr = [0]
+    indices = []
+    counts = []
+    for line in open(datafile, "r"):
+        line = tokenize(line)
+        if line[0] not in categories:
+            categories[line[0]] = len(categories)
+        labels.append(categories[line[0]])
+        docterms = dict() # term id --> position in indices
+        for word in line[1:]:
+            if word not in vocabulary:
+                vocabulary[word] = len(vocabulary)
+            termid = vocabulary[word]
+            if termid not in docterms:
+                docterms[termid] = len(indices)
+                indices.append(termid)
+                counts.append(0)
+            counts[docterms[termid]] = counts[docterms[termid]] + 1
+        indptr.append(len(indices))
+
+    if not os.path.isdir(cachedir):
+        os.makedirs(cachedir)
+    write_words(os.path.join(cachedir, "vocabulary.txt"), vocabulary)
+    write_words(os.path.join(cachedir, "categories.txt"), categories)
+    np.save(os.path.join(cachedir, "labels.npy"), np.array(labels, dtype=np.int32))
+    np.save(os.path.join(cachedir, "indptr.npy"), np.array(indptr, dtype=np.int64))
+    np.save(os.path.join(cachedir, "indices.npy"), np.array(indices, dtype=np.int32))
+    np.save(os.path.join(cachedir, "counts.npy"), np.array(counts, dtype=np.int32))
+    # written last: a cache without version.txt is incomplete
+    f = open(os.path.join(cachedir, "version.txt"), "w")
+    f.write(str(CACHE_VERSION) + "\n")
+    f.close()
+    return cachedir
+
+# write the keys of a str --> id mapping, one per line in id order
+def write_words(path, mapping):
+    words = [None] * len(mapping)
+    for word, index in mapping.iteritems():
+        words[index] = word
+    f = open(path, "w")
+    for word in words:
+        f.write(word + "\n")
+    f.close()
+
+def read_words(path):
+    return [word[:-1] for word in open(path, "r")] # strip "\n" only, "" is a valid word
+
+"""
+Load a cache directory, memory-mapping the arrays
+@return (vocabulary, categories, labels, indptr, indices, counts), vocabulary and categories are lists
+"""
+def load_cache(cachedir):
+    version = int(open(os.path.join(cachedir, "version.txt"), "r").read())
+    if version != CACHE_VERSION:
+        raise ValueError("Cache " + cachedir + " has version " + str(version) + ", expected " + str(CACHE_VERSION))
+    vocabulary = read_words(os.path.join(cachedir, "vocabulary.txt"))
+    categories = read_words(os.path.join(cachedir, "categories.txt"))
+    arrays = [np.load(os.path.join(cachedir, name + ".npy"), mmap_mode="r")
+              for name in ("labels", "indptr", "indices", "counts")]
+    return tuple([vocabulary, categories] + arrays)
+
+"""
+Find an up-to-date cache for @datafile
+@return the cache directory, or None if there is no complete cache or @datafile is newer
+"""
+def find_cache(datafile):
+    cachedir = cache_path(datafile)
+    stamp = os.path.join(cachedir, "version.txt")
+    if not os.path.exists(stamp):
+        return None
+    if os.path.exists(datafile) and os.path.getmtime(datafile) > os.path.getmtime(stamp):
+        return None
+    return cachedir
+
+"""
+Iterate over the documents of a loaded cache
+@return generator of (category, words, counts), words and counts are lists in the order of
+        first appearance in the document
+"""
+def iter_documents(cache):
+    (vocabulary, categories, labels, indptr, indices, counts) = cache
+    # plain ndarray views: slicing a np.memmap wraps every slice in a new memmap object
+    indices = np.asarray(indices)
+    counts = np.asarray(counts)
+    indptr = indptr.tolist()
+    labels = labels.tolist()
+    for i in range(len(labels)):
+        start = indptr[i]
+        end = indptr[i + 1]
+        words = [vocabulary[t] for t in indices[start:end].tolist()]
+        yield (categories[labels[i]], words, counts[start:end].tolist())
+
+def main(argv):
+    if len(argv) < 2:
+        print "Usage: python ./corpus_cache.py datafile [datafile ...]"
+        exit()
+    for datafile in argv[1:]:
+        cachedir = compile_cache(datafile)
+        (vocabulary, categories, labels, indptr, indices, counts) = load_cache(cachedir)
+        print cachedir + ": " + str(len(labels)) + " documents, " + str(len(vocabulary)) + " words, " \
+            + str(len(categories)) + " categories"
+
+if __name__ == "__main__":
+    main(sys.argv)
@@ -1,52 +1,128 @@
 #! /usr/bin/env python
 import sys
-from operator import itemgetter # for sort
 
-from generate_svm_datafile import caculate_idf, load_data
+import numpy as np
+
+from generate_svm_datafile import scan_data, svm_label, write_rows, format_svm_row
+from corpus import Corpus, Vocabulary
+from naive_bayes import used_category
 
 """
 Generate data files for R kNN
+Formats:
+dense     one row per doc: the label, then the tf*idf of every term of the vocabulary,
+          0.0 for terms not in the doc (<file>-R-data.csv, read by kNN.R)
+mtx       Matrix Market coordinate file of the same matrix, the label is column 1 and
+          term index i is column i+2 (<file>-R-data.mtx, Matrix::readMM)
+svmlight  label index:tf*idf ..., index starts with 1 (<file>-kNN-data.svmlight)
+npz       float32 CSR arrays of the tf*idf, N x V, with the labels in a separate array
+          (<file>-kNN-data.npz, np.load or scipy.sparse.load_npz)
+Only the dense format writes the zeros.
 """
 
-magic_key_set = set(["_CATEGORY", "_NUM_WORDS"])
+FORMATS = ["dense", "mtx", "svmlight", "npz"]
+SUFFIX = dict({"dense": "-R-data.csv", "mtx": "-R-data.mtx", "svmlight": "-kNN-data.svmlight",
+               "npz": "-kNN-data.npz"})
+
+MM_BANNER = "%%MatrixMarket matrix coordinate real general\n"
+MM_SIZE_WIDTH = 40 # the size line is padded to this width, it is filled in once the entries are written
+
+# format a doc as a dense row: label, then tf*idf of every term in index order
+def format_dense_row(doc, idf):
+    features = ["0.0"] * len(idf)
+    for (index, tf) in doc.terms():
+        features[index] = str(tf*idf[index])
+    return svm_label(doc) + " " + " ".join(features) + " \n"
+
+"""
+Formatter of Matrix Market rows, numbering the docs from 1
+@size [rows, entries], updated by every call
+@return function (doc, idf) --> str
+"""
+def matrix_market_formatter(size):
+    def format_row(doc, idf):
+        size[0] = size[0] + 1
+        row = str(size[0]) + " "
+        features = sorted(doc.terms()) # sort by index
+        size[1] = size[1] + len(features) + 1
+        return row + "1 " + svm_label(doc) + "\n" \
+            + "".join([row + str(index + 2) + " " + str(tf*idf[index]) + "\n" for (index, tf) in features])
+    return format_row
+
+def generate_data_file(doclist, outfile_path, idf):
+    return write_rows(doclist, outfile_path, idf, format_dense_row)
+
+def generate_mtx_file(doclist, outfile_path, idf):
+    size = [0, 0]
+    n = write_rows(doclist, outfile_path, idf, matrix_market_formatter(size),
+                   MM_BANNER + " " * MM_SIZE_WIDTH + "\n")
+    outfile = open(outfile_path, "r+")
+    outfile.seek(len(MM_BANNER))
+    outfile.write((str(size[0]) + " " + str(len(idf) + 1) + " " + str(size[1])).ljust(MM_SIZE_WIDTH))
+    outfile.close()
+    return n
 
-def generate_data_file(doclist, outfile_path, vocabulary):
+def generate_svmlight_file(doclist, outfile_path, idf):
+    return write_rows(doclist, outfile_path, idf, format_svm_row)
+
+"""
+Write the tf*idf of the docs as float32 CSR arrays in the layout of scipy.sparse.save_npz,
+plus the labels (-1 or 1) of the docs
+"""
+def generate_npz_file(doclist, outfile_path, idf):
     print "Writting to file: " + outfile_path
-    outfile = open(outfile_path, "w")
+    idf = np.asarray(idf)
+    lengths = []
+    indices = []
+    data = []
+    labels = []
     for doc in doclist:
-        features = [] # element will be: [index, tf*idf]
-        if doc["_CATEGORY"] == 0:
-            label = -1
-        else:
-            label = +1
-        outfile.write(str(label) + " ") # output the label
-        for key, value in vocabulary.iteritems():
-            if key in magic_key_set:
-                continue
-            idf = vocabulary[key][2]
-            index = vocabulary[key][0] + 1 # feature index must start with 1, not 0
-            if key in doc:
-                tf = doc[key][1]
-            else:
-                tf = 0
-            features.append([index, tf*idf])
-        features = sorted(features, key=itemgetter(0)) # sort by index
-        for f in features:
-            outfile.write(str(f[1]) + " ")
-        outfile.write("\n")
+        term_ids = np.frombuffer(doc.term_ids, dtype=np.int32)
+        order = np.argsort(term_ids) # sort by index
+        term_ids = term_ids[order]
+        lengths.append(len(term_ids))
+        indices.append(term_ids)
+        data.append((np.frombuffer(doc.counts, dtype=np.int32)[order] * idf[term_ids]).astype(np.float32))
+        labels.append(int(svm_label(doc)))
+    n = len(labels)
+    outfile = open(outfile_path, "wb")
+    np.savez(outfile, format="csr", shape=np.array([n, len(idf)]),
+             indptr=np.concatenate([[0], np.cumsum(lengths)]).astype(np.int64),
+             indices=np.concatenate(indices + [np.zeros(0, dtype=np.int32)]),
+             data=np.concatenate(data + [np.zeros(0, dtype=np.float32)]),
+             labels=np.array(labels, dtype=np.int8))
     outfile.close()
+    print "Number of docs:  " + str(n)
+    return n
+
+"""
+Load a file written by generate_npz_file
+@return (labels, (indptr, indices, data), V)
+"""
+def load_npz_file(path):
+    arrays = np.load(path)
+    (N, V) = arrays["shape"]
+    return (arrays["labels"], (arrays["indptr"], arrays["indices"], arrays["data"]), int(V))
+
+GENERATORS = dict({"dense": generate_data_file, "mtx": generate_mtx_file, "svmlight": generate_svmlight_file,
+                   "npz": generate_npz_file})
 
 def main(argv):
-    print "Usage: python ./generate_kNN_datafile train_file test_file"
-    vocabulary = dict() # vocabulary for the whole dataset
-    
-    traindoclist = load_data(argv[1], vocabulary)
-    testdoclist = load_data(argv[2], vocabulary)
+    print "Usage: python ./generate_kNN_datafile train_file test_file [" + "|".join(FORMATS) + "]"
+    output_format = "dense"
+    if len(argv) >= 4:
+        output_format = argv[3]
+    if output_format not in GENERATORS:
+        print "Unknown format: " + output_format
+        exit()
+    vocabulary = Vocabulary() # vocabulary for the whole dataset
+
+    idf = scan_data(argv[1], argv[2], vocabulary)
     print "Vocabulary size: " + str(len(vocabulary))
-    caculate_idf(traindoclist, vocabulary)
-    # generate csv format data file
-    generate_data_file(traindoclist, argv[1] + "-R-data.csv", vocabulary)
-    generate_data_file(testdoclist, argv[2] + "-R-data.csv", vocabulary)    
+    # generate the data file
+    for filepath in argv[1:3]:
+        docs = Corpus(vocabulary, used_category).stream(filepath, grow=False)
+        GENERATORS[output_format](docs, filepath + SUFFIX[output_format], idf)
 
 if __name__ == "__main__":
     main(sys.argv)
@@ -1,83 +1,101 @@
 #! /usr/bin/env python
 import sys
 import math
+from array import array
 
-from operator import itemgetter # for sort
-
-from naive_bayes import build_vocabulary, extract_token
+from corpus import Corpus, make_vocabulary, document_frequency
+from naive_bayes import used_category
 
 """
 Generate data files for SVM training
 Detail:
 Use tf*idf as features for words
+Documents are streamed from the dataset files: one pass collects the vocabulary and the idf,
+a second pass formats and writes the rows, so memory does not grow with the number of documents.
 """
 
 NUM_CATEGORY = 2 # number of categories
-magic_key_set = set(["_CATEGORY", "_NUM_WORDS"])
+BUFFER_SIZE = 1 << 20 # bytes buffered by the output file
+ROWS_PER_WRITE = 256 # rows formatted before each write
 
-# caculate idf for each term in vocabulary
+# caculate idf for each term in vocabulary, from the document frequencies collected in one pass
+# @traindoclist list or generator of training docs
+# @return array of idf, indexed by term index
 def caculate_idf(traindoclist, vocabulary):
-    N = len(traindoclist)
-    for key, value in vocabulary.iteritems():
-        if key in magic_key_set:
-            continue
-        count = 1 # just in case count == 0 after the searching below
-        for doc in traindoclist:
-            if key in doc:
-                count = count + 1
-        idf = math.log(N * 1.0 / count)
-        value = [value[0], value[1], idf]
-        vocabulary[key] = value
+    (df, N) = document_frequency(traindoclist, len(vocabulary))
+    return idf_weights(df, N, len(vocabulary))
 
-def load_data(filepath, vocabulary):
-    fsource = open(filepath, "r")
-    doclist = []
-    for line in fsource:
-        (docdict, category) = extract_token(line)
-        if category == -1:
-            continue
-        build_vocabulary(docdict, vocabulary)
-        doclist.append(docdict)
-        
-    print "Number of docs:  " + str(len(doclist))
-    
-    return doclist
+# idf from the document frequencies @df of @N training docs, for a vocabulary of size @V
+def idf_weights(df, N, V):
+    df = df + [0] * (V - len(df))
+    # count starts from 1, just in case a term does not appear in any training doc
+    return array("d", [math.log(N * 1.0 / (count + 1)) for count in df])
+
+"""
+First pass over the data: build the vocabulary of both files and the idf of the training docs
+without keeping any document
+@categories categories of the docs to scan, None for all of them
+@return idf
+"""
+def scan_data(train_file, test_file, vocabulary, categories=used_category):
+    (df, N) = document_frequency(Corpus(vocabulary, categories).stream(train_file), len(vocabulary))
+    for doc in Corpus(vocabulary, categories).stream(test_file):
+        pass # only adds the words of the test docs to the vocabulary
+    return idf_weights(df, N, len(vocabulary))
+
+# category "course" --> -1, "faculty" --> 1
+def svm_label(doc):
+    if doc.category == 0:
+        return "-1"
+    return "1"
+
+# format a doc as a svm-format row: label index:tf*idf ..., feature index must start with 1, not 0
+def format_svm_row(doc, idf):
+    features = sorted(doc.terms()) # sort by index
+    return svm_label(doc) + " " + "".join([str(index + 1) + ":" + str(tf*idf[index]) + " " for (index, tf) in features]) + "\n"
+
+"""
+Write one row per doc to @outfile_path through a large buffer
+@docs list or generator of docs, consumed lazily
+@format_row function (doc, idf) --> str
+@header written before the rows
+@return number of docs written
+"""
+def write_rows(docs, outfile_path, idf, format_row, header=""):
+    print "Writting to file: " + outfile_path
+    outfile = open(outfile_path, "w", BUFFER_SIZE)
+    outfile.write(header)
+    rows = []
+    n = 0
+    for doc in docs:
+        rows.append(format_row(doc, idf))
+        if len(rows) == ROWS_PER_WRITE:
+            outfile.write("".join(rows))
+            n = n + len(rows)
+            rows = []
+    outfile.write("".join(rows))
+    n = n + len(rows)
+    outfile.close()
+    print "Number of docs:  " + str(n)
+    return n
     
 # generate svm-format data file
 # Use tf*idf as features, and category "course" --> -1, "faculty" --> 1
-def generate_data_file(doclist, outfile_path, vocabulary):
-    print "Writting to file: " + outfile_path
-    outfile = open(outfile_path, "w")
-    for doc in doclist:
-        features = [] # element will be: [index, tf*idf]
-        if doc["_CATEGORY"] == 0:
-            label = -1
-        else:
-            label = +1
-        outfile.write(str(label) + " ") # output the label
-        for key, value in doc.iteritems():
-            if key in magic_key_set:
-                continue
-            idf = vocabulary[key][2]
-            index = vocabulary[key][0] + 1 # feature index must start with 1, not 0
-            tf = doc[key][1]
-            features.append([index, tf*idf])
-        features = sorted(features, key=itemgetter(0)) # sort by index
-        for f in features:
-            outfile.write(str(f[0]) + ":" + str(f[1]) + " ")
-        outfile.write("\n")
-    outfile.close()
+def generate_data_file(doclist, outfile_path, idf):
+    return write_rows(doclist, outfile_path, idf, format_svm_row)
 
 def main(argv):
-    print "Usage: python ./generate-svm-datafile train_file test_file"
-    vocabulary = dict() # vocabulary for the whole dataset
-    traindoclist = load_data(argv[1], vocabulary)
-    testdoclist = load_data(argv[2], vocabulary)
+    print "Usage: python ./generate-svm-datafile train_file test_file [hash_bits]"
+    hash_bits = None # with hash_bits, words are hashed into 2^hash_bits features
+    if len(argv) >= 4:
+        hash_bits = int(argv[3])
+    vocabulary = make_vocabulary(hash_bits) # vocabulary for the whole dataset
+    idf = scan_data(argv[1], argv[2], vocabulary)
     print "Vocabulary size: " + str(len(vocabulary))
-    caculate_idf(traindoclist, vocabulary)
     # output the data file
-    generate_data_file(traindoclist, argv[1] + "-svm-data.txt", vocabulary)
-    generate_data_file(testdoclist, argv[2] + "-svm-data.txt", vocabulary)
+    for filepath in argv[1:3]:
+        docs = Corpus(vocabulary, used_category).stream(filepath, grow=False)
+        generate_data_file(docs, filepath + "-svm-data.txt", idf)
     
 if __name__ == "__main__":
     main(sys.argv)
@@ -0,0 +1,215 @@
+#! /usr/bin/env python
+import sys
+import time
+import argparse
+
+import numpy as np
+
+from corpus import Corpus, Vocabulary
+from naive_bayes import read_batches
+from sparse_gibbs import build_csr, count_word_csr, doc_log_likelihood, sweep, update_theta, record_vote
+
+"""
+Long-lived Gibbs sampler of the sparse backend for test documents arriving in batches.
+
+NB_with_Gibbs.py labels a fixed set of test documents: every new batch means reloading the
+training data, random labels and a full burn-in. A GibbsSession keeps the state of the chain in
+memory instead: the word counts of the training documents (the training documents themselves are
+not kept, their labels never change), the word counts of the classes under the current labels,
+the number of test documents in each class and theta.
+
+add() appends a batch to the sampled documents. The newcomers start from their most probable label
+under the current theta, and a few local sweeps over the newcomers alone, each followed by a new
+theta, settle them before they join the others: since the rest of the chain is already mixed, this
+short local burn-in replaces the burn-in of a whole new run. step() runs one sweep over every test
+document in the session and records its votes, retire() removes test documents, e.g. the oldest
+ones once they have been labelled, and returns their labels by majority vote.
+"""
+
+LOCAL_BURNIN = 3 # local sweeps over the newcomers of every batch
+
+class GibbsSession(object):
+    __slots__ = ("K", "V", "hyper_gamma", "hyper_multi", "rng", "train_word_count", "word_count",
+                 "class_count", "theta", "log_theta", "docs", "ids", "labels", "class_vote", "csr", "next_id")
+
+    """
+    @docset training documents, corpus.Document whose category is its class 0..K-1
+    @K number of classes, @V size of the vocabulary
+    @hyper_gamma K array, Dirichlet prior over the classes; every value must be greater than 1, since a
+                 class without documents has the prior class_count + hyper_gamma - 1
+    @hyper_multi prior of the word distributions, a scalar or a V array
+    @seed seed of the random generator of the session
+    """
+    def __init__(self, docset, K, V, hyper_gamma, hyper_multi=1.0, seed=None):
+        if np.min(hyper_gamma) <= 1:
+            raise ValueError("hyper_gamma must be greater than 1, got " + str(list(hyper_gamma)))
+        self.K = K
+        self.V = V
+        self.hyper_gamma = np.asarray(hyper_gamma, dtype=np.float64)
+        self.hyper_multi = hyper_multi
+        self.rng = np.random.RandomState(seed)
+        train_labels = np.array([doc.category for doc in docset], dtype=np.int64)
+        self.train_word_count = count_word_csr(build_csr(docset), train_labels, K, V)
+        self.word_count = self.train_word_count.copy() # training and test documents under their labels
+        self.class_count = np.zeros(K, dtype=np.int64) # number of test documents in each class
+        (self.theta, self.log_theta) = update_theta(self.word_count, hyper_multi, self.rng)
+        self.docs = [] # test documents in the session, oldest first
+        self.ids = np.zeros(0, dtype=np.int64) # id of every test document, given by add
+        self.labels = np.zeros(0, dtype=np.int64)
+        self.class_vote = np.zeros((K, 0), dtype=np.int64)
+        self.csr = None # CSR arrays of self.docs, built again once they change
+        self.next_id = 0
+
+    # number of test documents in the session
+    def __len__(self):
+        return len(self.docs)
+
+    """
+    Make room for the words added to the vocabulary since the last batch
+    Their counts are 0, and theta is drawn again over the new vocabulary.
+    """
+    def grow(self, V):
+        for name in ("train_word_count", "word_count"):
+            counts = getattr(self, name)
+            grown = np.zeros((self.K, V))
+            grown[:, :self.V] = counts
+            setattr(self, name, grown)
+        if not np.isscalar(self.hyper_multi):
+            self.hyper_multi = np.concatenate([self.hyper_multi, np.ones(V - self.V)])
+        self.V = V
+        self.update_theta()
+
+    def update_theta(self):
+        (self.theta, self.log_theta) = update_theta(self.word_count, self.hyper_multi, self.rng)
+
+    """
+    Append a batch of test documents to the session
+    @docs corpus.Document, with term ids of the vocabulary of the training documents
+    @V size of the vocabulary, if words were added to it since the last batch
+    @burnin number of local sweeps over the batch
+    @return array of the ids of the documents
+    """
+    def add(self, docs, V=None, burnin=LOCAL_BURNIN):
+        if V is not None and V > self.V:
+            self.grow(V)
+        n = len(docs)
+        csr = build_csr(docs)
+        # warm start: the most probable label under the current theta and class counts
+        ln_pr = doc_log_likelihood(self.log_theta, csr, 0) \
+            + np.log(self.class_count + self.hyper_gamma - 1.0)[:, np.newaxis]
+        labels = ln_pr.argmax(axis=0)
+        self.class_count += np.bincount(labels, minlength=self.K)
+        self.word_count += count_word_csr(csr, labels, self.K, self.V)
+        for b in range(burnin):
+            old_labels = labels.copy()
+            sweep(labels, self.class_count, n, 0, self.hyper_gamma, self.log_theta, csr, self.rng)
+            self.word_count += count_word_csr(csr, labels, self.K, self.V) \
+                - count_word_csr(csr, old_labels, self.K, self.V)
+            self.update_theta()
+
+        ids = np.arange(self.next_id, self.next_id + n, dtype=np.int64)
+        self.next_id = self.next_id + n
+        self.docs.extend(docs)
+        self.ids = np.concatenate([self.ids, ids])
+        self.labels = np.concatenate([self.labels, labels])
+        self.class_vote = np.hstack([self.class_vote, np.zeros((self.K, n), dtype=np.int64)])
+        self.csr = None
+        return ids
+
+    """
+    One sweep over every test document in the session, then a new theta; the labels are voted
+    @return number of labels changed
+    """
+    def step(self):
+        if self.csr is None:
+            self.csr = build_csr(self.docs)
+        change_count = sweep(self.labels, self.class_count, len(self.docs), 0, self.hyper_gamma, self.log_theta,
+                             self.csr, self.rng)
+        self.word_count = self.train_word_count + count_word_csr(self.csr, self.labels, self.K, self.V)
+        self.update_theta()
+        record_vote(self.class_vote, self.labels)
+        return change_count
+
+    # @return labels of the test documents by majority vote, their current label if never voted
+    def predict(self):
+        voted = self.class_vote.sum(axis=0) > 0
+        return np.where(voted, self.class_vote.argmax(axis=0), self.labels)
+
+    """
+    Remove test documents from the session, their words no longer count for theta
+    @ids ids given by add
+    @return (ids, labels) of the documents removed, labels by majority vote
+    """
+    def retire(self, ids):
+        removed = np.in1d(self.ids, ids)
+        index = np.flatnonzero(removed)
+        labels = self.labels[index]
+        self.word_count -= count_word_csr(build_csr([self.docs[k] for k in index]), labels, self.K, self.V)
+        self.class_count -= np.bincount(labels, minlength=self.K)
+        result = (self.ids[index], self.predict()[index])
+
+        kept = np.flatnonzero(~removed)
+        self.docs = [self.docs[k] for k in kept]
+        self.ids = self.ids[kept]
+        self.labels = self.labels[kept]
+        self.class_vote = self.class_vote[:, kept]
+        self.csr = None
+        return result
+
+    # retire the @n oldest test documents, @return see retire
+    def retire_oldest(self, n):
+        return self.retire(self.ids[:n])
+
+def main(argv):
+    parser = argparse.ArgumentParser(description="Label the documents of test_file batch by batch with one "
+                                     "long-lived Gibbs chain")
+    parser.add_argument("data_file")
+    parser.add_argument("test_file")
+    parser.add_argument("--batch-size", type=int, default=200, help="test documents added at a time")
+    parser.add_argument("--window", type=int, default=1000,
+                        help="test documents kept in the session, the oldest are retired beyond it")
+    parser.add_argument("--burnin", type=int, default=LOCAL_BURNIN, help="local sweeps over every new batch")
+    parser.add_argument("--sweeps", type=int, default=5, help="sweeps over the whole session after every batch")
+    parser.add_argument("--all-categories", action="store_true",
+                        help="classify among all categories of data_file instead of acq and alum")
+    parser.add_argument("--seed", type=int, default=None, help="seed of the random generator of the session")
+    args = parser.parse_args(argv[1:])
+
+    vocabulary = Vocabulary()
+    if args.all_categories:
+        train = Corpus(vocabulary)
+    else:
+        train = Corpus(vocabulary, ["acq", "alum"])
+    train.load(args.data_file)
+    K = len(train.categories)
+    start = time.time()
+    session = GibbsSession(train.documents, K, len(vocabulary), [2] * K, seed=args.seed)
+    print "Session of %d training documents, %d classes, ready in %.3f s" % (len(train), K, time.time() - start)
+
+    test = Corpus(vocabulary, train.categories)
+    truth = [] # category of every test document, by id
+    (correct, labelled, latency) = (0, 0, [])
+    def retire(n):
+        (ids, labels) = session.retire_oldest(n)
+        return int(np.sum(labels == np.array([truth[k] for k in ids])))
+    for (b, batch) in enumerate(read_batches(test.stream(args.test_file), args.batch_size)):
+        start = time.time()
+        truth.extend([doc.category for doc in batch])
+        session.add(batch, len(vocabulary), args.burnin)
+        change_count = 0
+        for s in range(args.sweeps):
+            change_count = change_count + session.step()
+        if len(session) > args.window:
+            labelled = labelled + len(session) - args.window
+            correct = correct + retire(len(session) - args.window)
+        latency.append(time.time() - start)
+        print "Batch #%d: %d documents, %d in the session, %d changes, %.3f s" % (b, len(batch), len(session),
+                                                                               change_count, latency[-1])
+    labelled = labelled + len(session)
+    correct = correct + retire(len(session))
+    if labelled > 0:
+        print "Classification accuracy: " + str(correct * 1.0 / labelled)
+        print "Mean latency per batch: %.3f s" % np.mean(latency)
+
+if __name__ == "__main__":
+    main(sys.argv)
@@ -0,0 +1,182 @@
+#! /usr/bin/env python
+import sys
+import time
+import argparse
+from multiprocessing import Pool
+
+import numpy as np
+
+from corpus import Corpus, Vocabulary, documents_csr
+from generate_svm_datafile import caculate_idf
+from naive_bayes import used_category
+from sparse_gibbs import segment_sum
+
+"""
+kNN classifier with cosine similarity over tf*idf vectors, the Python counterpart of kNN.R.
+
+The training docs are kept as an inverted index: for every term, the training docs it appears
+in (its postings) with their normalized tf*idf weight. A query only walks the postings of its
+own terms, so only the training docs sharing a term with it get a score. Queries are scored in
+batches, every batch accumulating the scores of its queries at once, and the batches can be
+spread over a process pool.
+
+Usage: python ./kNN.py train_file test_file [-k 10] [--batch-size 256] [--processes P] [--all-categories]
+"""
+
+"""
+tf*idf vectors of @docs, normalized to unit length
+@return (indptr, indices, weights), CSR arrays
+"""
+def tfidf_vectors(docs, idf):
+    (indptr, indices, counts) = documents_csr(docs)
+    weights = counts * np.asarray(idf)[indices]
+    norms = np.sqrt(segment_sum(weights * weights, indptr))
+    norms[norms == 0] = 1 # docs without any known term stay zero vectors
+    return (indptr, indices, weights / np.repeat(norms, np.diff(indptr)))
+
+"""
+Build the inverted index of the training vectors
+@V size of vocabulary
+@return (post_ptr, post_docs, post_weights), the postings of term t are post_docs[post_ptr[t] : post_ptr[t+1]]
+"""
+def build_index(vectors, V):
+    (indptr, indices, weights) = vectors
+    doc_of_token = np.repeat(np.arange(len(indptr) - 1, dtype=np.int32), np.diff(indptr))
+    order = np.argsort(indices, kind="mergesort") # postings in doc order
+    post_ptr = np.concatenate([[0], np.cumsum(np.bincount(indices, minlength=V))]).astype(np.int64)
+    return (post_ptr, doc_of_token[order], weights[order])
+
+"""
+Cosine similarity of the queries first..last-1 to every training doc
+@queries tfidf_vectors of the query docs, with term ids of the index's vocabulary
+@trainN number of training docs
+@return (last - first) x trainN array
+"""
+def score_batch(index, trainN, queries, first, last):
+    (post_ptr, post_docs, post_weights) = index
+    (indptr, indices, weights) = queries
+    terms = indices[indptr[first] : indptr[last]]
+    query_of_term = np.repeat(np.arange(last - first), np.diff(indptr[first : last + 1]))
+    starts = post_ptr[terms]
+    lengths = post_ptr[terms + 1] - starts
+    # positions of all postings of all terms, term after term
+    positions = np.arange(lengths.sum()) + np.repeat(starts - (np.cumsum(lengths) - lengths), lengths)
+    scores = np.bincount(np.repeat(query_of_term, lengths) * trainN + post_docs[positions],
+                         weights=np.repeat(weights[indptr[first] : indptr[last]], lengths) * post_weights[positions],
+                         minlength=(last - first) * trainN)
+    return scores.reshape(last - first, trainN)
+
+"""
+Top @k training docs of every row of @scores
+@return (neighbours, similarities), rows x k arrays sorted by decreasing similarity
+"""
+def top_k(scores, k):
+    k = min(k, scores.shape[1])
+    neighbours = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+    similarities = np.take_along_axis(scores, neighbours, axis=1)
+    order = np.argsort(-similarities, axis=1, kind="mergesort")
+    return (np.take_along_axis(neighbours, order, axis=1), np.take_along_axis(similarities, order, axis=1))
+
+"""
+Majority vote of the neighbours sharing at least one term with the query, ties broken by
+the summed similarity
+@K number of classes
+@return predicted class of every row
+"""
+def vote(neighbours, similarities, train_labels, K):
+    (rows, k) = neighbours.shape
+    votes = np.zeros((rows, K))
+    row_index = np.repeat(np.arange(rows), k)
+    neighbour_labels = train_labels[neighbours].ravel()
+    shared = (similarities > 0).ravel()
+    np.add.at(votes, (row_index, neighbour_labels), shared)
+    np.add.at(votes, (row_index, neighbour_labels), similarities.ravel() / (k + 1)) # sums to less than 1
+    return votes.argmax(axis=1)
+
+index_args = None # (index, train_labels, K, queries, k, batch_size), shared with the workers
+
+def classify_batch(first):
+    (index, train_labels, K, queries, k, batch_size) = index_args
+    last = min(first + batch_size, len(queries[0]) - 1)
+    scores = score_batch(index, len(train_labels), queries, first, last)
+    (neighbours, similarities) = top_k(scores, k)
+    return vote(neighbours, similarities, train_labels, K)
+
+"""
+Classify the query docs by their @k nearest training docs
+@processes number of worker processes, number of CPUs by default; 1 scores the batches in this process
+@return predicted class of every query
+"""
+def classify(index, train_labels, K, queries, k=10, batch_size=256, processes=None):
+    global index_args
+    index_args = (index, train_labels, K, queries, k, batch_size)
+    firsts = range(0, len(queries[0]) - 1, batch_size)
+    try:
+        if processes == 1:
+            predictions = [classify_batch(first) for first in firsts]
+        else:
+            pool = Pool(processes)
+            try:
+                predictions = pool.map(classify_batch, firsts, chunksize=1)
+            finally:
+                pool.close()
+                pool.join()
+    finally:
+        index_args = None
+    return np.concatenate(predictions + [np.zeros(0, dtype=np.int64)])
+
+def main(argv):
+    parser = argparse.ArgumentParser(usage="python ./kNN.py train_file test_file [options]")
+    parser.add_argument("train_file")
+    parser.add_argument("test_file")
+    parser.add_argument("-k", type=int, default=10, help="number of neighbours (default: 10, as in kNN.R)")
+    parser.add_argument("--batch-size", type=int, default=256, help="queries scored together (default: 256)")
+    parser.add_argument("--processes", type=int, default=None,
+                        help="worker processes scoring the batches (default: number of CPUs)")
+    parser.add_argument("--all-categories", action="store_true",
+                        help="classify among all categories of train_file instead of used_category")
+    parser.add_argument("--categories", default=None,
+                        help="comma-separated categories to classify among instead of used_category, e.g. course,faculty")
+    args = parser.parse_args(argv[1:])
+    if args.all_categories and args.categories is not None:
+        parser.error("--all-categories and --categories exclude each other")
+
+    vocabulary = Vocabulary()
+    if args.all_categories:
+        categories = None
+    elif args.categories is not None:
+        categories = args.categories.split(",")
+    else:
+        categories = used_category
+    corpus = Corpus(vocabulary, categories)
+    corpus.load(args.train_file)
+    test_corpus = Corpus(vocabulary, corpus.categories) # same category indices as the training docs
+    test_corpus.load(args.test_file, grow=False) # words not in vocabulary are removed
+    K = len(corpus.categories)
+    V = len(vocabulary)
+    print "Categories used for classification: " + ", ".join(corpus.categories)
+    print "Training docs: " + str(len(corpus)) + ", test docs: " + str(len(test_corpus)) \
+        + ", vocabulary size: " + str(V)
+    if len(corpus) == 0 or len(test_corpus) == 0:
+        print "No document to classify among these categories, see --categories and --all-categories"
+        return
+
+    start = time.time()
+    idf = caculate_idf(corpus.documents, vocabulary)
+    index = build_index(tfidf_vectors(corpus.documents, idf), V)
+    queries = tfidf_vectors(test_corpus.documents, idf)
+    print "Index built in " + str(time.time() - start) + " seconds."
+
+    train_labels = np.array([doc.category for doc in corpus.documents])
+    start = time.time()
+    predictions = classify(index, train_labels, K, queries, args.k, args.batch_size, args.processes)
+    elapsed = time.time() - start
+    print "Queries per second: " + str(len(predictions) / elapsed)
+
+    truth = np.array([doc.category for doc in test_corpus.documents])
+    correct = int((predictions == truth).sum())
+    print str(correct) + " of " + str(len(truth)) + " documents are correctly classified."
+    print "Accuracy: " + str(correct * 1.0 / len(truth))
+
+if __name__ == "__main__":
+    main(sys.argv)
@@ -0,0 +1,100 @@
+#! /usr/bin/env python
+import json
+import threading
+import time
+from Queue import Queue
+
+"""
+Metrics of a Gibbs chain of NB_with_Gibbs.py, collected in memory and emitted every few iterations.
+
+Counters (label changes, ...) and the wall time of every phase of an iteration (sweep, theta,
+evaluate, ...) are summed, and values (accuracy, log-joint, ...) keep the last value set. Every
+@every iterations they are handed to the sinks as one record, a dict, and the counters, times and
+values are cleared:
+{"iteration": last iteration, "iterations": iterations summed, <counters and values>, "seconds": {<phase>: time}}
+
+A sink is any callable taking a record. JSONLinesSink writes the records to a file as JSON lines on
+a background thread. Without any sink nothing is formatted nor written, only a few additions per
+iteration remain.
+"""
+
+class Metrics(object):
+    __slots__ = ("sinks", "every", "iterations", "counters", "seconds", "values")
+
+    def __init__(self, sinks=[], every=1):
+        self.sinks = list(sinks)
+        self.every = every
+        self.reset()
+
+    def reset(self):
+        self.iterations = 0
+        self.counters = dict()
+        self.seconds = dict()
+        self.values = dict()
+
+    # add @n to counter @name
+    def count(self, name, n=1):
+        self.counters[name] = self.counters.get(name, 0) + n
+
+    # add the time since @start to phase @name, @return the current time, the start of the next phase
+    def lap(self, name, start):
+        now = time.time()
+        self.seconds[name] = self.seconds.get(name, 0.0) + (now - start)
+        return now
+
+    def set(self, name, value):
+        self.values[name] = value
+
+    # end iteration @i, emit a record every self.every iterations
+    def end_iteration(self, i):
+        self.iterations = self.iterations + 1
+        if self.iterations >= self.every:
+            self.emit(i)
+
+    def emit(self, i):
+        if len(self.sinks) > 0:
+            record = dict({"iteration": i, "iterations": self.iterations})
+            record.update(self.counters)
+            record.update(self.values)
+            record["seconds"] = self.seconds
+            for sink in self.sinks:
+                sink(record)
+        self.reset()
+
+    # emit the iterations not emitted yet, ending with iteration @i, and close the sinks
+    def close(self, i):
+        if self.iterations > 0:
+            self.emit(i)
+        for sink in self.sinks:
+            if hasattr(sink, "close"):
+                sink.close()
+
+"""
+Write records to @path as JSON lines, one per record, on a background thread
+"""
+class JSONLinesSink(object):
+    __slots__ = ("outfile", "queue", "thread")
+
+    def __init__(self, path):
+        self.outfile = open(path, "w", 1 << 16)
+        self.queue = Queue()
+        self.thread = threading.Thread(target=self.run)
+        self.thread.daemon = True
+        self.thread.start()
+
+    # hand over @record, which must not be modified afterwards
+    def __call__(self, record):
+        self.queue.put(record)
+
+    def run(self):
+        while True:
+            record = self.queue.get()
+            if record is None:
+                return
+            self.outfile.write(json.dumps(record, sort_keys=True) + "\n")
+
+    # write the records left and close the file
+    def close(self):
+        self.queue.put(None)
+        self.thread.join()
+        self.outfile.close()
@@ -1,6 +1,20 @@
 #! /usr/bin/env python
+import os
 import sys
 import math
+import argparse
+from array import array
+from collections import deque
+from itertools import islice
+from multiprocessing import Pool
+
+import numpy as np
+
+import profiling
+from corpus import Corpus, Document, Vocabulary, HashedVocabulary, make_vocabulary, count_words, tokenize, \
+    documents_csr
+from corpus_cache import write_words, read_words
+from sparse_gibbs import count_word_csr, doc_log_likelihood, segment_sum
 
 """
 This programme implements a Naive Bayes classifier(multinominal) applied to text categorizaton.
@@ -16,118 +30,57 @@ Reference:
 }
 """
 NUM_CATEGORY = 2 # number of categories
+MODEL_VERSION = 1 # version of the files written by save_model
 
 used_category = ["acq", "alum"]
 category_map = dict({used_category[0]:0, used_category[1]:1})
 
-magic_key_set = set(["_CATEGORY", "_NUM_WORDS"])
+# print out a document
+def print_document(doc, vocabulary):
+    print "category --> " + str(doc.category) + ", words --> " + str(doc.length)
+    for (index, count) in doc.terms():
+        print vocabulary.words[index] + " --> [ " + str(index) + " , " + str(count) + " ]"
 
-# print out docditct
-def print_dict(d):
-    it = d.iteritems()
-    try:
-        while 1:
-            (key, value) = it.next()
-            if key in magic_key_set:
-                print key + " --> " + str(value)
-            else:
-                print key + " --> [ " + str(value[0]) + " , " + str(value[1]) + " ]"
-    except StopIteration:
-        pass
-
-# extracting tokens from doc and build a vocabulary
+# extracting tokens from doc
+# @return (words, counts, category), distinct words of the doc and their counts, category is -1 for other categories
 def extract_token(line):
-    docdict = dict()
-    line = line.replace("\t", " ") # raplace \t
-    line = line.replace("\n", "") # remove \n
-    line = line.split(" "); # tokenize the document
-    
-    word_count = 0 # count words in doc
-    if line[0] == used_category[0] or line[0] == used_category[1]:
+    line = tokenize(line)
+    if line[0] in category_map:
         category = category_map[line[0]]
-        # add words(terms) to doc
-        del line[0]
-        for word in line:
-            if word not in docdict:
-                # dict: strword --> [index, count], index is unknown here for we don't have a vocabulary yet
-                docdict[word] = [-1, 0] 
-            value = docdict[word]
-            value[1] = value[1] + 1 # increase term count
-            word_count = word_count + 1
-            docdict[word] = value
+        (words, counts) = count_words(line[1:])
     else:
         category = -1 # unknown category
-    
-    # assign category info to every doc, a bit hacking here
-    docdict["_CATEGORY"] = category
-    docdict["_NUM_WORDS"] = word_count
-    return (docdict, category)
-    
-# build vocabulary
-def build_vocabulary(docdict, vocabulary):
-    it = docdict.iteritems()
-    try:
-        while 1:
-            (key, value) = it.next()
-            # omit magic keys
-            if key in magic_key_set:
-                continue
-            if key not in vocabulary:
-                index = len(vocabulary)
-                vocabulary[key] = [index, 0]
-
-            v = vocabulary[key]; v[1] = v[1] + value[1]
-            index = v[0]
-            vocabulary[key] = v
-            docdict[key] = [index, value[1]]
-    except StopIteration:
-        pass
-
-# build terms for each category using every doc    
-def build_cterm(docdict, vocabulary, cterm):
-    it = docdict.iteritems()
-    try:
-        while 1:
-            (key, value) = it.next()
-            # omit magic keys
-            if key in magic_key_set:
-                continue
-            if key not in cterm:
-                index = vocabulary[key][0]
-                cterm[key] = [index, 0]
-            cv = cterm[key]; cv[1] = cv[1] + value[1];
-            cterm[key] = cv
-    except StopIteration:
-        pass
-    except KeyError:
-        print "Word '" + key + "' not found in vocabulary!"
-        exit()
-    # add total words for each category
-    cterm["_NUM_WORDS"] = cterm["_NUM_WORDS"] + docdict["_NUM_WORDS"]
+        (words, counts) = ([], [])
+    return (words, counts, category)
+
+# build terms for a category using every doc: @cterm[index] counts term index in the category
+# @sign 1 to add the doc, -1 to remove it
+def build_cterm(doc, cterm, sign=1):
+    for (index, count) in doc.terms():
+        if index >= len(cterm):
+            cterm.extend([0] * (index + 1 - len(cterm)))
+        cterm[index] = cterm[index] + sign * count
 
 # train a multinomial Naive Bayes classifier
 def train_multinomial_NB(train_file_path):
-    trainfile = open(train_file_path, "r")
-    vocabulary = dict({"a":[0,0]}) # vocabulary for the whole dataset
-    doclist = []
-    Nc = [0] * NUM_CATEGORY # number of docs in every class
+    vocabulary = Vocabulary() # vocabulary for the whole dataset
+    vocabulary.add("a")
+    corpus = Corpus(vocabulary, used_category)
+    corpus.load(train_file_path)
+    doclist = corpus.documents
+    Nc = corpus.category_counts() # number of docs in every class
     cterm_list = [] # counts terms in each category
+    num_words = [0] * NUM_CATEGORY # total words in each category
     for i in range(NUM_CATEGORY):
-        cterm_list.append(dict({"_NUM_WORDS":0}))
+        cterm_list.append([])
         
-    for line in trainfile:
-        (docdict, category) = extract_token(line)
-        if category == -1: # omit other categories
-            continue
-        Nc[category] = Nc[category] + 1
-        build_vocabulary(docdict, vocabulary)
-        build_cterm(docdict, vocabulary, cterm_list[category])
-        doclist.append(docdict)
+    for doc in doclist:
+        build_cterm(doc, cterm_list[doc.category])
+        num_words[doc.category] = num_words[doc.category] + doc.length
         
     print "Vocabulary size: " + str(len(vocabulary))
     print "Number of docs:  " + str(len(doclist))
-    #print_dict(vocabulary)
-    #print_dict(doclist[0])
+    #print_document(doclist[0], vocabulary)
     prior = [0] * NUM_CATEGORY # priors for each class
     condprob = [] # conditional prob condprob[c][t]
     assert(len(doclist) == sum(Nc))
@@ -135,46 +88,23 @@ def train_multinomial_NB(train_file_path):
     V = len(vocabulary) # size of vocabulary
     for c in range(NUM_CATEGORY):
         prior[c] = Nc[c] * 1.0 / N
-        p = [-1] * V
         cterm = cterm_list[c]
-        it = cterm.iteritems()
-        total_words = cterm["_NUM_WORDS"] # total words in each category
-        try:
-            while 1:
-                (key, value) = it.next()
-                if key in magic_key_set:
-                    continue
-                index = value[0]
-                count = value[1]
-                p[index] = (count + 1) * 1.0 / (total_words + V)
-        except StopIteration:
-            pass
-        # assign conditional prob that dose not exist in cterm
-        for i in range(V):
-            if p[i] == -1:
-                p[i] = 1.0 / (total_words + V)
+        cterm.extend([0] * (V - len(cterm)))
+        total_words = num_words[c]
+        p = [(count + 1) * 1.0 / (total_words + V) for count in cterm]
         assert(abs(sum(p) - 1) < 0.000001)
         condprob.append(p)
         
     return (doclist, vocabulary, prior, condprob)
     
 # apply multinomial Naive Bayes classifier to docs
-def apply_multinomial_NB(prior, condprob, docdict):
-    it = docdict.iteritems()
+def apply_multinomial_NB(prior, condprob, doc):
     score = [0] * NUM_CATEGORY
     for c in range(NUM_CATEGORY):
         score[c] = prior[c]
-    try:
-        while 1:
-            (key, value) = it.next()
-            if key in magic_key_set:
-                continue
-            index = value[0]
-            count = value[1]
-            for c in range(NUM_CATEGORY):
-                score[c] = score[c] + count * math.log(condprob[c][index])
-    except StopIteration:
-        pass
+    for (index, count) in doc.terms():
+        for c in range(NUM_CATEGORY):
+            score[c] = score[c] + count * math.log(condprob[c][index])
         
     max_score = -float("inf")
     cat = -1
@@ -185,44 +115,282 @@ def apply_multinomial_NB(prior, condprob, docdict):
             
     return cat
 
-# assgin word index for test documents
-def assign_word_index(docdict, vocabulary):
-    it = docdict.iteritems()
-    unknown_words = []
-    try:
-        while 1:
-            (key, value) = it.next()
-            if key in magic_key_set:
-                continue
-            if key not in vocabulary:
-                unknown_words.append(key)
+# assgin word index for test documents, words that don't exist in vocabulary are removed
+# @return the doc as a Document
+def assign_word_index(words, counts, category, vocabulary):
+    (term_ids, doc_counts) = vocabulary.map_words(words, counts, grow=False)
+    return Document(category, term_ids, doc_counts)
+
+"""
+Train a multinomial Naive Bayes classifier on the whole training set at once: the term counts of
+every category come from one aggregation over the CSR arrays of the docs, which are those of the
+corpus cache when there is one (corpus.Corpus.load_csr)
+@hash_bits hash the words into 2^hash_bits terms instead of building a vocabulary
+@processes tokenize the training file on this many processes, None for the number of CPUs
+@return (labels, vocabulary, log_prior, log_condprob), labels is the array of the categories of the
+        training docs, log_prior is a C array and log_condprob a C x V array of log conditional probabilities
+"""
+def train_multinomial_NB_batch(train_file_path, hash_bits=None, processes=1):
+    vocabulary = make_vocabulary(hash_bits) # vocabulary for the whole dataset
+    vocabulary.add("a")
+    corpus = Corpus(vocabulary, used_category)
+    (labels, csr) = corpus.load_csr(train_file_path, processes=processes)
+    print "Vocabulary size: " + str(len(vocabulary))
+    print "Number of docs:  " + str(len(labels))
+    V = len(vocabulary) # size of vocabulary
+    cterm = count_word_csr(csr, labels, NUM_CATEGORY, V)
+    (log_prior, log_condprob) = estimate_multinomial_NB(cterm, np.bincount(labels, minlength=NUM_CATEGORY))
+    return (labels, vocabulary, log_prior, log_condprob)
+
+"""
+Estimate the parameters of a multinomial Naive Bayes classifier from the counts of the docs, which
+may be expected counts of docs labelled with probabilities (nb_em.py)
+@cterm C x V array, count of every term in every category
+@docs C array, number of docs in every category
+@term_smoothing added to cterm, a scalar or a V array; 1 is add-one smoothing:
+                condprob[c][t] = (cterm[c][t] + 1) / (total words of c + V)
+@prior_smoothing added to docs, a scalar or a C array
+@return (log_prior, log_condprob)
+"""
+def estimate_multinomial_NB(cterm, docs, term_smoothing=1.0, prior_smoothing=0.0):
+    docs = np.asarray(docs) + prior_smoothing
+    log_prior = np.log(docs * 1.0 / docs.sum())
+    smoothed = cterm + term_smoothing
+    log_condprob = np.log(smoothed) - np.log(smoothed.sum(axis=1))[:, np.newaxis]
+    return (log_prior, log_condprob)
+
+# apply multinomial Naive Bayes classifier to the docs of @csr (see corpus.documents_csr), @return array of categories
+def apply_multinomial_NB_batch(log_prior, log_condprob, csr):
+    score = doc_log_likelihood(log_condprob, csr, 0)
+    return (score + log_prior[:, np.newaxis]).argmax(axis=0)
+
+"""
+Posterior probabilities of the categories for the docs of @csr
+@return (posterior, log_likelihood), posterior is a C x N array whose columns sum to 1 and
+        log_likelihood the log-likelihood of the docs, their multinomial coefficients left out
+"""
+def posterior_multinomial_NB(log_prior, log_condprob, csr):
+    score = doc_log_likelihood(log_condprob, csr, 0) + log_prior[:, np.newaxis]
+    top = score.max(axis=0)
+    posterior = np.exp(score - top)
+    total = posterior.sum(axis=0)
+    posterior /= total
+    return (posterior, float((top + np.log(total)).sum()))
+
+"""
+Save a model trained by train_multinomial_NB_batch into the directory @model_dir
+    vocabulary.txt    the words, one per line, the line number is the term index
+    hash_bits.txt     instead of vocabulary.txt for a HashedVocabulary
+    categories.txt    the categories, one per line, the line number is the category index
+    log_prior.npy     C array
+    log_condprob.npy  C x V array
+    version.txt       MODEL_VERSION
+"""
+def save_model(model_dir, vocabulary, log_prior, log_condprob):
+    if not os.path.isdir(model_dir):
+        os.makedirs(model_dir)
+    for name in ("vocabulary.txt", "hash_bits.txt"): # from a previous model
+        if os.path.exists(os.path.join(model_dir, name)):
+            os.remove(os.path.join(model_dir, name))
+    if vocabulary.hashed:
+        f = open(os.path.join(model_dir, "hash_bits.txt"), "w")
+        f.write(str(vocabulary.hash_bits) + "\n")
+        f.close()
+    else:
+        write_words(os.path.join(model_dir, "vocabulary.txt"), vocabulary.index)
+    write_words(os.path.join(model_dir, "categories.txt"), category_map)
+    np.save(os.path.join(model_dir, "log_prior.npy"), np.asarray(log_prior, dtype=np.float64))
+    np.save(os.path.join(model_dir, "log_condprob.npy"), np.asarray(log_condprob, dtype=np.float64))
+    # written last: a model without version.txt is incomplete
+    f = open(os.path.join(model_dir, "version.txt"), "w")
+    f.write(str(MODEL_VERSION) + "\n")
+    f.close()
+
+"""
+Load a model saved by save_model; log_condprob is memory-mapped, so processes loading the same
+model share one copy of it
+@return (vocabulary, categories, log_prior, log_condprob)
+"""
+def load_model(model_dir):
+    version = int(open(os.path.join(model_dir, "version.txt"), "r").read())
+    if version != MODEL_VERSION:
+        raise ValueError("Model " + model_dir + " has version " + str(version) + ", expected " + str(MODEL_VERSION))
+    if os.path.exists(os.path.join(model_dir, "hash_bits.txt")):
+        vocabulary = HashedVocabulary(int(open(os.path.join(model_dir, "hash_bits.txt"), "r").read()))
+    else:
+        vocabulary = Vocabulary()
+        for word in read_words(os.path.join(model_dir, "vocabulary.txt")):
+            vocabulary.add(word)
+    categories = read_words(os.path.join(model_dir, "categories.txt"))
+    log_prior = np.load(os.path.join(model_dir, "log_prior.npy"))
+    log_condprob = np.load(os.path.join(model_dir, "log_condprob.npy"), mmap_mode="r")
+    return (vocabulary, categories, log_prior, log_condprob)
+
+"""
+Multinomial Naive Bayes classifier trained incrementally: documents are added or removed in
+batches, and the vocabulary grows in place.
+
+condprob[c][t] = (cterm[c][t] + 1) / (num_words[c] + V) is kept as two parts:
+log_num[c][t] = log(cterm[c][t] + 1), only recomputed for the terms touched since the last
+refresh, and the per-class log(num_words[c] + V), which is a scalar. So an update costs time
+proportional to the words of the batch, whatever the size of the corpus and of the vocabulary.
+"""
+class IncrementalNB(object):
+    __slots__ = ("vocabulary", "cterm_list", "num_words", "Nc", "log_num", "dirty")
+
+    # @vocabulary shared with the corpora of the documents; a new one by default
+    def __init__(self, vocabulary=None):
+        if vocabulary is None:
+            vocabulary = Vocabulary()
+        self.vocabulary = vocabulary
+        self.cterm_list = [[] for c in range(NUM_CATEGORY)] # counts terms in each category
+        self.num_words = [0] * NUM_CATEGORY # total words in each category
+        self.Nc = [0] * NUM_CATEGORY # number of docs in every class
+        self.log_num = np.zeros((NUM_CATEGORY, 0)) # log(cterm + 1), the columns past V are spare room
+        self.dirty = [set() for c in range(NUM_CATEGORY)] # terms whose log_num is out of date
+
+    # add the docs of a training file, growing the vocabulary; @return the docs added
+    def add_file(self, train_file_path):
+        corpus = Corpus(self.vocabulary, used_category)
+        corpus.load(train_file_path)
+        self.add(corpus.documents)
+        return corpus.documents
+
+    # add labelled docs, whose term ids come from self.vocabulary
+    def add(self, doclist):
+        self.update(doclist, 1)
+
+    # remove docs previously added
+    def remove(self, doclist):
+        self.update(doclist, -1)
+
+    def update(self, doclist, sign):
+        for doc in doclist:
+            c = doc.category
+            build_cterm(doc, self.cterm_list[c], sign)
+            self.num_words[c] = self.num_words[c] + sign * doc.length
+            self.Nc[c] = self.Nc[c] + sign
+            self.dirty[c].update(doc.term_ids)
+
+    # bring log_num up to date with the counts and the size of the vocabulary
+    def refresh(self):
+        V = len(self.vocabulary)
+        if V > self.log_num.shape[1]:
+            # grow geometrically, new terms have cterm = 0, log(0 + 1) = 0
+            grown = np.zeros((NUM_CATEGORY, max(V, 2 * self.log_num.shape[1])))
+            grown[:, :self.log_num.shape[1]] = self.log_num
+            self.log_num = grown
+        for c in range(NUM_CATEGORY):
+            if len(self.dirty[c]) == 0:
                 continue
-            index = vocabulary[key][0]
-            value[0] = index
-            docdict[key] = value
-    except StopIteration:
-        pass
-        
-    # remove unknown words, i.e. keys that don't exist in vocabulary
-    for word in unknown_words:
-        del docdict[word]
-            
-# Note: test_file_path contains multiple test documents
-def classify_test_documents(prior, condprob, vocabulary, test_file_path):
-    testfile = open(test_file_path, "r")
-    testdoc_list = []
-    predictions = []
-    for line in testfile:
-        (docdict, category) = extract_token(line)
-        if category == -1:
-            continue
-        # assgin word index for test documents
-        assign_word_index(docdict, vocabulary)
-        testdoc_list.append(docdict)
-        cat = apply_multinomial_NB(prior, condprob, docdict)
-        predictions.append(cat)
-        
-    return (predictions, testdoc_list)
+            terms = np.fromiter(self.dirty[c], dtype=np.int64, count=len(self.dirty[c]))
+            cterm = self.cterm_list[c]
+            self.log_num[c, terms] = np.log(np.array([cterm[t] if t < len(cterm) else 0 for t in terms]) + 1.0)
+            self.dirty[c] = set()
+
+    # @return C array, log(num_words[c] + V)
+    def log_denominator(self):
+        return np.log(np.array(self.num_words, dtype=np.float64) + len(self.vocabulary))
+
+    def log_prior(self):
+        return np.log(np.array(self.Nc) * 1.0 / sum(self.Nc))
+
+    # @return (log_prior, log_condprob) as returned by train_multinomial_NB_batch, e.g. for save_model
+    def model(self):
+        self.refresh()
+        V = len(self.vocabulary)
+        return (self.log_prior(), self.log_num[:, :V] - self.log_denominator()[:, np.newaxis])
+
+    # classify docs whose term ids come from self.vocabulary, @return array of categories
+    def classify(self, doclist):
+        self.refresh()
+        csr = documents_csr(doclist)
+        score = doc_log_likelihood(self.log_num, csr, 0)
+        score -= np.outer(self.log_denominator(), segment_sum(csr[2], csr[0])) # every word divides by it
+        return (score + self.log_prior()[:, np.newaxis]).argmax(axis=0)
+
+"""
+Streaming classification: test lines are read, tokenized (extract_token), mapped to term ids
+straight into CSR arrays (lines_csr) and scored (apply_multinomial_NB_batch) in batches of a fixed size, so memory
+does not grow with the test file. The batches can be scored on a pool of workers, which inherit
+the model from the module global stream_args when the pool forks.
+"""
+
+stream_args = None # (vocabulary, log_prior, log_condprob), shared with the workers
+
+# split @lines into lists of @batch_size lines
+def read_batches(lines, batch_size):
+    lines = iter(lines)
+    while True:
+        batch = list(islice(lines, batch_size))
+        if len(batch) == 0:
+            return
+        yield batch
+
+"""
+Apply @func to every item of @items on @pool, with at most @window items in flight, so that a long
+input is not read ahead into memory (Pool.imap reads all of its input)
+@return generator of the results, in input order
+"""
+def bounded_imap(pool, func, items, window):
+    pending = deque()
+    for item in items:
+        pending.append(pool.apply_async(func, (item,)))
+        if len(pending) >= window:
+            yield pending.popleft().get()
+    while len(pending) > 0:
+        yield pending.popleft().get()
+
+"""
+Tokenize test lines straight into the CSR arrays of the batch (see corpus.documents_csr), without
+a Document per line; lines of other categories are skipped, words not in @vocabulary are removed
+@return (csr, labels)
+"""
+def lines_csr(lines, vocabulary):
+    indptr = [0]
+    indices = array("i")
+    counts = array("i")
+    labels = []
+    for line in lines:
+        (words, word_counts, category) = extract_token(line)
+        if category != -1:
+            vocabulary.map_words(words, word_counts, False, indices, counts)
+            indptr.append(len(indices))
+            labels.append(category)
+    # view the arrays without a copy, as documents_csr does
+    csr = (np.array(indptr, dtype=np.int64), np.frombuffer(indices, dtype=np.int32),
+           np.frombuffer(counts, dtype=np.int32))
+    return (csr, np.array(labels, dtype=np.int64))
+
+"""
+Classify a batch of test lines with the model in stream_args; docs of other categories are skipped
+@return (predictions, labels), arrays
+"""
+def classify_test_lines(lines):
+    (vocabulary, log_prior, log_condprob) = stream_args
+    (csr, labels) = lines_csr(lines, vocabulary)
+    return (apply_multinomial_NB_batch(log_prior, log_condprob, csr), labels)
+
+"""
+Classify the test docs in @lines batch by batch
+@processes number of worker processes; 1 scores the batches in this process
+@return generator of (predictions, labels) per batch
+"""
+def classify_test_stream(log_prior, log_condprob, vocabulary, lines, batch_size=1024, processes=1):
+    global stream_args
+    stream_args = (vocabulary, log_prior, log_condprob)
+    batches = read_batches(lines, batch_size)
+    if processes == 1:
+        for batch in batches:
+            yield classify_test_lines(batch)
+        return
+    pool = Pool(processes)
+    try:
+        for result in bounded_imap(pool, classify_test_lines, batches, 2 * processes):
+            yield result
+    finally:
+        pool.close()
+        pool.join()
 
 # evaluate predictions    
 def evaluate_classification(predictions, labels):
@@ -232,25 +400,59 @@ def evaluate_classification(predictions, labels):
     for i in range(n):
         if predictions[i] == labels[i]:
             correct = correct + 1
-    
+    print_accuracy(correct, n)
+
+def print_accuracy(correct, n):
     accuracy = correct * 1.0 / n
     print "Number of test documents: " + str(n)
     print str(correct) + " of " + str(n) + " documents are correctly classified."
     print "Accuracy: " + str(accuracy)
     
 def main(argv):
-    print "Usage: python ./naive-bayes.py training_docs testing_docs"
+    parser = argparse.ArgumentParser(usage="python ./naive-bayes.py training_docs testing_docs [model_dir] [options]")
+    parser.add_argument("training_docs")
+    parser.add_argument("testing_docs")
+    parser.add_argument("model_dir", nargs="?", default=None, help="save the trained model to this directory")
+    parser.add_argument("--hash-bits", type=int, default=None,
+                        help="hash the words into 2^HASH_BITS terms instead of building a vocabulary")
+    parser.add_argument("--load-processes", type=int, default=1,
+                        help="processes tokenizing the training file, 0 for the number of CPUs (default: 1)")
+    parser.add_argument("--processes", type=int, default=1,
+                        help="worker processes classifying the batches of test docs (default: 1)")
+    parser.add_argument("--batch-size", type=int, default=1024, help="test docs classified together (default: 1024)")
+    parser.add_argument("--profile", default=None, metavar="PREFIX",
+                        help="time every phase of the run, print a table and write PREFIX.folded for a flamegraph")
+    args = parser.parse_args(argv[1:])
+    if args.profile is not None and args.processes > 1:
+        parser.error("--profile classifies in this process: the batches of --processes run in other processes")
+    profiler = None
+    if args.profile is not None:
+        profiler = profiling.Profiler()
+        profiling.instrument(profiler, sys.modules[__name__],
+                             ["train_multinomial_NB_batch", "save_model", "classify_test_lines", "extract_token",
+                              "lines_csr", "documents_csr", "count_word_csr", "apply_multinomial_NB_batch",
+                              "doc_log_likelihood"])
+        profiling.instrument(profiler, sys.modules[Corpus.__module__], ["split_document"], "corpus.")
+        profiling.instrument(profiler, Corpus, ["load", "load_csr", "make_document"], "Corpus.")
     print "Categories used for classification: " + used_category[0] + " and " + used_category[1]
     # training
-    (doclist, vocabulary, prior, condprob) = train_multinomial_NB(argv[1])
-    # apply Naive bayes classifier
-    (predictions, testdoc_list) = classify_test_documents(prior, condprob, vocabulary, argv[2])
-    
-    labels = []
-    for doc in testdoc_list:
-        cat = doc["_CATEGORY"]
-        labels.append(cat)
-    evaluate_classification(predictions, labels)
+    (train_labels, vocabulary, log_prior, log_condprob) = train_multinomial_NB_batch(args.training_docs,
+                                                                                      args.hash_bits,
+                                                                                      args.load_processes or None)
+    if args.model_dir is not None:
+        save_model(args.model_dir, vocabulary, log_prior, log_condprob)
+        print "Model saved to " + args.model_dir
+    # apply Naive bayes classifier, keeping running counts only
+    n = 0
+    correct = 0
+    for (predictions, labels) in classify_test_stream(log_prior, log_condprob, vocabulary, open(args.testing_docs, "r"),
+                                                      args.batch_size, args.processes):
+        n = n + len(labels)
+        correct = correct + int((predictions == labels).sum())
+        print "Classified " + str(n) + " documents, running accuracy: " + str(correct * 1.0 / max(n, 1))
+    print_accuracy(correct, n)
+    if profiler is not None:
+        profiler.dump(args.profile)
     
     
 if __name__ == "__main__":
@@ -0,0 +1,108 @@
+#! /usr/bin/env python
+import sys
+import time
+import argparse
+from multiprocessing import Pool
+
+from corpus import Document, count_words, documents_csr, tokenize
+from naive_bayes import load_model, apply_multinomial_NB_batch, read_batches, bounded_imap
+
+"""
+Classify documents with a Naive Bayes model saved by naive_bayes.py, without retraining.
+
+Every input line is a document: its words separated by spaces, or with --labelled the category,
+a tab and the words, as in the dataset files. One category is printed per line; labelled lines of
+a category the model does not know are skipped, as naive_bayes.py skips them. Lines are read and
+classified in batches, so the input can be a stream.
+
+With --processes, every worker loads the model itself; log_condprob is memory-mapped, so the
+workers share the pages of one copy of it.
+
+Usage: python ./nb_classify.py model_dir [file ...] [--labelled] [--batch-size 1024] [--processes P]
+"""
+
+model = None # (vocabulary, categories, log_prior, log_condprob), loaded once per process
+
+def init_model(model_dir):
+    global model
+    model = load_model(model_dir)
+
+"""
+Classify a batch of input lines with the model of this process
+@labelled lines start with their category, lines of other categories than those of the model are skipped
+@return (predictions, truth), category names; truth is None for unlabelled lines
+"""
+def classify_lines(lines, labelled=False):
+    (vocabulary, categories, log_prior, log_condprob) = model
+    docs = []
+    truth = []
+    for line in lines:
+        tokens = tokenize(line)
+        if labelled:
+            if len(tokens) == 0 or tokens[0] not in categories:
+                continue
+            truth.append(tokens[0])
+            tokens = tokens[1:]
+        (words, counts) = count_words(tokens)
+        (term_ids, doc_counts) = vocabulary.map_words(words, counts, grow=False) # unknown words are removed
+        docs.append(Document(-1, term_ids, doc_counts))
+    predictions = apply_multinomial_NB_batch(log_prior, log_condprob, documents_csr(docs))
+    return ([categories[c] for c in predictions], truth if labelled else None)
+
+def classify_labelled_lines(lines):
+    return classify_lines(lines, True)
+
+# the lines of every file in turn, of stdin if there is no file
+def read_lines(files):
+    if len(files) == 0:
+        for line in sys.stdin:
+            yield line
+    for path in files:
+        for line in open(path, "r"):
+            yield line
+
+def main(argv):
+    parser = argparse.ArgumentParser(usage="python ./nb_classify.py model_dir [file ...] [options]")
+    parser.add_argument("model_dir", help="model saved by: python ./naive_bayes.py training_docs testing_docs model_dir")
+    parser.add_argument("files", nargs="*", help="documents to classify, one per line (default: stdin)")
+    parser.add_argument("--labelled", action="store_true",
+                        help="lines start with the category and a tab; report the accuracy")
+    parser.add_argument("--batch-size", type=int, default=1024, help="lines classified together (default: 1024)")
+    parser.add_argument("--processes", type=int, default=1, help="worker processes (default: 1)")
+    (args, extra) = parser.parse_known_args(argv[1:])
+    # files given after the options end up in extra
+    for arg in extra:
+        if arg.startswith("-"):
+            parser.error("unrecognized arguments: " + arg)
+    args.files.extend(extra)
+
+    start = time.time()
+    init_model(args.model_dir)
+    print >> sys.stderr, "Model loaded in %.1f ms" % ((time.time() - start) * 1000)
+    classify = classify_labelled_lines if args.labelled else classify_lines
+    batches = read_batches(read_lines(args.files), args.batch_size)
+    pool = None
+    if args.processes > 1:
+        pool = Pool(args.processes, init_model, (args.model_dir,))
+        results = bounded_imap(pool, classify, batches, 2 * args.processes) # in input order
+    else:
+        results = (classify(lines) for lines in batches)
+
+    start = time.time()
+    n = 0
+    correct = 0
+    for (predictions, truth) in results:
+        sys.stdout.write("".join([category + "\n" for category in predictions]))
+        n = n + len(predictions)
+        if truth is not None:
+            correct = correct + sum([1 for (p, t) in zip(predictions, truth) if p == t])
+    elapsed = time.time() - start
+    if pool is not None:
+        pool.close()
+        pool.join()
+    print >> sys.stderr, "Classified " + str(n) + " documents in %.3f s" % elapsed
+    if args.labelled and n > 0:
+        print >> sys.stderr, "Accuracy: " + str(correct * 1.0 / n)
+
+if __name__ == "__main__":
+    main(sys.argv)
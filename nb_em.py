@@ -0,0 +1,75 @@
+#! /usr/bin/env python
+import numpy as np
+
+import naive_bayes
+import sparse_gibbs
+
+"""
+Semi-supervised expectation-maximisation over the model of NB_with_Gibbs.py, a deterministic
+alternative to Gibbs sampling when only the final labels of the test documents are wanted.
+
+The training documents keep their labels. Every iteration labels each test document with the
+posterior probabilities of the classes under the current parameters (E step), then estimates the
+parameters again from the expected counts (M step), with naive_bayes.estimate_multinomial_NB:
+    theta[c][w] proportional to word_count[c][w] + hyper_multi[w], the mean of the Dirichlet
+                posterior that update_theta draws from
+    prior[c]    proportional to class_count[c] + hyper_gamma[c] - 1, the class prior of sweep,
+                class_count being the expected number of test documents in class c
+The first E step uses the parameters of the training documents alone, i.e. a Naive Bayes
+classifier.
+
+The M step maximises the log-posterior of the parameters, which therefore never decreases from one
+iteration to the next: the log-likelihood of the documents (multinomial coefficients left out),
+plus sum(hyper_multi * log theta), theta being the mode of the Dirichlet posterior under the prior
+Dirichlet(hyper_multi + 1), plus sum((hyper_gamma - 1) * log prior). The iterations stop once it
+changes by less than @tol relative to its value.
+"""
+
+DEFAULT_TOL = 1e-6
+
+# rows @first..@last-1 of a CSR matrix, as a CSR matrix of their own
+def csr_rows(csr, first, last):
+    (indptr, indices, counts) = csr
+    (start, end) = (indptr[first], indptr[last])
+    return (indptr[first : last + 1] - start, indices[start:end], counts[start:end])
+
+"""
+Run EM over the documents of @csr, the first len(@train_labels) of which are the training documents
+@K number of classes, @V size of vocabulary
+@max_iters largest number of iterations, at least 1
+@hyper_gamma K array, @hyper_multi V array or scalar, the priors of NB_with_Gibbs.py
+@callback called after every iteration as callback(i, posterior, log_posterior, change_count)
+@return (posterior, iterations, converged), posterior is the K x testN array of the last E step
+"""
+def run_em(csr, train_labels, K, V, max_iters, hyper_gamma, hyper_multi, tol=DEFAULT_TOL, callback=None):
+    if max_iters < 1:
+        raise ValueError("EM needs at least one iteration, got max_iters = " + str(max_iters))
+    trainN = len(train_labels)
+    N = len(csr[0]) - 1
+    test_csr = csr_rows(csr, trainN, N)
+    train_word_count = sparse_gibbs.count_word_csr(csr_rows(csr, 0, trainN), train_labels, K, V)
+    prior_smoothing = np.asarray(hyper_gamma, dtype=np.float64) - 1.0
+    (log_prior, log_condprob) = naive_bayes.estimate_multinomial_NB(train_word_count, np.zeros(K), hyper_multi,
+                                                                    prior_smoothing)
+    (labels, previous, converged) = (None, None, False)
+    i = -1
+    for i in range(max_iters):
+        # E step: the log-posterior is that of the parameters used for the posterior
+        (posterior, log_likelihood) = naive_bayes.posterior_multinomial_NB(log_prior, log_condprob, test_csr)
+        log_posterior = log_likelihood + (train_word_count * log_condprob).sum() \
+            + (hyper_multi * log_condprob).sum() + (prior_smoothing * log_prior).sum()
+        new_labels = posterior.argmax(axis=0)
+        change_count = len(new_labels) if labels is None else int(np.sum(new_labels != labels))
+        labels = new_labels
+        if callback is not None:
+            callback(i, posterior, log_posterior, change_count)
+        if previous is not None and abs(log_posterior - previous) <= tol * abs(log_posterior):
+            converged = True
+            break
+        previous = log_posterior
+
+        # M step
+        word_count = train_word_count + sparse_gibbs.count_word_soft(test_csr, posterior, V)
+        (log_prior, log_condprob) = naive_bayes.estimate_multinomial_NB(word_count, posterior.sum(axis=1),
+                                                                        hyper_multi, prior_smoothing)
+    return (posterior, i + 1, converged)
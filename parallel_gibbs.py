@@ -0,0 +1,52 @@
+#! /usr/bin/env python
+from multiprocessing import Pool
+
+import numpy as np
+
+import sparse_gibbs
+
+"""
+Run several independent Gibbs chains of the sparse backend on a process pool.
+
+The corpus is put in a module global before the pool is created, so the forked workers
+inherit it copy-on-write instead of receiving a pickled copy per chain. Every chain gets
+its own seed and returns its class_vote; the votes are pooled by the caller.
+"""
+
+chain_args = None # (csr, train_labels, K, V, T, B, hyper_gamma, hyper_multi, collapsed), shared with the workers
+
+def run_one_chain(seed):
+    (csr, train_labels, K, V, T, B, hyper_gamma, hyper_multi, collapsed) = chain_args
+    return sparse_gibbs.run_chain(csr, train_labels, K, V, T, B, hyper_gamma, hyper_multi, seed, collapsed)
+
+"""
+Run one chain per seed in @seeds
+@collapsed run the collapsed sampler in every chain
+@processes number of worker processes, number of CPUs by default; 1 runs the chains in this process
+@return chains x K x testN array, votes[k] is the class_vote of chain k
+"""
+def run_chains(csr, train_labels, K, V, T, B, hyper_gamma, hyper_multi, seeds, collapsed=False, processes=None):
+    global chain_args
+    chain_args = (csr, train_labels, K, V, T, B, hyper_gamma, hyper_multi, collapsed)
+    try:
+        if processes == 1:
+            votes = [run_one_chain(seed) for seed in seeds]
+        else:
+            pool = Pool(processes)
+            try:
+                votes = pool.map(run_one_chain, seeds, chunksize=1)
+            finally:
+                pool.close()
+                pool.join()
+    finally:
+        chain_args = None
+    return np.array(votes)
+
+"""
+Agreement between chains: fraction of test documents that two chains label the same way
+@votes chains x K x testN class_vote of every chain
+@return chains x chains matrix
+"""
+def chain_agreement(votes):
+    labels = votes.argmax(axis=1) # chains x testN
+    return (labels[:, np.newaxis, :] == labels[np.newaxis, :, :]).mean(axis=2)
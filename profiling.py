@@ -0,0 +1,123 @@
+#! /usr/bin/env python
+import sys
+import time
+import pstats
+import cProfile
+
+"""
+Opt-in instrumentation of NB_with_Gibbs.py and naive_bayes.py: wall time and number of calls of
+every phase of a run.
+
+A phase is a function of a module (or a method of a class): instrument() replaces it with a
+wrapper that counts and times every call. The callers look the function up in the module at every
+call, as benchmark.py relies on when it swaps caculate_Pr, so they go through the wrapper.
+Nothing is replaced unless profiling is asked for, so a run without it has no overhead at all.
+Phases nest: the self time of a phase excludes the phases called from it, and the self time of
+every stack of phases is kept for a flamegraph.
+
+For chosen iterations, the whole call tree is also recorded with cProfile.
+
+dump(prefix) prints the table of the phases and writes
+    <prefix>.folded  the stacks of phases with their self time in microseconds, one per line
+                     ("main;sweep;caculate_Pr 1234"), as read by flamegraph.pl or speedscope
+    <prefix>.pstats  the cProfile statistics of the chosen iterations, if any, for pstats or snakeviz
+"""
+
+ROOT = "main" # phase of the time spent outside of every instrumented phase
+
+class Profiler(object):
+    __slots__ = ("calls", "total", "own", "stacks", "stack", "children", "start", "iterations", "cprofile")
+
+    """
+    @iterations iterations to run under cProfile
+    """
+    def __init__(self, iterations=()):
+        self.calls = dict() # phase --> number of calls
+        self.total = dict() # phase --> seconds, phases called from it included
+        self.own = dict() # phase --> seconds, phases called from it excluded
+        self.stacks = dict() # "main;phase;...;phase" --> self seconds
+        self.stack = [ROOT] # phases in progress
+        self.children = [0.0] # seconds spent in the phases called by every phase in progress
+        self.start = time.time()
+        self.iterations = set(iterations)
+        self.cprofile = None
+
+    # @return @func wrapped into phase @name
+    def wrap(self, func, name):
+        def phase(*args, **kwargs):
+            self.stack.append(name)
+            self.children.append(0.0)
+            start = time.time()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                elapsed = time.time() - start
+                own = elapsed - self.children.pop()
+                key = ";".join(self.stack)
+                self.stack.pop()
+                self.children[-1] = self.children[-1] + elapsed
+                self.calls[name] = self.calls.get(name, 0) + 1
+                self.total[name] = self.total.get(name, 0.0) + elapsed
+                self.own[name] = self.own.get(name, 0.0) + own
+                self.stacks[key] = self.stacks.get(key, 0.0) + own
+        phase.__name__ = getattr(func, "__name__", name)
+        phase.__doc__ = getattr(func, "__doc__", None)
+        return phase
+
+    # start of iteration @i: run it under cProfile if it was chosen
+    def begin_iteration(self, i):
+        if i in self.iterations:
+            if self.cprofile is None:
+                self.cprofile = cProfile.Profile()
+            self.cprofile.enable()
+
+    def end_iteration(self, i):
+        if i in self.iterations:
+            self.cprofile.disable()
+
+    """
+    Print the table of the phases to @out, write the flamegraph stacks and the cProfile statistics
+    @prefix of the files written
+    """
+    def dump(self, prefix, out=sys.stdout):
+        elapsed = time.time() - self.start
+        root = elapsed - self.children[0]
+        print >> out, "%-36s %10s %10s %10s %7s %12s" % ("phase", "calls", "total (s)", "self (s)", "self %",
+                                                         "per call (us)")
+        for name in sorted(self.own, key=lambda name: -self.own[name]):
+            print >> out, "%-36s %10d %10.3f %10.3f %6.1f%% %12.1f" % (name, self.calls[name], self.total[name],
+                self.own[name], 100.0 * self.own[name] / elapsed, 1e6 * self.total[name] / self.calls[name])
+        print >> out, "%-36s %10s %10.3f %10.3f %6.1f%%" % (ROOT, "", elapsed, root, 100.0 * root / elapsed)
+
+        outfile = open(prefix + ".folded", "w")
+        outfile.write("%s %d\n" % (ROOT, int(root * 1e6)))
+        for key in sorted(self.stacks):
+            outfile.write("%s %d\n" % (key, int(self.stacks[key] * 1e6)))
+        outfile.close()
+        print >> out, "Flamegraph stacks written to " + prefix + ".folded"
+        if self.cprofile is not None:
+            self.cprofile.dump_stats(prefix + ".pstats")
+            print >> out, "cProfile of iterations " + ", ".join([str(i) for i in sorted(self.iterations)]) \
+                + " written to " + prefix + ".pstats"
+            pstats.Stats(self.cprofile, stream=out).sort_stats("cumulative").print_stats(15)
+
+"""
+Replace the functions @names of @owner (a module or a class) by phases of @profiler
+@prefix of the names of the phases
+"""
+def instrument(profiler, owner, names, prefix=""):
+    for name in names:
+        # for a class, the function itself rather than an unbound method
+        func = owner.__dict__[name] if isinstance(owner, type) else getattr(owner, name)
+        setattr(owner, name, profiler.wrap(func, prefix + name))
+
+# parse a list of iterations: "3,10-12" --> [3, 10, 11, 12]
+def parse_iterations(text):
+    iterations = []
+    for part in text.split(","):
+        if "-" in part:
+            (first, last) = part.split("-")
+            iterations.extend(range(int(first), int(last) + 1))
+        elif part:
+            iterations.append(int(part))
+    return iterations
@@ -0,0 +1,250 @@
+#! /usr/bin/env python
+from math import log
+from math import lgamma
+
+import numpy as np
+
+from utils import Dirichlet_batch
+from corpus import documents_csr
+
+"""
+Sparse backend for the Gibbs sampler in NB_with_Gibbs.py.
+
+The corpus is kept as a document-term matrix in CSR form: the words of document i are
+indices[indptr[i] : indptr[i+1]], with their counts in counts[indptr[i] : indptr[i+1]].
+The word counts of the classes are a C x V array and theta is a C x V array whose log is
+computed once per iteration, so the log-likelihood of every test document is a sparse dot
+product instead of a walk over its docdict.
+"""
+
+"""
+Build the CSR arrays from a list of corpus.Document
+@return (indptr, indices, counts)
+"""
+def build_csr(docset):
+    (indptr, indices, counts) = documents_csr(docset)
+    return (indptr, indices, counts.astype(np.float64)) # float, so dot products need no cast
+
+"""
+Sum @values (shape (..., nnz)) over every row of a CSR matrix described by @indptr
+Empty rows get 0, which np.add.reduceat alone does not handle.
+"""
+def segment_sum(values, indptr):
+    N = len(indptr) - 1
+    out = np.zeros(values.shape[:-1] + (N,))
+    nonempty = np.flatnonzero(indptr[1:] > indptr[:-1])
+    if len(nonempty) > 0:
+        out[..., nonempty] = np.add.reduceat(values, indptr[nonempty] - indptr[0], axis=-1)
+    return out
+
+"""
+Count words for each class
+@C number of classes
+@V size of vocabulary
+@return C x V array, word_count[c][index]
+"""
+def count_word_csr(csr, labels, C, V):
+    (indptr, indices, counts) = csr
+    token_labels = np.repeat(np.asarray(labels, dtype=np.int64), np.diff(indptr))
+    word_count = np.bincount(token_labels * V + indices, weights=counts, minlength=C * V)
+    return word_count.reshape(C, V)
+
+"""
+Expected word counts of the classes when document i is in class c with probability @weights[c][i]
+@weights C x N array
+@return C x V array
+"""
+def count_word_soft(csr, weights, V):
+    (indptr, indices, counts) = csr
+    lengths = np.diff(indptr)
+    word_count = np.empty((len(weights), V))
+    for c in range(len(weights)): # one class at a time: no C x nnz temporary
+        word_count[c] = np.bincount(indices, weights=counts * np.repeat(weights[c], lengths), minlength=V)
+    return word_count
+
+LIKELIHOOD_BLOCK = 4096 # documents scored together by doc_log_likelihood, so that their values stay in cache
+
+"""
+Log-likelihood of documents first..N-1 under each class: sum_w count_w * log(theta[c][w])
+@log_theta C x V array
+@csr counts may be int or float
+@return C x (N - first) array
+"""
+def doc_log_likelihood(log_theta, csr, first):
+    (indptr, indices, counts) = csr
+    N = len(indptr) - 1
+    ln_lik = np.empty((len(log_theta), N - first))
+    for block in range(first, N, LIKELIHOOD_BLOCK):
+        last = min(N, block + LIKELIHOOD_BLOCK)
+        (start, end) = (indptr[block], indptr[last])
+        terms = indices[start:end].astype(np.intp) # converted once rather than by every np.take
+        values = np.empty(len(terms))
+        for c in range(len(log_theta)): # one class at a time into the same buffer: no C x nnz temporary
+            np.take(log_theta[c], terms, out=values) # np.take is much faster than fancy indexing
+            values *= counts[start:end]
+            ln_lik[c, block - first : last - first] = segment_sum(values, indptr[block : last + 1])
+    return ln_lik
+
+"""
+One sweep over the test documents (index trainN..N-1), for any number of classes K
+Theta does not change inside a sweep, so the likelihoods of all test documents are computed
+up front and only the class prior is updated document by document.
+@class_count K array of document counts, updated in place
+@hyper_gamma K array, Dirichlet prior over the classes
+@return number of labels changed
+"""
+def sweep(labels, class_count, N, trainN, hyper_gamma, log_theta, csr, rng):
+    ln_lik = doc_log_likelihood(log_theta, csr, trainN).T # testN x K, one row per document
+    # log(class_count[c] + hyper_gamma[c] - 1), the shared normalizer of caculate_Pr cancels out
+    ln_prior = np.log(class_count + np.asarray(hyper_gamma) - 1.0)
+    testN = N - trainN
+    uniform = rng.random_sample(testN)
+    change_count = 0
+    for k in range(testN):
+        j = trainN + k
+        label = labels[j]
+        class_count[label] = class_count[label] - 1
+        ln_prior[label] = log(class_count[label] + hyper_gamma[label] - 1)
+
+        # log-sum-exp sampling over the K classes
+        ln_pr = ln_prior + ln_lik[k]
+        cumulative = np.cumsum(np.exp(ln_pr - ln_pr.max()))
+        new_label = cumulative.searchsorted(uniform[k] * cumulative[-1], side="right")
+
+        labels[j] = new_label
+        if label != new_label:
+            change_count = change_count + 1
+        class_count[new_label] = class_count[new_label] + 1
+        ln_prior[new_label] = log(class_count[new_label] + hyper_gamma[new_label] - 1)
+
+    return change_count
+
+"""
+Update theta, the word distribution for each class
+theta_c ~ Dirichlet(word_count[c] + hyper_multi)
+@return (theta, log_theta)
+"""
+def update_theta(word_count, hyper_multi, rng):
+    theta = Dirichlet_batch(word_count + hyper_multi, rng=rng) # all classes in one draw
+    return (theta, np.log(theta))
+
+"""
+Log-joint of the labels of the test documents and theta, up to a constant:
+log P(words | labels, theta) + log P(test labels) + log P(theta),
+where the class proportions are integrated out of P(test labels) as in sweep
+@word_count word counts of the classes under the labels of all documents
+@class_count number of test documents in each class
+@return float
+"""
+def log_joint(word_count, class_count, hyper_gamma, hyper_multi, log_theta):
+    loglik = (word_count * log_theta).sum()
+    log_prior = sum([lgamma(class_count[c] + hyper_gamma[c]) for c in range(len(class_count))])
+    return loglik + log_prior + ((hyper_multi - 1) * log_theta).sum()
+
+"""
+Expand the test documents (index first..N-1) token by token for the collapsed sampler
+A word with count x in a document gives x tokens with offsets 0..x-1, so that
+Gamma(n + beta + x) / Gamma(n + beta) = prod_k (n + beta + k) is a sum of logs over tokens.
+@return (exp_indptr, exp_terms, exp_shift), exp_shift = hyper_multi[term] + offset
+"""
+def build_expanded(csr, first, hyper_multi):
+    (indptr, indices, counts) = csr
+    start = indptr[first]
+    int_counts = counts[start:].astype(np.int64)
+    exp_terms = np.repeat(indices[start:], int_counts)
+    word_start = np.cumsum(int_counts) - int_counts # first token of every word
+    exp_offsets = np.arange(len(exp_terms)) - np.repeat(word_start, int_counts)
+    exp_indptr = np.concatenate([[0], np.cumsum(segment_sum(counts[start:], indptr[first:])).astype(np.int64)])
+    return (exp_indptr, exp_terms, hyper_multi[exp_terms] + exp_offsets)
+
+"""
+One sweep of the collapsed sampler: theta is integrated out and every test document is drawn
+from its Dirichlet-multinomial predictive given the other documents,
+Pr(c) ~ (class_count[c] + hyper_gamma[c] - 1)
+        * prod_w Gamma(word_count[c][w] + beta_w + x_w) / Gamma(word_count[c][w] + beta_w)
+        * Gamma(class_total[c] + B) / Gamma(class_total[c] + B + L), B = sum(beta)
+@word_count K x V array and @class_total K array of tokens per class, both updated in place
+@expanded output of build_expanded for the test documents
+@return number of labels changed
+"""
+def collapsed_sweep(labels, class_count, word_count, class_total, N, trainN, hyper_gamma, hyper_multi,
+                    csr, expanded, rng):
+    (indptr, indices, counts) = csr
+    (exp_indptr, exp_terms, exp_shift) = expanded
+    hyper_gamma = np.asarray(hyper_gamma)
+    testN = N - trainN
+    ramp = hyper_multi.sum() + np.arange(np.diff(exp_indptr).max() if testN > 0 else 0)
+    uniform = rng.random_sample(testN)
+    change_count = 0
+    for k in range(testN):
+        j = trainN + k
+        label = labels[j]
+        doc_indices = indices[indptr[j] : indptr[j+1]]
+        doc_counts = counts[indptr[j] : indptr[j+1]]
+        terms = exp_terms[exp_indptr[k] : exp_indptr[k+1]]
+        shift = exp_shift[exp_indptr[k] : exp_indptr[k+1]]
+        L = len(terms)
+        # remove document j
+        class_count[label] = class_count[label] - 1
+        word_count[label, doc_indices] -= doc_counts
+        class_total[label] = class_total[label] - L
+
+        ln_pr = np.log(class_count + hyper_gamma - 1.0)
+        ln_pr += np.log(word_count[:, terms] + shift).sum(axis=1)
+        ln_pr -= np.log(class_total[:, np.newaxis] + ramp[:L]).sum(axis=1)
+        cumulative = np.cumsum(np.exp(ln_pr - ln_pr.max()))
+        new_label = cumulative.searchsorted(uniform[k] * cumulative[-1], side="right")
+
+        # add document j with its new label
+        labels[j] = new_label
+        if label != new_label:
+            change_count = change_count + 1
+        class_count[new_label] = class_count[new_label] + 1
+        word_count[new_label, doc_indices] += doc_counts
+        class_total[new_label] = class_total[new_label] + L
+
+    return change_count
+
+"""
+Run a whole chain without per-iteration evaluation, starting from random test labels
+@train_labels labels of the training documents (index 0..trainN-1)
+@K number of classes, @V size of vocabulary
+@T number of iterations, @B number of burn-in iterations
+@seed seed of the chain's own random generator
+@collapsed use collapsed_sweep instead of sampling theta
+@return class_vote, K x testN array: class_vote[c][k] counts the iterations after burn-in
+        in which test document k was labelled c
+"""
+def run_chain(csr, train_labels, K, V, T, B, hyper_gamma, hyper_multi, seed, collapsed=False):
+    rng = np.random.RandomState(seed)
+    N = len(csr[0]) - 1
+    trainN = len(train_labels)
+    testN = N - trainN
+    labels = np.concatenate([train_labels, rng.randint(0, K, testN)])
+    # class_count counts the test documents only, as in NB_with_Gibbs.main
+    class_count = np.bincount(labels[trainN:], minlength=K)
+    word_count = count_word_csr(csr, labels, K, V)
+    if collapsed:
+        class_total = word_count.sum(axis=1)
+        expanded = build_expanded(csr, trainN, hyper_multi)
+    else:
+        (theta, log_theta) = update_theta(np.zeros((K, V)), hyper_multi, rng)
+    class_vote = np.zeros((K, testN), dtype=np.int64)
+    for i in range(T):
+        if collapsed:
+            collapsed_sweep(labels, class_count, word_count, class_total, N, trainN, hyper_gamma, hyper_multi,
+                            csr, expanded, rng)
+        else:
+            sweep(labels, class_count, N, trainN, hyper_gamma, log_theta, csr, rng)
+            word_count = count_word_csr(csr, labels, K, V)
+            (theta, log_theta) = update_theta(word_count, hyper_multi, rng)
+        if i >= B:
+            record_vote(class_vote, labels[trainN:])
+    return class_vote
+
+"""
+Add one vote per test document for its current label
+@class_vote K x testN array, updated in place
+"""
+def record_vote(class_vote, test_labels):
+    class_vote[test_labels, np.arange(len(test_labels))] += 1
@@ -4,15 +4,18 @@
 from random import gammavariate
 from random import random
 
+import numpy as np
+
 """
 Samples from a Dirichlet distribution with parameter @alpha using a Gamma distribution
-Reference: 
+Reference:
 http://en.wikipedia.org/wiki/Dirichlet_distribution
 http://stackoverflow.com/questions/3028571/non-uniform-distributed-random-array
 """
 def Dirichlet(alpha):
     sample = [gammavariate(a,1) for a in alpha]
-    sample = [v/sum(sample) for v in sample]
+    s = sum(sample)
+    sample = [v/s for v in sample]
     return sample
 
 """
@@ -27,13 +30,67 @@ def choose(vec, pr):
     for i in range(len(pr)):
         pr[i] = pr[i] * 1.0 / s
     r = random()
-    index = -1
-    while (r > 0):
+    for index in range(len(pr)):
         r = r - pr[index]
-        index = index + 1
-    return index
-    
-    
+        if r < 0:
+            return index
+    return len(pr) - 1 # only reached through rounding errors
+
+"""
+Vectorized version of Dirichlet: one gamma draw for the whole array, normalized once
+@alpha 1-d array for one distribution, or 2-d array with one row per class (or chain)
+@size draw @size independent samples, the result then has shape (size,) + alpha.shape
+@rng numpy RandomState, the global numpy generator by default
+@return array in which every row (last axis) sums to 1
+"""
+def Dirichlet_batch(alpha, size=None, rng=None):
+    if rng is None:
+        rng = np.random
+    alpha = np.asarray(alpha, dtype=np.float64)
+    if size is not None:
+        alpha = np.broadcast_to(alpha, (size,) + alpha.shape)
+    sample = rng.gamma(alpha)
+    sample /= sample.sum(axis=-1, keepdims=True)
+    return sample
+
+"""
+Vectorized version of choose for a batch of documents
+@ln_pr N x K array, row i holds the (unnormalized) log-probabilities of the K choices for item i
+@rng numpy RandomState, the global numpy generator by default
+@return array of N indices in 0..K-1
+"""
+def choose_batch(ln_pr, rng=None):
+    if rng is None:
+        rng = np.random
+    ln_pr = np.atleast_2d(ln_pr)
+    # log-sum-exp: shift by the row maximum before exponentiating
+    pr = np.exp(ln_pr - ln_pr.max(axis=1)[:, np.newaxis])
+    cumulative = np.cumsum(pr, axis=1)
+    r = rng.random_sample(len(ln_pr)) * cumulative[:, -1]
+    index = (cumulative <= r[:, np.newaxis]).sum(axis=1)
+    return np.minimum(index, ln_pr.shape[1] - 1)
+
+
 if __name__ == "__main__":
     # This is a test
     print Dirichlet([1,1,1]);
+    # compare the vectorized samplers with the scalar ones
+    n = 20000
+    alpha = [1, 2, 7]
+    mean = np.mean([Dirichlet(alpha) for i in range(n)], axis=0)
+    batch_mean = Dirichlet_batch(alpha, size=n).mean(axis=0)
+    expected = np.array(alpha) * 1.0 / sum(alpha)
+    print "Dirichlet mean:       " + str(mean)
+    print "Dirichlet_batch mean: " + str(batch_mean)
+    print "Expected:             " + str(expected)
+    assert(np.abs(mean - expected).max() < 0.01)
+    assert(np.abs(batch_mean - expected).max() < 0.01)
+
+    pr = [0.2, 0.5, 0.3]
+    freq = np.bincount([choose((0, 1, 2), list(pr)) for i in range(n)], minlength=3) * 1.0 / n
+    batch_freq = np.bincount(choose_batch(np.log(np.tile(pr, (n, 1)))), minlength=3) * 1.0 / n
+    print "choose frequencies:       " + str(freq)
+    print "choose_batch frequencies: " + str(batch_freq)
+    print "Expected:                 " + str(np.array(pr))
+    assert(np.abs(freq - pr).max() < 0.01)
+    assert(np.abs(batch_freq - pr).max() < 0.01)